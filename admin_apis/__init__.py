@@ -1,15 +1,21 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
 import psycopg2
 from flask import jsonify, request
+from psycopg2.errors import UniqueViolation
 from app import app
 from app import handle_exceptions
+from app import logger
+from app import facet_index
+from app import search_index
 
-from settings import set_connection, setup_logger
-
+from settings import set_connection, BULK_IMPORT_BATCH_SIZE
+from catalog_cache import invalidate
 
-from psycopg2.extras import execute_values
-from werkzeug.security import generate_password_hash
 
-logger = setup_logger('__name__', 'app.log')
 
 
 @app.route('/app/v1/products/create_product', methods=['POST'])
@@ -32,14 +38,23 @@ def create_product():
     tags = data.get('tags')
 
     cur, conn = set_connection()
-    cur.execute("""INSERT INTO Products (product_name, sku, description, price, discount_id, capacity, units,
-                   available_qty, featured, is_active, vendor_id, in_order, image_urls, tags)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                (product_name, sku, description, price, discount_id, capacity, units, available_qty, featured,
-                 is_active, vendor_id, in_order, image_urls, tags))
+    try:
+        cur.execute("""INSERT INTO Products (product_name, sku, description, price, discount_id, capacity, units,
+                       available_qty, featured, is_active, vendor_id, in_order, image_urls, tags)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING product_id""",
+                    (product_name, sku, description, price, discount_id, capacity, units, available_qty, featured,
+                     is_active, vendor_id, in_order, image_urls, tags))
+    except UniqueViolation:
+        # products_sku_key
+        conn.rollback()
+        return jsonify({'error': f'Product with sku {sku} already exists'}), 409
+    product_id = cur.fetchone()[0]
     conn.commit()
-    logger.debug(f"Created product {product_name} with ID {cur.lastrowid}")
-    return jsonify({'product_id': cur.lastrowid}), 201
+    invalidate('products')
+    facet_index.refresh_product(cur, product_id)
+    search_index.refresh_product(cur, product_id)
+    logger.debug("Created product %s with ID %s", product_name, product_id)
+    return jsonify({'product_id': product_id}), 201
 
 
 @app.route('/app/v1/products/update_product', methods=['PUT'])
@@ -67,12 +82,189 @@ def update_product():
     row = cur.fetchone()
     if not row:
         return jsonify({'error': f'Product with ID {product_id} does not exist'}), 404
-    cur.execute("""UPDATE Products SET product_name = %s, sku = %s, description = %s, price = %s,
-                   discount_id = %s, capacity = %s, units = %s, available_qty = %s, featured = %s, 
-                   is_active = %s, vendor_id = %s, in_order = %s, image_urls = %s, tags = %s,
-                   updated_at = NOW() WHERE product_id = %s;""",
-                (product_name, sku, description, price, discount_id, capacity, units, available_qty, featured,
-                 is_active, vendor_id, in_order, image_urls, tags, product_id))
+    try:
+        cur.execute("""UPDATE Products SET product_name = %s, sku = %s, description = %s, price = %s,
+                       discount_id = %s, capacity = %s, units = %s, available_qty = %s, featured = %s, 
+                       is_active = %s, vendor_id = %s, in_order = %s, image_urls = %s, tags = %s,
+                       updated_at = NOW() WHERE product_id = %s;""",
+                    (product_name, sku, description, price, discount_id, capacity, units, available_qty, featured,
+                     is_active, vendor_id, in_order, image_urls, tags, product_id))
+    except UniqueViolation:
+        conn.rollback()
+        return jsonify({'error': f'Product with sku {sku} already exists'}), 409
     conn.commit()
-    logger.debug(f"Updated product with ID {product_id}")
+    invalidate('products')
+    facet_index.refresh_product(cur, product_id)
+    search_index.refresh_product(cur, product_id)
+    logger.debug("Updated product with ID %s", product_id)
     return 'Updated product successfully', 200
+
+
+PRODUCT_COLUMNS = ('product_name', 'sku', 'description', 'price', 'discount_id', 'capacity', 'units',
+                   'available_qty', 'featured', 'is_active', 'vendor_id', 'in_order', 'image_urls', 'tags')
+ARRAY_COLUMNS = ('image_urls', 'tags')
+BOOLEAN_COLUMNS = ('featured', 'is_active')
+
+UPSERT_COLUMNS = ', '.join(PRODUCT_COLUMNS)
+UPSERT_ASSIGNMENTS = ', '.join(f'{column} = EXCLUDED.{column}' for column in PRODUCT_COLUMNS if column != 'sku')
+UPSERT_SQL = (f'INSERT INTO Products ({UPSERT_COLUMNS}) SELECT {UPSERT_COLUMNS} FROM products_staging ORDER BY line_no '
+              f'ON CONFLICT (sku) DO UPDATE SET {UPSERT_ASSIGNMENTS}, updated_at = NOW() '
+              f'RETURNING product_id, sku, (xmax = 0) AS inserted;')
+UPSERT_ROW_SQL = (f'INSERT INTO Products ({UPSERT_COLUMNS}) VALUES ({", ".join(["%s"] * len(PRODUCT_COLUMNS))}) '
+                  f'ON CONFLICT (sku) DO UPDATE SET {UPSERT_ASSIGNMENTS}, updated_at = NOW() '
+                  f'RETURNING product_id, sku, (xmax = 0) AS inserted;')
+
+
+def _ndjson_records(stream):
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'Expected a JSON object'
+            continue
+        yield line_no, record, None
+
+
+def _csv_records(stream):
+    # CSV needs a header row; image_urls and tags cells hold '|'-separated values
+    reader = csv.DictReader(stream)
+    for record in reader:
+        record = {key: value for key, value in record.items() if key is not None}
+        for column in ARRAY_COLUMNS:
+            if record.get(column):
+                record[column] = [value for value in record[column].split('|') if value]
+        yield reader.line_num, record, None
+
+
+def _parse_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('', 'null'):
+        return None
+    if text in ('1', 't', 'true', 'y', 'yes'):
+        return True
+    if text in ('0', 'f', 'false', 'n', 'no'):
+        return False
+    raise ValueError(f'Invalid boolean {value!r}')
+
+
+def _product_row(record):
+    sku = record.get('sku')
+    if not sku or not str(sku).strip():
+        raise ValueError('Missing sku')
+    if not record.get('product_name'):
+        raise ValueError('Missing product_name')
+    row = []
+    for column in PRODUCT_COLUMNS:
+        value = record.get(column)
+        if value == '':
+            value = None
+        if column == 'price' and value is not None:
+            try:
+                value = Decimal(str(value))
+            except InvalidOperation:
+                raise ValueError(f'Invalid price {value!r}')
+        elif column in BOOLEAN_COLUMNS:
+            value = _parse_bool(value)
+        elif column in ARRAY_COLUMNS and value is not None and not isinstance(value, list):
+            value = [value]
+        row.append(value)
+    row[1] = str(sku).strip()
+    return tuple(row)
+
+
+def _copy_value(value):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        # Postgres array literal with every element quoted
+        items = (str(item).replace('\\', '\\\\').replace('"', '\\"') for item in value)
+        return '{' + ','.join(f'"{item}"' for item in items) + '}'
+    return value
+
+
+def _flush_import_batch(cur, batch, result):
+    # batch maps sku -> (line_no, row); COPY it into staging and upsert the whole batch in one statement
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line_no, row in batch.values():
+        writer.writerow([line_no] + [_copy_value(value) for value in row])
+    buffer.seek(0)
+    cur.execute('SAVEPOINT bulk_batch;')
+    try:
+        cur.execute('TRUNCATE products_staging;')
+        cur.copy_expert(f'COPY products_staging (line_no, {UPSERT_COLUMNS}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cur.execute(UPSERT_SQL)
+        returned = cur.fetchall()
+        cur.execute('RELEASE SAVEPOINT bulk_batch;')
+    except psycopg2.Error:
+        # Something in the batch is rejected by the database; redo it row by row to find out which
+        cur.execute('ROLLBACK TO SAVEPOINT bulk_batch;')
+        returned = []
+        for line_no, row in batch.values():
+            cur.execute('SAVEPOINT bulk_row;')
+            try:
+                cur.execute(UPSERT_ROW_SQL, row)
+                returned.append(cur.fetchone())
+                cur.execute('RELEASE SAVEPOINT bulk_row;')
+            except psycopg2.Error as e:
+                cur.execute('ROLLBACK TO SAVEPOINT bulk_row;')
+                result['errors'].append({'line': line_no, 'sku': row[1], 'error': str(e).strip()})
+    for product_id, sku, inserted in returned:
+        result['inserted' if inserted else 'updated'].append(product_id)
+
+
+@app.route('/app/v1/products/bulk_import', methods=['POST'])
+@handle_exceptions
+def bulk_import_products():
+    # Streams NDJSON (application/x-ndjson) or CSV (text/csv) from the request body and upserts by sku.
+    # Only one batch of rows is held in memory at a time.
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        parse = _ndjson_records
+    elif request.mimetype in ('text/csv', 'application/csv'):
+        parse = _csv_records
+    else:
+        return jsonify({'error': f'Unsupported content type {request.mimetype}'}), 415
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+
+    cur, conn = set_connection()
+    cur.execute('CREATE TEMP TABLE products_staging ON COMMIT DROP AS '
+                f'SELECT 0 AS line_no, {UPSERT_COLUMNS} FROM Products WITH NO DATA;')
+    result = {'inserted': [], 'updated': [], 'errors': []}
+    batch = {}
+    rows = 0
+    for line_no, record, error in parse(stream):
+        rows += 1
+        if error is None:
+            try:
+                row = _product_row(record)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            result['errors'].append({'line': line_no, 'sku': (record or {}).get('sku'), 'error': error})
+            continue
+        if row[1] in batch:
+            # A sku can only be upserted once per statement; the later line wins
+            earlier = batch.pop(row[1])[0]
+            result['errors'].append({'line': earlier, 'sku': row[1], 'error': f'Superseded by line {line_no}'})
+        batch[row[1]] = (line_no, row)
+        if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+            _flush_import_batch(cur, batch, result)
+            batch = {}
+    if batch:
+        _flush_import_batch(cur, batch, result)
+    conn.commit()
+
+    if result['inserted'] or result['updated']:
+        invalidate('products')
+        facet_index.rebuild(cur)
+        search_index.rebuild(cur)
+    logger.debug("Bulk imported %s rows: %s inserted, %s updated, %s errors",
+                 rows, len(result['inserted']), len(result['updated']), len(result['errors']))
+    return jsonify(result), 200
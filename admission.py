@@ -0,0 +1,192 @@
+import collections
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    def __init__(self, route, reason, retry_after):
+        super().__init__(f"Request to {route} shed ({reason}), retry after {retry_after}s")
+        self.route = route
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PriorityClass:
+    def __init__(self, name, priority, share=1.0, max_queue=100, max_queue_time=0.5, target_latency=0.5):
+        self.name = name
+        self.priority = priority
+        self.share = share
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.target_latency = target_latency
+        self.waiting = collections.deque()
+        self.in_flight = 0
+        self.stats = {'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_timeout': 0,
+                      'queue_seconds_total': 0.0, 'slow': 0}
+
+
+class _Waiter:
+    __slots__ = ('route', 'ready', 'admitted')
+
+    def __init__(self, route):
+        self.route = route
+        self.ready = threading.Event()
+        self.admitted = False
+
+
+class Ticket:
+    __slots__ = ('route', 'cls', 'admitted_at')
+
+    def __init__(self, route, cls):
+        self.route = route
+        self.cls = cls
+        self.admitted_at = time.monotonic()
+
+
+class AdmissionController:
+    # Gives every request a slot under one concurrency limit before its handler runs. Routes belong to
+    # priority classes; a class may only fill its share of the limit, so lower classes are refused while
+    # there is still room for catalog reads, and route_limits caps single expensive routes on top of that.
+    # Requests that find no slot wait in their class's queue, at most max_queue of them and for at most
+    # max_queue_time seconds, and are then shed with Overloaded. Freed slots go to the highest priority class
+    # first, oldest waiter first. Every adjust_interval seconds the limit is cut by backoff when more than
+    # slow_ratio of the requests finished in that window ran past their class's target_latency, and raised by
+    # one when requests had to queue and latency was fine (AIMD), staying within min_limit..max_limit.
+    def __init__(self, classes, routes=None, route_limits=None, default_class='normal', exempt=(),
+                 initial_limit=20, min_limit=4, max_limit=64, adjust_interval=0.5, slow_ratio=0.1, backoff=0.9):
+        self.classes = {name: PriorityClass(name, **options) for name, options in classes.items()}
+        if default_class not in self.classes:
+            raise ValueError(f"Unknown default admission class {default_class!r}")
+        for route, name in (routes or {}).items():
+            if name not in self.classes:
+                raise ValueError(f"Route {route} uses unknown admission class {name!r}")
+        self._by_priority = sorted(self.classes.values(), key=lambda cls: cls.priority)
+        self.routes = dict(routes or {})
+        self.route_limits = dict(route_limits or {})
+        self.default_class = default_class
+        self.exempt = frozenset(exempt)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(initial_limit, max_limit))
+        self.adjust_interval = adjust_interval
+        self.slow_ratio = slow_ratio
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._route_in_flight = collections.Counter()
+        self._window_started = time.monotonic()
+        self._window_done = 0
+        self._window_slow = 0
+        self._window_queued = False
+        self._latency = None
+        self._stats = {'limit_increases': 0, 'limit_decreases': 0}
+
+    def class_for(self, route):
+        if route in self.exempt:
+            return None
+        return self.classes[self.routes.get(route, self.default_class)]
+
+    def _slots(self, cls):
+        return max(1, int(self.limit * cls.share))
+
+    def _can_admit(self, cls, route):
+        if self._in_flight >= self._slots(cls):
+            return False
+        route_limit = self.route_limits.get(route)
+        return route_limit is None or self._route_in_flight[route] < route_limit
+
+    def _admit(self, cls, route):
+        self._in_flight += 1
+        self._route_in_flight[route] += 1
+        cls.in_flight += 1
+        cls.stats['admitted'] += 1
+
+    def acquire(self, route):
+        # Returns a ticket to hand back to release(), None for exempt routes, or raises Overloaded
+        cls = self.class_for(route)
+        if cls is None:
+            return None
+        with self._lock:
+            ahead = any(c.waiting for c in self._by_priority if c.priority <= cls.priority)
+            if not ahead and self._can_admit(cls, route):
+                self._admit(cls, route)
+                return Ticket(route, cls)
+            # Only queueing behind the shared limit argues for raising it, not a route's own cap
+            if self._in_flight >= self._slots(cls):
+                self._window_queued = True
+            if len(cls.waiting) >= cls.max_queue:
+                cls.stats['shed_queue_full'] += 1
+                raise Overloaded(route, 'queue full', self._retry_after(cls))
+            waiter = _Waiter(route)
+            cls.waiting.append(waiter)
+            cls.stats['queued'] += 1
+            # Waiters ahead of it may be held back only by their own route's cap
+            self._dispatch()
+        started = time.monotonic()
+        waiter.ready.wait(cls.max_queue_time)
+        with self._lock:
+            cls.stats['queue_seconds_total'] += time.monotonic() - started
+            if not waiter.admitted:
+                cls.waiting.remove(waiter)
+                cls.stats['shed_timeout'] += 1
+                # Whoever queued behind this waiter for its route may fit now
+                self._dispatch()
+                raise Overloaded(route, 'queue timeout', self._retry_after(cls))
+        return Ticket(route, cls)
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+        elapsed = time.monotonic() - ticket.admitted_at
+        cls = ticket.cls
+        with self._lock:
+            self._in_flight -= 1
+            self._route_in_flight[ticket.route] -= 1
+            cls.in_flight -= 1
+            self._latency = elapsed if self._latency is None else self._latency * 0.9 + elapsed * 0.1
+            self._window_done += 1
+            if elapsed > cls.target_latency:
+                self._window_slow += 1
+                cls.stats['slow'] += 1
+            if time.monotonic() - self._window_started >= self.adjust_interval:
+                self._adjust()
+            self._dispatch()
+
+    def _adjust(self):
+        if self._window_done and self._window_slow > self._window_done * self.slow_ratio:
+            limit = max(self.min_limit, int(self.limit * self.backoff))
+            if limit < self.limit:
+                self._stats['limit_decreases'] += 1
+            self.limit = limit
+        elif self._window_queued and self.limit < self.max_limit:
+            self.limit += 1
+            self._stats['limit_increases'] += 1
+        self._window_started = time.monotonic()
+        self._window_done = self._window_slow = 0
+        self._window_queued = False
+
+    def _dispatch(self):
+        for cls in self._by_priority:
+            for waiter in list(cls.waiting):
+                if self._in_flight >= self.limit:
+                    return
+                if self._can_admit(cls, waiter.route):
+                    cls.waiting.remove(waiter)
+                    self._admit(cls, waiter.route)
+                    waiter.admitted = True
+                    waiter.ready.set()
+
+    def _retry_after(self, cls):
+        # Roughly how long the requests already queued in the class take to drain through their share
+        latency = self._latency if self._latency is not None else cls.target_latency
+        return max(1, math.ceil(latency * (len(cls.waiting) + 1) / self._slots(cls)))
+
+    def stats(self):
+        with self._lock:
+            classes = {cls.name: dict(cls.stats, in_flight=cls.in_flight, waiting=len(cls.waiting),
+                                      priority=cls.priority, slots=self._slots(cls))
+                       for cls in self._by_priority}
+            return dict(self._stats, limit=self.limit, min_limit=self.min_limit, max_limit=self.max_limit,
+                        in_flight=self._in_flight, latency_ewma=self._latency, classes=classes,
+                        routes={route: count for route, count in self._route_in_flight.items() if count})
@@ -1,131 +1,598 @@
-import psycopg2
-from flask import Flask, jsonify, request
-from werkzeug.security import generate_password_hash
+from functools import wraps
 
-from settings import set_connection, setup_logger
+import psycopg2
+from flask import Flask, Response, g, jsonify, request
+
+from settings import set_connection, setup_logger, release_connections, get_pool
+from settings import checkout_connection, release_connection, get_replica_router, prefers_replica
+from settings import pin_reads_to_primary, mark_read_only
+from settings import CATALOG_CACHE_TTL, CATALOG_CACHE_MAX_ENTRIES, CATALOG_CACHE_MAX_BYTES
+from settings import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_FETCH_SIZE, FACET_INDEX_TTL
+from settings import SEARCH_INDEX_TTL, SEARCH_RESULT_LIMIT, CATEGORY_TREE_TTL
+from settings import PASSWORD_HASH_METHOD, PASSWORD_HASH_SALT_LENGTH, PASSWORD_HASH_WORKERS
+from settings import PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_QUEUE_TIMEOUT, PASSWORD_HASH_TIMEOUT
+from settings import BATCH_MAX_REQUESTS, CACHE_CONTROL
+from settings import ADMISSION_ENABLED, ADMISSION_CLASSES, ADMISSION_ROUTES, ADMISSION_ROUTE_LIMITS, ADMISSION_EXEMPT
+from settings import ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT, ADMISSION_ADJUST_INTERVAL
+from settings import CATALOG_SNAPSHOT_PATH, CATALOG_SNAPSHOT_CHECK_INTERVAL
+from settings import SLOW_QUERY_THRESHOLD, SLOW_QUERY_EXPLAIN_INTERVAL, SLOW_QUERY_EXPLAIN_TIMEOUT
+from settings import SLOW_QUERY_MAX_PENDING, QUERY_LOG_MAX_ENTRIES
+from settings import RESERVATION_HOLD_SECONDS, RESERVATION_BATCH_WINDOW, RESERVATION_MAX_BATCH
+from settings import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_JSON_ENCODER
+from settings import RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY, RESPONSE_COMPRESS_MIN_SIZE
+from psycopg2.errors import UniqueViolation
 from psycopg2.extras import execute_values
+from catalog_cache import CatalogCache, invalidate, cache_stats, add_invalidation_listener
+from catalog_snapshot import SnapshotManager
+from response_cache import ResponseCache
+from conditional import version_etag, is_conditional, is_not_modified, add_validators, not_modified
+from facet_index import FacetIndex
+from search_index import SearchIndex
+from category_tree import CategoryTree
+from db_pool import PoolTimeout
+from password_hashing import PasswordHasher, HashingBusy
+from inventory import StockReserver, InsufficientStock, ProductNotFound, ReservationNotHeld
+from query_trace import QueryLog
+from projection import PRODUCT_FIELDS, CUSTOMER_FIELDS
+from admission import AdmissionController, Overloaded
+from statements import FILTER_SELECT, FILTER_COLUMNS, FILTER_JOINS, execute_prepared
+import metrics
+
+if __name__ == '__mp_main__':
+    # A spawned child re-importing `python app.py` would build a second pool, caches and log writer.
+    # PasswordHasher starts its workers with password_hashing as __main__, so this only trips on a regression.
+    raise RuntimeError("app.py must not be imported as a multiprocessing child's __main__")
 
 app = Flask(__name__)
+logger = setup_logger('__name__', 'app.log')
+catalog_cache = CatalogCache('catalog', ttl=CATALOG_CACHE_TTL, max_entries=CATALOG_CACHE_MAX_ENTRIES,
+                             max_bytes=CATALOG_CACHE_MAX_BYTES)
+response_cache = ResponseCache('responses', encoder=RESPONSE_JSON_ENCODER, gzip_level=RESPONSE_GZIP_LEVEL,
+                               brotli_quality=RESPONSE_BROTLI_QUALITY, min_compress_size=RESPONSE_COMPRESS_MIN_SIZE,
+                               ttl=CATALOG_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                               max_bytes=RESPONSE_CACHE_MAX_BYTES)
+facet_index = FacetIndex(ttl=FACET_INDEX_TTL)
+search_index = SearchIndex(ttl=SEARCH_INDEX_TTL)
+category_tree = CategoryTree(ttl=CATEGORY_TREE_TTL)
+password_hasher = PasswordHasher(workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING,
+                                 method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_HASH_SALT_LENGTH,
+                                 queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT, timeout=PASSWORD_HASH_TIMEOUT)
+# Stock shows up in cached product pages (the "detail" projection)
+stock_reserver = StockReserver(hold_seconds=RESERVATION_HOLD_SECONDS, batch_window=RESERVATION_BATCH_WINDOW,
+                               max_batch=RESERVATION_MAX_BATCH, on_change=lambda product_id: invalidate('products'))
+catalog_snapshot = None
+if CATALOG_SNAPSHOT_PATH:
+    # A newer snapshot from another worker makes this worker's cached catalog responses stale
+    catalog_snapshot = SnapshotManager(CATALOG_SNAPSHOT_PATH, checkout_connection, release_connection,
+                                       check_interval=CATALOG_SNAPSHOT_CHECK_INTERVAL,
+                                       on_swap=lambda: invalidate('products', 'categories', 'filters', notify=False))
+    add_invalidation_listener(lambda *tags: catalog_snapshot.request_rebuild())
+query_log = QueryLog(checkout_connection, release_connection,
+                     slow_threshold=SLOW_QUERY_THRESHOLD, explain_interval=SLOW_QUERY_EXPLAIN_INTERVAL,
+                     explain_timeout=SLOW_QUERY_EXPLAIN_TIMEOUT, max_pending=SLOW_QUERY_MAX_PENDING,
+                     max_entries=QUERY_LOG_MAX_ENTRIES, logger=logger)
+admission = None
+if ADMISSION_ENABLED:
+    admission = AdmissionController(ADMISSION_CLASSES, routes=ADMISSION_ROUTES, route_limits=ADMISSION_ROUTE_LIMITS,
+                                    exempt=ADMISSION_EXEMPT, initial_limit=ADMISSION_INITIAL_LIMIT,
+                                    min_limit=ADMISSION_MIN_LIMIT, max_limit=ADMISSION_MAX_LIMIT,
+                                    adjust_interval=ADMISSION_ADJUST_INTERVAL)
+metrics.init_app(app)
+metrics.registry.add_request_listener(query_log.record_request)
 
 
 def handle_exceptions(func):
+    @wraps(func)
     def wrapper(*args, **kwargs):
+        failed = False
         try:
             return func(*args, **kwargs)
+        except PoolTimeout:
+            failed = True
+            # Answered by pool_exhausted, which also covers routes without this decorator
+            raise
         except psycopg2.Error as e:
-            conn = kwargs.get('conn')
-            if conn:
-                conn.rollback()
+            failed = True
             logger.error(str(e))
             return jsonify({"error": "Database error"})
         except Exception as e:
+            failed = True
             logger.error(str(e))
             return jsonify({"error": "Internal server error"})
         finally:
-            conn = kwargs.get('conn')
-            cur = kwargs.get('cur')
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
+            # Hand the request's connections back to the pool, rolling back on error
+            release_connections(error=failed)
 
     return wrapper
 
 
-@app.route('/app/v1/filters/update_filter', methods=['PUT'])
-@handle_exceptions
-def update_filter():
-    data = request.get_json()
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(e):
+    logger.warning("No database connection for %s: %s", request.endpoint, e)
+    return jsonify({'error': 'Server is busy, please retry'}), 503, {'Retry-After': '1'}
+
+
+@app.teardown_request
+def release_db_connections(exc):
+    # Routes without handle_exceptions still return their connections here
+    release_connections(error=exc is not None)
+
+
+@app.before_request
+def admit_request():
+    # Registered after the metrics hooks, so shed requests are still counted, as 503s
+    if admission is None:
+        return None
+    try:
+        g._admission_ticket = admission.acquire(request.endpoint or 'unmatched')
+    except Overloaded as e:
+        return overloaded_response(e)
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    # A streamed body is written after this, so its slot is already free while it streams
+    if admission is not None:
+        admission.release(g.pop('_admission_ticket', None))
+
+
+app.after_request(pin_reads_to_primary)
+
+
+@app.after_request
+def set_cache_control(response):
+    policy = CACHE_CONTROL.get(request.endpoint)
+    if policy and request.method == 'GET' and response.status_code in (200, 304) \
+            and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = policy
+    return response
+
+
+def check_version(cur, statement, kind, key, variant=None):
+    # Answers a conditional GET from the row's updated_at alone, before the full row is read.
+    # Returns a 404 or 304 response, or None when the caller should go on and build the body.
+    if not is_conditional(request):
+        return None
+    execute_prepared(cur, statement, (key,))
+    version = cur.fetchone()
+    if version is None:
+        return jsonify({'error': f'{kind.capitalize()} with ID {key} does not exist'}), 404
+    etag = version_etag(kind, key, version[0], variant)
+    if is_not_modified(request, etag, version[0]):
+        return not_modified(etag, version[0])
+    return None
+
+
+def requested_fields(projection, default, rename=None):
+    # ?fields= on the query string, or "fields" in the JSON body of endpoints that take one
+    value = request.args.get('fields')
+    if value is None:
+        value = (request.get_json(silent=True) or {}).get('fields')
+    return projection.parse(value, default, rename)
+
+
+def search_limit(value):
+    # search_products' "limit", capped at SEARCH_RESULT_LIMIT; ValueError unless it is a positive integer
+    if not value:
+        return SEARCH_RESULT_LIMIT
+    try:
+        limit = int(value) if isinstance(value, (int, str)) and not isinstance(value, bool) else None
+    except ValueError:
+        limit = None
+    if limit is None or limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, SEARCH_RESULT_LIMIT)
+
+
+def get_page_args():
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def current_snapshot():
+    return catalog_snapshot.current() if catalog_snapshot is not None else None
+
+
+def primary_cursor():
+    # Whatever goes into a process-wide cache or index is loaded from the primary. Right after a write
+    # invalidates it, a replica that is still behind would refill it with the rows from before the write,
+    # and every client, the writer pinned to the primary included, would get those until the TTL runs out.
+    cur, conn = set_connection(readonly=False)
+    return cur
+
+
+def get_category_tree_loaded():
+    if category_tree.is_stale():
+        category_tree.rebuild(primary_cursor())
+    return category_tree
+
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def wants_full_list():
+    # Clients that send neither after nor limit get every row, as before keyset pagination; it is streamed
+    return 'after' not in request.args and 'limit' not in request.args
+
+
+def fetch_page(cur, sql, key_column, after, limit):
+    # Keyset pagination: rows strictly after the last seen key, one extra row tells us there is more
+    params = []
+    if after is not None:
+        sql += f' WHERE {key_column} > %s'
+        params.append(after)
+    sql += f' ORDER BY {key_column} LIMIT %s;'
+    params.append(limit + 1)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1][0] if has_more else None
+    return rows, next_cursor
+
+
+def stream_rows(sql, key_column, after, build, prefix='[', suffix=']'):
+    # Streams a JSON array from a server-side cursor so memory stays flat regardless of table size.
+    # The generator owns its connection because it runs after the view function has returned.
+    params = []
+    if after is not None:
+        sql += f' WHERE {key_column} > %s'
+        params.append(after)
+    sql += f' ORDER BY {key_column};'
+    readonly = prefers_replica()
+
+    def generate():
+        conn = checkout_connection(readonly=readonly)
+        failed = False
+        try:
+            cur = conn.cursor(name='stream_rows')
+            cur.itersize = STREAM_FETCH_SIZE
+            cur.execute(sql, params)
+            yield prefix
+            first = True
+            while True:
+                rows = cur.fetchmany(STREAM_FETCH_SIZE)
+                if not rows:
+                    break
+                chunk = ','.join(app.json.dumps(build(row)) for row in rows)
+                yield chunk if first else ',' + chunk
+                first = False
+            yield suffix
+            cur.close()
+        except Exception as e:
+            failed = True
+            logger.error(str(e))
+            raise
+        finally:
+            release_connection(conn, error=failed)
+
+    return Response(generate(), mimetype='application/json')
+
+
+# get_product and filter_products answer with id/name rather than product_id/product_name
+SHORT_PRODUCT_KEYS = {'product_id': 'id', 'product_name': 'name'}
+FILTERED_PRODUCT_FIELDS = ('product_id', 'product_name', 'description', 'price', 'featured')
+
+
+def product_from_row(row):
+    return {
+        'product_id': row[0],
+        'product_name': row[1],
+        'description': row[2],
+        'price': row[3],
+        'image_urls': row[4]
+    }
+
+
+def customer_from_row(row):
+    return {
+        'customer_id': row[0],
+        'customer_fname': row[1],
+        'customer_lname': row[2],
+        'email': row[3],
+        'phone_number': row[4],
+        'address': row[5],
+        'points_balance': row[6],
+        'points_redeemed': row[7]
+    }
+
+
+def collect_pool_metrics():
+    stats = get_pool().stats()
+    return [
+        ('db_pool_connections', 'gauge', 'Pooled database connections by state',
+         [({'state': 'in_use'}, stats['in_use']), ({'state': 'idle'}, stats['idle'])]),
+        ('db_pool_checkouts_total', 'counter', 'Connections checked out of the pool', [({}, stats['checkouts'])]),
+        ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection',
+         [({}, stats['wait_time_total'])]),
+        ('db_pool_timeouts_total', 'counter', 'Checkouts that timed out', [({}, stats['timeouts'])]),
+    ]
+
+
+def collect_cache_metrics():
+    samples = {'hits': [], 'misses': [], 'evictions': []}
+    for name, stats in cache_stats().items():
+        for key in samples:
+            samples[key].append(({'cache': name}, stats[key]))
+    return [(f'cache_{key}_total', 'counter', f'Cache {key}', values) for key, values in samples.items()]
+
+
+def collect_hashing_metrics():
+    stats = password_hasher.stats()
+    return [
+        ('password_hash_pending', 'gauge', 'Password hashes queued or running', [({}, stats['pending'])]),
+        ('password_hash_total', 'counter', 'Password hashes by outcome',
+         [({'outcome': 'hashed'}, stats['hashed']), ({'outcome': 'rejected'}, stats['rejected']),
+          ({'outcome': 'failed'}, stats['failed'])]),
+        ('password_hash_seconds_total', 'counter', 'Time from submit to hash result',
+         [({}, stats['hash_seconds_total'])]),
+    ]
+
+
+def collect_reservation_metrics():
+    stats = stock_reserver.stats()
+    return [
+        ('stock_reservation_queued', 'gauge', 'Reservation calls waiting for their batch', [({}, stats['queued'])]),
+        ('stock_reservation_batches_total', 'counter', 'Reservation batches applied', [({}, stats['batches'])]),
+        ('stock_reservation_ops_total', 'counter', 'Reservation calls by outcome',
+         [({'outcome': key}, stats[key]) for key in ('reserved', 'rejected', 'confirmed', 'released', 'expired')]),
+    ]
+
+
+def collect_replica_metrics():
+    replicas = get_replica_router().stats()['replicas']
+    return [
+        ('db_replica_lag_seconds', 'gauge', 'Replication lag at the last check',
+         [({'replica': name}, stats['lag']) for name, stats in replicas.items() if stats['lag'] is not None]),
+        ('db_replica_healthy', 'gauge', 'Whether the replica currently takes reads',
+         [({'replica': name}, int(stats['healthy'])) for name, stats in replicas.items()]),
+        ('db_replica_selected_total', 'counter', 'Read checkouts routed to the replica',
+         [({'replica': name}, stats['selected']) for name, stats in replicas.items()]),
+    ]
+
+
+def collect_admission_metrics():
+    if admission is None:
+        return []
+    stats = admission.stats()
+    classes = stats['classes']
+    return [
+        ('admission_limit', 'gauge', 'Current adaptive concurrency limit', [({}, stats['limit'])]),
+        ('admission_in_flight', 'gauge', 'Admitted requests still running, by class',
+         [({'class': name}, c['in_flight']) for name, c in classes.items()]),
+        ('admission_waiting', 'gauge', 'Requests queued for a slot, by class',
+         [({'class': name}, c['waiting']) for name, c in classes.items()]),
+        ('admission_requests_total', 'counter', 'Admission decisions by class and outcome',
+         [({'class': name, 'outcome': key}, c[key]) for name, c in classes.items()
+          for key in ('admitted', 'shed_queue_full', 'shed_timeout')]),
+        ('admission_queue_seconds_total', 'counter', 'Time requests spent queued for a slot',
+         [({'class': name}, c['queue_seconds_total']) for name, c in classes.items()]),
+    ]
+
+
+def overloaded_response(e):
+    logger.warning("Shedding %s (%s), asking client to retry after %ss", e.route, e.reason, e.retry_after)
+    return jsonify({'error': 'Server is busy, please retry'}), 503, {'Retry-After': str(e.retry_after)}
+
+
+def hashing_busy_response(e):
+    logger.warning("Password hashing saturated, asking client to retry after %ss", e.retry_after)
+    return jsonify({'error': 'Too many requests in progress, please retry'}), 503, {'Retry-After': str(e.retry_after)}
+
+
+metrics.registry.register_collector(collect_pool_metrics)
+metrics.registry.register_collector(collect_cache_metrics)
+metrics.registry.register_collector(collect_hashing_metrics)
+metrics.registry.register_collector(collect_reservation_metrics)
+metrics.registry.register_collector(collect_replica_metrics)
+metrics.registry.register_collector(collect_admission_metrics)
+
+
+@app.route('/app/v1/pool/stats', methods=['GET'])
+def get_pool_stats():
+    return jsonify(get_pool().stats()), 200
+
+
+@app.route('/app/v1/pool/replicas', methods=['GET'])
+def get_replica_stats():
+    return jsonify(get_replica_router().stats()), 200
+
+
+@app.route('/app/v1/admission/stats', methods=['GET'])
+def get_admission_stats():
+    if admission is None:
+        return jsonify({'error': 'Admission control is not enabled'}), 404
+    return jsonify(admission.stats()), 200
+
+
+@app.route('/app/v1/catalog/snapshot', methods=['GET'])
+def get_snapshot_stats():
+    if catalog_snapshot is None:
+        return jsonify({'error': 'Catalog snapshot is not enabled'}), 404
+    return jsonify(catalog_snapshot.stats()), 200
+
+
+# Worst statements seen so far: ?limit=20&endpoint=filter_products&sort=total|max|mean|calls
+@app.route('/app/v1/queries/top', methods=['GET'])
+def get_top_queries():
+    limit = max(1, min(request.args.get('limit', 20, type=int), 500))
+    try:
+        queries = query_log.top(limit, endpoint=request.args.get('endpoint'),
+                                sort=request.args.get('sort', 'total'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'queries': queries, 'stats': query_log.stats()}), 200
+
+
+@app.route('/app/v1/queries/reset', methods=['POST'])
+def reset_query_log():
+    query_log.reset()
+    return 'Query log reset', 200
+
+
+@app.route('/app/v1/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_stats()), 200
+
+
+# Updates a filter and brings its options in line with the requested list in one statement: options that are
+# no longer wanted are deleted, new ones inserted, and existing ones keep their option_id. With replace false
+# the options are left alone. Nothing is written when the filter does not exist, and then no row comes back.
+FILTER_UPDATE_SQL = """
+WITH f AS (
+    UPDATE Filter SET filter_name = %(filter_name)s, filter_type = %(filter_type)s, category_id = %(category_id)s
+    WHERE filter_id = %(filter_id)s
+    RETURNING filter_id, filter_name, category_id, filter_type
+), removed AS (
+    DELETE FROM FilterOption fo
+    WHERE %(replace)s AND fo.filter_id = %(filter_id)s AND fo.option_value <> ALL(%(options)s::text[])
+      AND EXISTS (SELECT 1 FROM f)
+    RETURNING fo.option_id
+), added AS (
+    INSERT INTO FilterOption (filter_id, option_value)
+    SELECT %(filter_id)s, wanted.option_value FROM unnest(%(options)s::text[]) AS wanted(option_value)
+    WHERE EXISTS (SELECT 1 FROM f)
+      AND NOT EXISTS (SELECT 1 FROM FilterOption fo
+                      WHERE fo.filter_id = %(filter_id)s AND fo.option_value = wanted.option_value)
+    RETURNING option_id, option_value
+), kept AS (
+    SELECT option_id, option_value FROM FilterOption
+    WHERE filter_id = %(filter_id)s AND (NOT %(replace)s OR option_value = ANY(%(options)s::text[]))
+)
+SELECT f.filter_id, f.filter_name, f.category_id, c.category_name, f.filter_type,
+       (SELECT COALESCE(json_agg(json_build_object('option_id', o.option_id, 'option_value', o.option_value)
+                                 ORDER BY o.option_id), '[]')
+        FROM (SELECT option_id, option_value FROM kept UNION ALL SELECT option_id, option_value FROM added) o),
+       (SELECT count(*) FROM added), (SELECT count(*) FROM removed)
+FROM f LEFT JOIN Category c ON c.category_id = f.category_id;
+"""
+
+
+def filter_update_params(data):
+    # Validates one update_filter payload; returns (params, category_name) or raises ValueError
     filter_id = data.get('filter_id')
     filter_name = data.get('filter_name')
-    category_name = data.get('category_name')
     filter_type = data.get('filter_type')
-    options = data.get('options')
     if not all([filter_id, filter_name, filter_type]):
-        return jsonify({'error': 'Missing required fields'}), 400
-    cur, conn = set_connection()
-    cur.execute('SELECT * FROM Filter WHERE filter_id = %s;', (filter_id,))
+        raise ValueError('Missing required fields')
+    options = data.get('options')
+    if options is not None and not isinstance(options, list):
+        raise ValueError('options must be a list')
+    # Duplicates collapse to one option; the order of first appearance is kept
+    options = list(dict.fromkeys(str(option) for option in options if option is not None)) \
+        if options is not None else None
+    params = {'filter_id': filter_id, 'filter_name': filter_name, 'filter_type': filter_type,
+              'category_id': None, 'replace': options is not None, 'options': options or []}
+    return params, data.get('category_name')
+
+
+def apply_filter_update(cur, params):
+    # Returns the updated filter, or None when it does not exist
+    cur.execute(FILTER_UPDATE_SQL, params)
     row = cur.fetchone()
-    if not row:
-        return jsonify({'error': f'Filter with ID {filter_id} does not exist'}), 404
+    if row is None:
+        return None
+    logger.debug("Updated filter with ID %s: %s options added, %s removed", row[0], row[6], row[7])
+    return filter_from_row(row)
+
+
+@app.route('/app/v1/filters/update_filter', methods=['PUT'])
+@handle_exceptions
+def update_filter():
+    try:
+        params, category_name = filter_update_params(request.get_json())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    filter_id = params['filter_id']
+    cur, conn = set_connection()
     # Get category_id for the given category_name
-    cur.execute('SELECT category_id FROM Category WHERE category_name = %s', (category_name,))
+    execute_prepared(cur, 'live_category_id_by_name', (category_name,))
     category_row = cur.fetchone()
     if not category_row:
         return jsonify({'error': f'Category with name {category_name} does not exist'}), 404
-    category_id = category_row[0]
-    cur.execute(
-        'UPDATE Filter SET filter_name=%s, filter_type=%s, category_id=%s WHERE filter_id=%s;',
-        (filter_name, filter_type, category_id, filter_id))
-    cur.execute('DELETE FROM FilterOption WHERE filter_id=%s;', (filter_id,))
-    cur.executemany('INSERT INTO FilterOption(filter_id, option_value) VALUES(%s, %s);',
-                    [(filter_id, option) for option in options])
+    params['category_id'] = category_row[0]
+    filter_data = apply_filter_update(cur, params)
+    if filter_data is None:
+        return jsonify({'error': f'Filter with ID {filter_id} does not exist'}), 404
     conn.commit()
-    cur.execute('SELECT Filter.filter_id, filter_name, category_id, category_name, filter_type, '
-                'array_agg(option_value) FROM Filter '
-                'JOIN Category ON Filter.category_id = Category.category_id '
-                'LEFT JOIN FilterOption ON Filter.filter_id = FilterOption.filter_id '
-                'WHERE Filter.filter_id = %s GROUP BY Filter.filter_id, filter_name, category_id, category_name, filter_type;',
-                (filter_id,))
-    row = cur.fetchone()
-    # if not row:
-    #
-
-    filter_data = {
-        'filter_id': row[0],
-        'filter_name': row[1],
-        'category_id': row[2],
-        'category_name': row[3],
-        'filter_type': row[4],
-        'options': row[5]
-    }
-    logger.debug(f"Updated filter with ID {filter_id}")
+    invalidate('filters')
+    facet_index.refresh_filter(cur, filter_id)
     return jsonify({'filter': filter_data}), 200
 
 
+# API endpoint for updating many filters in one transaction: {"filters": [<update_filter payload>, ...]}.
+# Either every filter is updated or, on the first error, none is.
+@app.route('/app/v1/filters/bulk_update_filters', methods=['PUT'])
+@handle_exceptions
+def bulk_update_filters():
+    payloads = (request.get_json() or {}).get('filters')
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({'error': 'Missing filters list'}), 400
+    updates = []
+    for index, data in enumerate(payloads):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError('Expected an object')
+            updates.append(filter_update_params(data))
+        except ValueError as e:
+            return jsonify({'error': str(e), 'index': index}), 400
+
+    cur, conn = set_connection()
+    # Resolve every category name in one query
+    category_names = list({category_name for _, category_name in updates})
+    cur.execute('SELECT category_name, category_id FROM Category WHERE category_name = ANY(%s) AND deleted_at IS NULL;',
+                (category_names,))
+    category_ids = dict(cur.fetchall())
+    filters = []
+    for index, (params, category_name) in enumerate(updates):
+        if category_name not in category_ids:
+            conn.rollback()
+            return jsonify({'error': f'Category with name {category_name} does not exist', 'index': index}), 404
+        params['category_id'] = category_ids[category_name]
+        filter_data = apply_filter_update(cur, params)
+        if filter_data is None:
+            conn.rollback()
+            return jsonify({'error': f"Filter with ID {params['filter_id']} does not exist", 'index': index}), 404
+        filters.append(filter_data)
+    conn.commit()
+    invalidate('filters')
+    for filter_id in {params['filter_id'] for params, _ in updates}:
+        facet_index.refresh_filter(cur, filter_id)
+    logger.debug("Bulk updated %s filters", len(filters))
+    return jsonify({'filters': filters}), 200
+
+
 @app.route('/app/v1/products/filter_products', methods=['GET'])
 @handle_exceptions
 def filter_products():
     data = request.get_json()
     category_id = data.get('category')
-    filter_options = data.get('filter_options')
+    filter_options = data.get('filter_options') or []
+    with_counts = bool(data.get('with_counts'))
+    try:
+        fields = requested_fields(PRODUCT_FIELDS, FILTERED_PRODUCT_FIELDS, rename=SHORT_PRODUCT_KEYS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if facet_index.is_stale():
+        facet_index.rebuild(primary_cursor())
+    category_ids = [category_id]
+    if data.get('include_subcategories'):
+        category_ids = get_category_tree_loaded().descendants(category_id) or category_ids
+
+    # Resolve the facets in memory, then fetch the matching products in one query
+    product_ids, counts = facet_index.search(category_ids, filter_options, with_counts=with_counts)
     cur, conn = set_connection()
-
-    # Construct the SQL query
-    sql = "select p.* from products p inner join product_category pc on p.product_id = pc.product_id where pc.category_id = %s "
-    params = [category_id]
-
-    for option_value in filter_options:
-        cur.execute(
-            "select fo.option_id, fo.filter_id from filteroption fo inner join filter_category fc on fo.filter_id = fc.filter_id where fo.option_value = %s and fc.category_id = %s ",
-            (option_value, category_id))
-        row = cur.fetchone()
-        if row is not None:
-            option_id = row[0]
-            filter_id = row[1]
-            sql += "and exists (select 1 from filteroption fo inner join filter_category fc on fo.filter_id = fc.filter_id where fo.option_id = %s and fc.category_id = %s and fo.filter_id = %s) "
-            params.append(option_id)
-            params.append(category_id)
-            params.append(filter_id)
-
-    cur.execute(sql, params)
-
-    # Construct the response as a JSON array
-    products = []
-    for row in cur:
-        product = {
-            'id': row[0],
-            'name': row[1],
-            'description': row[3],
-            'price': str(row[4]),
-            'featured': row[9]
-        }
-        products.append(product)
-
-    conn.close()
-
-    logger.debug(
-        f"Retrieved {len(products)} products from the database with filter options {filter_options} for category {category_id}")
+    cur.execute(PRODUCT_FIELDS.select(fields) + ' WHERE product_id = any(%s) ORDER BY product_id;', (product_ids,))
+    build = PRODUCT_FIELDS.builder(fields, SHORT_PRODUCT_KEYS)
+    products = [build(row) for row in cur]
+
+    logger.debug("Retrieved %s products from the database with filter options %s for category %s",
+                 len(products), filter_options, category_id)
+    if with_counts:
+        return jsonify({'products': products, 'facets': counts})
     return jsonify(products)
 
 
@@ -134,69 +601,116 @@ def filter_products():
 @app.route('/app/v1/products/get_products', methods=['GET'])
 @handle_exceptions
 def get_products():
+    after, limit = get_page_args()
+    try:
+        fields = requested_fields(PRODUCT_FIELDS, 'list')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sql = PRODUCT_FIELDS.select(fields)
+    build = PRODUCT_FIELDS.builder(fields)
+    if wants_stream() or wants_full_list():
+        logger.debug("Streaming products after %s", after)
+        return stream_rows(sql, 'product_id', after, build, prefix='{"products":[', suffix=']}')
+
+    def load():
+        snapshot = current_snapshot()
+        if snapshot is not None and snapshot.has_product_fields(fields):
+            products, next_cursor = snapshot.products_page(after, limit, fields)
+            return {'products': products, 'next_cursor': next_cursor}
+        rows, next_cursor = fetch_page(primary_cursor(), sql, 'product_id', after, limit)
+        return {'products': [build(row) for row in rows], 'next_cursor': next_cursor}
+
+    entry = response_cache.get_or_build(('get_products', after, limit, fields), load, tags=('products',))
+    logger.debug("Served products page after %s", after)
+    return response_cache.respond(entry, request)
+
+
+# API endpoint for products in a category, including its subcategories unless ?include_descendants=0
+@app.route('/app/v1/products/get_category_products', methods=['GET'])
+@handle_exceptions
+def get_category_products():
+    category_id = request.args.get('category_id', type=int)
+    after, limit = get_page_args()
+    tree = get_category_tree_loaded()
+    if category_id not in tree:
+        return jsonify({'error': f'Category with ID {category_id} not found'}), 404
+    if request.args.get('include_descendants', '1').lower() in ('0', 'false', 'no'):
+        category_ids = [category_id]
+    else:
+        category_ids = tree.descendants(category_id)
+
+    # One indexed query over product_category for the whole subtree
+    sql = ('select product_id, product_name, description, price, image_urls from products p '
+           'where exists (select 1 from product_category pc where pc.product_id = p.product_id '
+           'and pc.category_id = any(%s))')
+    params = [category_ids]
+    if after is not None:
+        sql += ' and p.product_id > %s'
+        params.append(after)
+    sql += ' order by p.product_id limit %s;'
+    params.append(limit + 1)
     cur, conn = set_connection()
-    cur.execute('select product_id, product_name, description, price, image_urls from products;')
+    cur.execute(sql, params)
     rows = cur.fetchall()
-    products = []
-    for row in rows:
-        product = {
-            'product_id': row[0],
-            'product_name': row[1],
-            'description': row[2],
-            'price': row[3],
-            'image_urls': row[4]
-        }
-        products.append(product)
-
-    logger.debug(f"Retrieved {len(products)} products from the database")
-    return jsonify({'products': products})
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    products = [product_from_row(row) for row in rows[:limit]]
+    logger.debug("Retrieved %s products for %s categories under %s", len(products), len(category_ids), category_id)
+    return jsonify({'products': products, 'next_cursor': next_cursor})
 
 
 @app.route('/app/v1/products/get_product', methods=['GET'])
 @handle_exceptions
 def get_product():
     product_id = request.json.get('product_id')
+    try:
+        fields = requested_fields(PRODUCT_FIELDS, 'list', rename=SHORT_PRODUCT_KEYS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    variant = PRODUCT_FIELDS.variant(fields, 'list')
     cur, conn = set_connection()
-    cur.execute('select product_id, product_name, description, price, image_urls from products WHERE id = %s;',
-                (product_id,))
+    unchanged = check_version(cur, 'product_updated_at', 'product', product_id, variant)
+    if unchanged is not None:
+        return unchanged
+    if variant is None:
+        execute_prepared(cur, 'product_by_id', (product_id,))
+    else:
+        # updated_at comes last for the validators
+        cur.execute(PRODUCT_FIELDS.select(fields + ('updated_at',)) + ' WHERE product_id = %s;', (product_id,))
     row = cur.fetchone()
-    product = {
-        'id': row[0],
-        'name': row[1],
-        'description': row[2],
-        'price': row[3],
-        'image_urls': row[4]
-    }
+    if row is None:
+        return jsonify({'error': f'Product with ID {product_id} does not exist'}), 404
+    product = PRODUCT_FIELDS.builder(fields, SHORT_PRODUCT_KEYS)(row)
 
-    logger.debug(f"Retrieved product with id {product_id} from the database")
-    return jsonify({'product': product})
+    logger.debug("Retrieved product with id %s from the database", product_id)
+    return add_validators(jsonify({'product': product}), version_etag('product', row[0], row[-1], variant), row[-1])
 
 
 @app.route('/app/v1/products/search_products', methods=['GET'])
 @handle_exceptions
 def search_products():
     query = request.json.get('query')
+    try:
+        limit = search_limit(request.json.get('limit'))
+        fields = requested_fields(PRODUCT_FIELDS, 'list')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if search_index.is_stale():
+        search_index.rebuild(primary_cursor())
+
+    # Rank in memory, then fetch only the rows that made the cut
+    ranked = search_index.search(query, limit=limit)
     cur, conn = set_connection()
-    # Construct the SQL query
-    sql = "select product_id, product_name, description, price, image_urls from products where product_name ilike %s or description ilike %s;"
-    params = [f"%{query}%", f"%{query}%"]
-    cur.execute(sql, params)
-    # Construct the response as a JSON array
+    cur.execute(PRODUCT_FIELDS.select(fields) + ' WHERE product_id = any(%s);',
+                ([product_id for product_id, _ in ranked],))
+    rows = {row[0]: row for row in cur.fetchall()}
+    build = PRODUCT_FIELDS.builder(fields)
     products = []
-    for row in cur:
-        product = {
-            'product_id': row[0],
-            'product_name': row[1],
-            'description': row[2],
-            'price': row[3],
-            'image_urls': row[4]
-        }
-        products.append(product)
-
-    conn.close()
+    for product_id, score in ranked:
+        if product_id in rows:
+            products.append(build(rows[product_id]))
 
     # Log the number of matching products
-    logger.debug(f"Found {len(products)} products matching query '{query}'")
+    logger.debug("Found %s products matching query '%s'", len(products), query)
 
     return jsonify({'products': products})
 
@@ -204,42 +718,74 @@ def search_products():
 @app.route('/app/v1/products/get_featured_products', methods=['GET'])
 @handle_exceptions
 def get_featured_products():
-    cur, conn = set_connection()
-    cur.execute('select product_id, product_name, description, price, image_urls from products where featured = true;')
-    rows = cur.fetchall()
-    products = []
-    for row in rows:
-        product = {
-            'product_id': row[0],
-            'product_name': row[1],
-            'description': row[2],
-            'price': row[3],
-            'image_urls': row[4]
-        }
-        products.append(product)
-
-    logger.debug(f"Retrieved {len(products)} featured products from the database")
-    return jsonify({'products': products})
+    def load():
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            return {'products': snapshot.featured_products()}
+        cur = primary_cursor()
+        cur.execute('select product_id, product_name, description, price, image_urls from products where featured = true;')
+        rows = cur.fetchall()
+        products = []
+        for row in rows:
+            product = {
+                'product_id': row[0],
+                'product_name': row[1],
+                'description': row[2],
+                'price': row[3],
+                'image_urls': row[4]
+            }
+            products.append(product)
+        return {'products': products}
+
+    entry = response_cache.get_or_build(('get_featured_products',), load, tags=('products',))
+    logger.debug("Served featured products")
+    return response_cache.respond(entry, request)
+
+
+def filter_from_row(row):
+    return {
+        'filter_id': row[0],
+        'filter_name': row[1],
+        'category_id': row[2],
+        'category_name': row[3],
+        'filter_type': row[4],
+        'options': row[5]
+    }
 
 
-# API endpoint for getting all filters
+def load_filters(cur, filter_id=None, category_id=None):
+    # Loads filters with their options in one grouped query instead of one FilterOption query per filter
+    if filter_id is not None:
+        execute_prepared(cur, 'filter_with_options', (filter_id,))
+    else:
+        sql = FILTER_SELECT
+        params = []
+        if category_id is not None:
+            # A union of ids rather than OR-ing a subquery, so both sides are index lookups
+            sql += ("WHERE f.filter_id IN (SELECT filter_id FROM Filter WHERE category_id = %s "
+                    "UNION SELECT filter_id FROM filter_category WHERE category_id = %s) ")
+            params.extend([category_id, category_id])
+        sql += "GROUP BY f.filter_id, c.category_name ORDER BY f.filter_id;"
+        cur.execute(sql, params)
+    return [filter_from_row(row) for row in cur.fetchall()]
+
+
+# API endpoint for getting all filters, or only those of one category with ?category_id=
 @app.route('/app/v1/filters/get_filters', methods=['GET'])
 @handle_exceptions
 def get_filters():
-    cur, conn = set_connection()
-    cur.execute('SELECT filter_id, filter_name, category_id, filter_type FROM Filter;')
-    rows = cur.fetchall()
-    filters = []
-    for row in rows:
-        filter_id, filter_name, category_id, filter_type = row
-        cur.execute('SELECT option_id, option_value FROM FilterOption WHERE filter_id = %s', (filter_id,))
-        option_rows = cur.fetchall()
-        options = [{'option_id': option_row[0], 'option_value': option_row[1]} for option_row in option_rows]
-        fil = {'filter_id': filter_id, 'filter_name': filter_name, 'category_id': category_id,
-               'filter_type': filter_type, 'options': options}
-        filters.append(fil)
-
-    logger.debug(f"Retrieved {len(filters)} filters from the database")
+    category_id = request.args.get('category_id', type=int)
+
+    def load():
+        return load_filters(primary_cursor(), category_id=category_id)
+
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        # Read straight from the shared mapping instead of keeping a copy per worker
+        filters = snapshot.filters(category_id)
+    else:
+        filters = catalog_cache.get_or_load(('get_filters', category_id), load, tags=('filters',))
+    logger.debug("Retrieved %s filters from the database", len(filters))
     return jsonify({'filters': filters})
 
 
@@ -248,20 +794,16 @@ def get_filters():
 @handle_exceptions
 def get_filter():
     filter_id = request.json.get('filter_id')
-    cur, conn = set_connection()
-    cur.execute('SELECT filter_id, filter_name, category_id, filter_type FROM Filter WHERE filter_id = %s;',
-                (filter_id,))
-    row = cur.fetchone()
-    if row is None:
+
+    def load():
+        filters = load_filters(primary_cursor(), filter_id=filter_id)
+        return filters[0] if filters else None
+
+    fil = catalog_cache.get_or_load(('get_filter', filter_id), load, tags=('filters',))
+    if fil is None:
         return jsonify({'error': f"No filter found with id {filter_id}"}), 404
-    filter_id, filter_name, category_id, filter_type = row
-    cur.execute('SELECT option_id, option_value FROM FilterOption WHERE filter_id = %s', (filter_id,))
-    option_rows = cur.fetchall()
-    options = [{'option_id': option_row[0], 'option_value': option_row[1]} for option_row in option_rows]
-    fil = {'filter_id': filter_id, 'filter_name': filter_name, 'category_id': category_id, 'filter_type': filter_type,
-           'options': options}
-
-    logger.debug(f"Retrieved filter {filter_id} from the database")
+
+    logger.debug("Retrieved filter %s from the database", filter_id)
     return jsonify({'filter': fil})
 
 
@@ -276,7 +818,7 @@ def create_filter():
     cur, conn = set_connection()
 
     # Get category_id for the given category_name
-    cur.execute('SELECT category_id FROM Category WHERE category_name = %s', (category_name,))
+    execute_prepared(cur, 'live_category_id_by_name', (category_name,))
     category_row = cur.fetchone()
     if not category_row:
         return jsonify({'error': f'Category with name {category_name} does not exist'}), 404
@@ -295,11 +837,13 @@ def create_filter():
     sql = 'INSERT INTO FilterOption (filter_id, option_value) VALUES %s'
 
     # Use execute_values to insert multiple rows at once
-    execute_values(cur, sql, filter_options)
+    execute_values(cur, sql, [(filter_id, option) for option in filter_options])
 
     conn.commit()
+    invalidate('filters')
+    facet_index.refresh_filter(cur, filter_id)
 
-    logger.debug(f"Created filter with ID {filter_id}")
+    logger.debug("Created filter with ID %s", filter_id)
     return jsonify({'filter_id': filter_id}), 201
 
 
@@ -317,30 +861,63 @@ def delete_filter():
         return jsonify({'error': f'Filter with ID {filter_id} does not exist'}), 404
     cur.execute('DELETE FROM Filter WHERE filter_id=%s;', (filter_id,))
     conn.commit()
-    logger.debug(f"Deleted filter with ID {filter_id}")
+    invalidate('filters')
+    facet_index.refresh_filter(cur, filter_id)
+    logger.debug("Deleted filter with ID %s", filter_id)
     return 'Deleted filter successfully', 204
 
 
 # API endpoint for getting a list of all categories
 @app.route('/app/v1/categories/get_categories')
 def get_categories():
-    cur, conn = set_connection()
-    cur.execute(
-        'SELECT category_id,name,description,parent_category_id FROM Category WHERE deleted_at IS NULL ORDER BY category_id;')
-    rows = cur.fetchall()
-    categories = []
-    for row in rows:
-        category = {
-            'category_id': row[0],
-            'name': row[1],
-            'description': row[2],
-            'parent_category_id': row[3]
-            # 'created_at': row[4].strftime('%Y-%m-%d %H:%M:%S'),
-            # 'updated_at': row[5].strftime('%Y-%m-%d %H:%M:%S')
-        }
-        categories.append(category)
-    logger.debug(f"Retrieved {len(categories)} categories")
-    return jsonify(categories), 200
+    def load():
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            return snapshot.categories()
+        cur = primary_cursor()
+        cur.execute(
+            'SELECT category_id,category_name,description,parent_category_id FROM Category WHERE deleted_at IS NULL ORDER BY category_id;')
+        rows = cur.fetchall()
+        categories = []
+        for row in rows:
+            category = {
+                'category_id': row[0],
+                'name': row[1],
+                'description': row[2],
+                'parent_category_id': row[3]
+                # 'created_at': row[4].strftime('%Y-%m-%d %H:%M:%S'),
+                # 'updated_at': row[5].strftime('%Y-%m-%d %H:%M:%S')
+            }
+            categories.append(category)
+        return categories
+
+    entry = response_cache.get_or_build(('get_categories',), load, tags=('categories',))
+    logger.debug("Served categories")
+    return response_cache.respond(entry, request)
+
+
+# API endpoint for getting the category hierarchy as nested children, optionally below ?root_id=
+@app.route('/app/v1/categories/get_category_tree', methods=['GET'])
+@handle_exceptions
+def get_category_tree():
+    root_id = request.args.get('root_id', type=int)
+    tree = get_category_tree_loaded().tree(root_id)
+    if tree is None:
+        return jsonify({'error': f'Category with ID {root_id} not found'}), 404
+    logger.debug("Retrieved category tree below %s", root_id)
+    return jsonify(tree), 200
+
+
+# API endpoint for the path from the top-level category down to ?category_id=
+@app.route('/app/v1/categories/get_breadcrumbs', methods=['GET'])
+@handle_exceptions
+def get_breadcrumbs():
+    category_id = request.args.get('category_id', type=int)
+    breadcrumbs = get_category_tree_loaded().breadcrumbs(category_id)
+    if breadcrumbs is None:
+        return jsonify({'error': f'Category with ID {category_id} not found'}), 404
+    logger.debug("Retrieved breadcrumbs for category %s", category_id)
+    return jsonify(breadcrumbs), 200
 
 
 # API endpoint for getting details of a specific category
@@ -348,16 +925,19 @@ def get_categories():
 def get_category():
     category_name = request.json.get("category_name")
     cur, conn = set_connection()
-    cur.execute('SELECT category_id FROM Category WHERE category_name=%s AND deleted_at IS NULL;', (category_name,))
+    execute_prepared(cur, 'live_category_version_by_name', (category_name,))
     category_id = cur.fetchone()
     if not category_id:
-        logger.debug(f"Category with name {category_name} not found")
+        logger.debug("Category with name %s not found", category_name)
         return jsonify({'error': f'Category with name {category_name} not found'}), 404
+    etag = version_etag('category', category_id[0], category_id[1])
+    if is_not_modified(request, etag, category_id[1]):
+        return not_modified(etag, category_id[1])
 
-    cur.execute('SELECT * FROM Category WHERE category_id=%s AND deleted_at IS NULL;', (category_id,))
+    execute_prepared(cur, 'live_category_by_id', (category_id[0],))
     row = cur.fetchone()
     if not row:
-        logger.debug(f"Category with ID {category_id} not found")
+        logger.debug("Category with ID %s not found", category_id)
         return jsonify({'error': f'Category with ID {category_id} not found'}), 404
     category = {
         'category_id': row[0],
@@ -367,12 +947,13 @@ def get_category():
         # 'created_at': row[4].strftime('%Y-%m-%d %H:%M:%S'),
         # 'updated_at': row[5].strftime('%Y-%m-%d %H:%M:%S')
     }
-    logger.debug(f"Retrieved category with ID {category_id}")
-    return jsonify(category), 200
+    logger.debug("Retrieved category with ID %s", category_id[0])
+    return add_validators(jsonify(category), etag, category_id[1]), 200
 
 
 # API endpoint for creating a new category
 @app.route('/app/v1/categories/create_category', methods=['POST'])
+@handle_exceptions
 def create_category():
     name = request.json.get('name')
     description = request.json.get('description')
@@ -381,12 +962,19 @@ def create_category():
         logger.debug("Missing  field in request")
         return jsonify({'error': 'Missing field'}), 400
     cur, conn = set_connection()
-    cur.execute(
-        'INSERT INTO Category (name, description, parent_category_id) VALUES (%s, %s, %s) RETURNING category_id;',
-        (name, description, parent_category_id))
+    try:
+        cur.execute(
+            'INSERT INTO Category (category_name, description, parent_category_id) VALUES (%s, %s, %s) RETURNING category_id;',
+            (name, description, parent_category_id))
+    except UniqueViolation:
+        # category_live_name_key: names are unique among categories that are not deleted
+        conn.rollback()
+        return jsonify({'error': f'Category {name} already exists'}), 409
     category_id = cur.fetchone()[0]
     conn.commit()
-    logger.debug(f"Created category with ID {category_id}")
+    invalidate('categories')
+    category_tree.refresh_category(cur, category_id)
+    logger.debug("Created category with ID %s", category_id)
     return jsonify({'category_id': category_id}), 201
 
 
@@ -400,7 +988,7 @@ def update_category():
     parent_category_id = data.get('parent_category_id')
 
     cur, conn = set_connection()
-    cur.execute('SELECT category_id FROM Category WHERE category_name = %s;', (category_name,))
+    execute_prepared(cur, 'live_category_id_by_name', (category_name,))
     category_id = cur.fetchone();
     # cur.execute('SELECT * FROM Category WHERE category_id = %s;', (category_id,))
     # row = cur.fetchone()
@@ -410,7 +998,9 @@ def update_category():
     cur.execute("""UPDATE Category SET category_name = %s,description = %s,parent_category_id = %s,updated_at = 
     NOW() WHERE category_id = %s;""", (category_name, description, parent_category_id, category_id))
     conn.commit()
-    logger.debug(f"Updated category with ID {category_id}")
+    invalidate('categories')
+    category_tree.refresh_category(cur, category_id[0])
+    logger.debug("Updated category with ID %s", category_id)
     return 'Updated category successfully', 200
 
 
@@ -418,9 +1008,9 @@ def update_category():
 @app.route('/app/v1/categories/delete_category', methods=['DELETE'])
 @handle_exceptions
 def delete_category():
-    category_name = request.get_json("category_name")
+    category_name = request.json.get("category_name")
     cur, conn = set_connection()
-    cur.execute('SELECT category_id FROM Category WHERE category_name = %s;', (category_name,))
+    execute_prepared(cur, 'live_category_id_by_name', (category_name,))
     category_id = cur.fetchone();
     # cur.execute('SELECT * FROM Category WHERE category_id = %s;', (category_id,))
     # row = cur.fetchone()
@@ -430,61 +1020,67 @@ def delete_category():
     # row = cur.fetchone()
     cur.execute("UPDATE Category SET deleted_at = NOW() WHERE category_id = %s", (category_id,))
     conn.commit()
-    logger.debug(f"Deleted category with ID {category_id}")
+    invalidate('categories')
+    category_tree.refresh_category(cur, category_id[0])
+    logger.debug("Deleted category with ID %s", category_id)
     return 'Deleted category successfully', 204
 
 
 @app.route('/app/v1/customers/get_customers', methods=['GET'])
 @handle_exceptions
 def get_customers():
+    after, limit = get_page_args()
+    try:
+        fields = requested_fields(CUSTOMER_FIELDS, 'detail')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    sql = CUSTOMER_FIELDS.select(fields)
+    build = CUSTOMER_FIELDS.builder(fields)
+    if wants_stream() or wants_full_list():
+        logger.debug("Streaming customers after %s", after)
+        return stream_rows(sql, 'customer_id', after, build)
+
     cur, conn = set_connection()
-    cur.execute(
-        'SELECT customer_id, customer_fname, customer_lname, email, phone_number, address, points_balance, points_redeemed FROM Customer;')
-    rows = cur.fetchall()
-    customers = []
-    for row in rows:
-        customer = {
-            'customer_id': row[0],
-            'customer_fname': row[1],
-            'customer_lname': row[2],
-            'email': row[3],
-            'phone_number': row[4],
-            'address': row[5],
-            'points_balance': row[6],
-            'points_redeemed': row[7]
-        }
-        customers.append(customer)
-    logger.debug(f"Retrieved {len(customers)} customers from the database")
-    return jsonify(customers), 200
+    # Validators for the page from ids and updated_at only: a digest of the rows it would hold
+    version_sql = ("SELECT md5(string_agg(customer_id || ':' || COALESCE(updated_at::text, ''), ',' "
+                   "ORDER BY customer_id)), max(updated_at) FROM (SELECT customer_id, updated_at FROM Customer")
+    params = []
+    if after is not None:
+        version_sql += ' WHERE customer_id > %s'
+        params.append(after)
+    version_sql += ' ORDER BY customer_id LIMIT %s) page;'
+    params.append(limit + 1)
+    cur.execute(version_sql, params)
+    digest, last_modified = cur.fetchone()
+    variant = CUSTOMER_FIELDS.variant(fields, 'detail')
+    etag = f'customers-{digest}-{variant}' if variant else f'customers-{digest}'
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+
+    rows, next_cursor = fetch_page(cur, sql, 'customer_id', after, limit)
+    customers = [build(row) for row in rows]
+    logger.debug("Retrieved %s customers from the database", len(customers))
+    # The body stays a plain list, so the cursor for the next page travels in a header
+    headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+    return add_validators(jsonify(customers), etag, last_modified), 200, headers
 
 
 @app.route('/app/v1/customers/get_customer', methods=['GET'])
 @handle_exceptions
 def get_customer():
-    customer_name = request.json.get("customer_name")
+    customer_id = request.json.get("customer_id")
     cur, conn = set_connection()
-    cur.execute('SELECT customer_id FROM Customer WHERE customer_name = %s;', (customer_name,))
-    customer_id = cur.fetchone();
-    if not customer_id:
-        return jsonify({'error': f'Customer with name {customer_name} does not exist'}), 404
-    cur, conn = set_connection()
-    cur.execute(
-        'SELECT customer_id, customer_fname, customer_lname, email, phone_number, address, points_balance, points_redeemed  FROM Customer WHERE customer_id = %s;',
-        (customer_id,))
+    unchanged = check_version(cur, 'customer_updated_at', 'customer', customer_id)
+    if unchanged is not None:
+        return unchanged
+    execute_prepared(cur, 'customer_by_id', (customer_id,))
     row = cur.fetchone()
+    if not row:
+        return jsonify({'error': f'Customer with ID {customer_id} does not exist'}), 404
 
-    customer = {
-        'customer_id': row[0],
-        'customer_fname': row[1],
-        'customer_lname': row[2],
-        'email': row[3],
-        'phone_number': row[4],
-        'address': row[5],
-        'points_balance': row[6],
-        'points_redeemed': row[7]
-    }
-    logger.debug(f"Retrieved customer with ID {customer_id}")
-    return jsonify(customer), 200
+    customer = customer_from_row(row)
+    logger.debug("Retrieved customer with ID %s", customer_id)
+    return add_validators(jsonify(customer), version_etag('customer', row[0], row[8]), row[8]), 200
 
 
 @app.route('/app/v1/customers/create_customer', methods=['POST'])
@@ -500,26 +1096,29 @@ def create_customer():
 
     # Check if email already exists
     cur, conn = set_connection()
-    cur.execute('SELECT customer_id FROM Customer WHERE email = %s;', (email,))
+    execute_prepared(cur, 'customer_id_by_email', (email,))
     result = cur.fetchone()
     if result is not None:
         return jsonify({'error': f'Email {email} already exists'}), 400
 
-    # Hash the password
-    hashed_password = generate_password_hash(password)
+    # Hash the password off the request thread
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HashingBusy as e:
+        return hashing_busy_response(e)
 
     # Insert the new customer into the database
     cur.execute("""INSERT INTO Customer (customer_fname, customer_lname, email, password, phone_number, address)
                     VALUES (%s, %s, %s, %s, %s, %s);""",
                 (customer_fname, customer_lname, email, hashed_password, phone_number, address))
     conn.commit()
-    logger.debug(f"Created customer with email {email}")
+    logger.debug("Created customer with email %s", email)
     return jsonify({'message': 'Customer created successfully'}), 201
 
 
 @app.route('/app/v1/customers/update_customer', methods=['PUT'])
 @handle_exceptions
-def update_customer(customer_id):
+def update_customer():
     data = request.json
     customer_id = data.get('customer_id')
     customer_fname = data.get('customer_fname')
@@ -531,29 +1130,33 @@ def update_customer(customer_id):
 
     # Check if the customer exists
     cur, conn = set_connection()
-    cur.execute('SELECT * FROM Customer WHERE customer_id = %s;', (customer_id,))
+    cur.execute('SELECT password FROM Customer WHERE customer_id = %s;', (customer_id,))
     result = cur.fetchone()
     if result is None:
         return jsonify({'error': f'Customer with ID {customer_id} does not exist'}), 404
+    existing_password = result[0]
 
     # Check if email is already taken by another customer
-    cur.execute('SELECT customer_id FROM Customer WHERE email = %s AND customer_id != %s;', (email, customer_id))
+    execute_prepared(cur, 'other_customer_id_by_email', (email, customer_id))
     result = cur.fetchone()
     if result is not None:
         return jsonify({'error': f'Email {email} is already taken by another customer'}), 400
 
     # Hash the password if provided
     if password:
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashingBusy as e:
+            return hashing_busy_response(e)
     else:
-        hashed_password = result['password']
+        hashed_password = existing_password
 
     # Update the customer in the database
     cur.execute("""UPDATE Customer SET customer_fname = %s, customer_lname = %s, email = %s, password = %s,
                     phone_number = %s, address = %s, updated_at = NOW() WHERE customer_id = %s;""",
                 (customer_fname, customer_lname, email, hashed_password, phone_number, address, customer_id))
     conn.commit()
-    logger.debug(f"Updated customer with ID {customer_id}")
+    logger.debug("Updated customer with ID %s", customer_id)
     return jsonify({'message': 'Customer updated successfully'}), 200
 
 
@@ -570,9 +1173,184 @@ def delete_customer():
 
     cur.execute('UPDATE Customer SET deleted_at = NOW() WHERE customer_id = %s;', (customer_id,))
     conn.commit()
-    logger.debug(f"Deleted customer with ID {customer_id}")
+    logger.debug("Deleted customer with ID %s", customer_id)
     return 'Deleted customer successfully', 200
 
 
+# Sub-request ops accepted by /app/v1/batch and the request field that identifies what they fetch
+BATCH_OPS = {
+    'get_product': 'product_id',
+    'get_category': 'category_name',
+    'get_filter': 'filter_id',
+    'get_filters': 'category_id',
+    'get_customer': 'customer_id',
+    'get_featured_products': None,
+}
+
+
+def batch_key(op, value):
+    # Normalises one sub-request's id so "2" and 2 share a lookup; returns None when it is unusable
+    if op == 'get_category':
+        return value if isinstance(value, str) and value else None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    return None
+
+
+def batch_load(cur, wanted):
+    # One query per entity type, each covering every id requested for it
+    found = {op: {} for op in BATCH_OPS}
+    if wanted['get_product']:
+        cur.execute('SELECT product_id, product_name, description, price, image_urls FROM products '
+                    'WHERE product_id = ANY(%s);', (list(wanted['get_product']),))
+        for row in cur.fetchall():
+            found['get_product'][row[0]] = {'product': {'id': row[0], 'name': row[1], 'description': row[2],
+                                                        'price': row[3], 'image_urls': row[4]}}
+    if wanted['get_category']:
+        cur.execute('SELECT category_id, category_name, description, parent_category_id FROM Category '
+                    'WHERE category_name = ANY(%s) AND deleted_at IS NULL;', (list(wanted['get_category']),))
+        for row in cur.fetchall():
+            found['get_category'][row[1]] = {'category_id': row[0], 'name': row[1], 'description': row[2],
+                                             'parent_category_id': row[3]}
+    if wanted['get_filter']:
+        cur.execute(FILTER_SELECT + 'WHERE f.filter_id = ANY(%s) GROUP BY f.filter_id, c.category_name;',
+                    (list(wanted['get_filter']),))
+        for row in cur.fetchall():
+            found['get_filter'][row[0]] = {'filter': filter_from_row(row)}
+    if wanted['get_filters']:
+        category_ids = list(wanted['get_filters'])
+        cur.execute('WITH links AS (SELECT filter_id, category_id FROM Filter WHERE category_id = ANY(%s) '
+                    'UNION SELECT filter_id, category_id FROM filter_category WHERE category_id = ANY(%s)) '
+                    f'SELECT links.category_id, {FILTER_COLUMNS} FROM links '
+                    f'JOIN Filter f ON f.filter_id = links.filter_id {FILTER_JOINS}'
+                    'GROUP BY links.category_id, f.filter_id, c.category_name ORDER BY f.filter_id;',
+                    (category_ids, category_ids))
+        for category_id in category_ids:
+            found['get_filters'][category_id] = {'filters': []}
+        for row in cur.fetchall():
+            found['get_filters'][row[0]]['filters'].append(filter_from_row(row[1:]))
+    if wanted['get_customer']:
+        cur.execute('SELECT customer_id, customer_fname, customer_lname, email, phone_number, address, '
+                    'points_balance, points_redeemed FROM Customer WHERE customer_id = ANY(%s);',
+                    (list(wanted['get_customer']),))
+        for row in cur.fetchall():
+            found['get_customer'][row[0]] = customer_from_row(row)
+    if wanted['get_featured_products']:
+        cur.execute('SELECT product_id, product_name, description, price, image_urls FROM products '
+                    'WHERE featured = true;')
+        found['get_featured_products'][None] = {'products': [product_from_row(row) for row in cur.fetchall()]}
+    return found
+
+
+# API endpoint for holding stock of a product for a checkout: {"product_id": 1, "quantity": 2}
+@app.route('/app/v1/inventory/reserve', methods=['POST'])
+@handle_exceptions
+def reserve_stock():
+    data = request.get_json()
+    product_id = data.get('product_id')
+    quantity = data.get('quantity', 1)
+    if not isinstance(product_id, int) or not isinstance(quantity, int) or quantity <= 0:
+        return jsonify({'error': 'product_id and a positive integer quantity are required'}), 400
+    try:
+        reservation = stock_reserver.reserve(product_id, quantity)
+    except ProductNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except InsufficientStock as e:
+        logger.debug("Rejected reservation of %s x product %s, %s available", quantity, product_id, e.available)
+        return jsonify({'error': str(e), 'available': e.available}), 409
+    logger.debug("Reserved %s x product %s as reservation %s", quantity, product_id, reservation['reservation_id'])
+    return jsonify(reservation), 201
+
+
+def finish_reservation(action):
+    reservation_id = request.get_json().get('reservation_id')
+    if not isinstance(reservation_id, int):
+        return jsonify({'error': 'reservation_id is required'}), 400
+    cur, conn = set_connection()
+    try:
+        reservation = action(cur, reservation_id)
+    except ReservationNotHeld as e:
+        if e.status is None:
+            return jsonify({'error': f'Reservation with ID {reservation_id} does not exist'}), 404
+        return jsonify({'error': str(e), 'status': e.status}), 409
+    logger.debug("Reservation %s is now %s", reservation_id, reservation['status'])
+    return jsonify(reservation), 200
+
+
+# API endpoint for turning a held reservation into a sale: {"reservation_id": 1}
+@app.route('/app/v1/inventory/confirm', methods=['POST'])
+@handle_exceptions
+def confirm_reservation():
+    return finish_reservation(stock_reserver.confirm)
+
+
+# API endpoint for returning held stock: {"reservation_id": 1}
+@app.route('/app/v1/inventory/release', methods=['POST'])
+@handle_exceptions
+def release_reservation():
+    return finish_reservation(stock_reserver.release)
+
+
+@app.route('/app/v1/inventory/stats', methods=['GET'])
+def get_inventory_stats():
+    return jsonify(stock_reserver.stats()), 200
+
+
+# API endpoint for resolving several reads in one round trip, e.g.
+# {"requests": [{"op": "get_product", "product_id": 1}, {"op": "get_featured_products"}]}
+@app.route('/app/v1/batch', methods=['POST'])
+@handle_exceptions
+def batch():
+    sub_requests = (request.json or {}).get('requests')
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({'error': 'Missing requests list'}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'}), 400
+
+    wanted = {op: set() for op in BATCH_OPS}
+    keys = []
+    for sub_request in sub_requests:
+        op = sub_request.get('op') if isinstance(sub_request, dict) else None
+        if op not in BATCH_OPS:
+            keys.append(None)
+            continue
+        key = None
+        if BATCH_OPS[op]:
+            value = sub_request.get(BATCH_OPS[op])
+            key = batch_key(op, value)
+            if key is None:
+                keys.append((op, value, False))
+                continue
+        keys.append((op, key, True))
+        wanted[op].add(key)
+
+    mark_read_only()
+    cur, conn = set_connection()
+    # Every lookup reads from the same snapshot
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;')
+    found = batch_load(cur, wanted)
+    conn.rollback()
+
+    responses = []
+    for sub_request, key in zip(sub_requests, keys):
+        if key is None:
+            responses.append({'status': 400, 'body': {'error': f'Unsupported op {sub_request!r}'}})
+            continue
+        op, value, valid = key
+        if not valid:
+            error = f'Missing {BATCH_OPS[op]}' if value is None else f'Invalid {BATCH_OPS[op]} {value!r}'
+            responses.append({'op': op, 'status': 400, 'body': {'error': error}})
+        elif value in found[op]:
+            responses.append({'op': op, 'status': 200, 'body': found[op][value]})
+        else:
+            responses.append({'op': op, 'status': 404, 'body': {'error': f'{BATCH_OPS[op]} {value} not found'}})
+    logger.debug("Resolved batch of %s requests", len(sub_requests))
+    return jsonify({'responses': responses}), 200
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,297 @@
+# Asyncio serving mode: the read-heavy /app/v1 routes run as native coroutines on an asyncpg pool so one
+# process can keep many requests in flight while Postgres works. Every other route falls through to the
+# Flask app over asgiref's WSGI adapter, so both modes serve the same API.
+# Needs quart, asyncpg and asgiref, plus an ASGI server such as hypercorn.
+#
+#   hypercorn async_app:application --bind 127.0.0.1:8000
+#
+# The async routes answer with the same bodies and Cache-Control headers as app.py; the README lists the
+# request-path features of app.py they do not have.
+import asyncio
+import json
+
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, jsonify, request
+
+import admin_apis  # noqa: F401  registers the admin routes on the Flask app
+from app import app as flask_app
+from app import catalog_cache, search_index, logger
+from app import product_from_row, customer_from_row, search_limit, SHORT_PRODUCT_KEYS
+from projection import PRODUCT_FIELDS, CUSTOMER_FIELDS
+from statements import FILTER_SELECT
+from settings import DB_CONFIG, DB_PRIMARY_DSN, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT
+from settings import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, CACHE_CONTROL
+
+quart_app = Quart(__name__)
+ASYNC_ROUTES = set()
+pool = None
+
+PRODUCT_COLUMNS = 'product_id, product_name, description, price, image_urls'
+CUSTOMER_COLUMNS = ('customer_id, customer_fname, customer_lname, email, phone_number, address, points_balance, '
+                    'points_redeemed')
+FILTERS_SQL = FILTER_SELECT
+
+
+def route(path, **options):
+    def decorator(func):
+        ASYNC_ROUTES.add(path)
+        return quart_app.route(path, **options)(func)
+    return decorator
+
+
+async def _init_connection(conn):
+    # Decode json/jsonb into Python objects like psycopg2 does
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+@quart_app.before_serving
+async def open_pool():
+    global pool
+    if DB_PRIMARY_DSN:
+        config = {'dsn': DB_PRIMARY_DSN}
+    else:
+        config = dict(DB_CONFIG)
+        config['port'] = int(config['port'])
+    pool = await asyncpg.create_pool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                                     init=_init_connection, **config)
+
+
+@quart_app.after_serving
+async def close_pool():
+    await pool.close()
+
+
+@quart_app.after_request
+async def set_cache_control(response):
+    # Same policies as app.set_cache_control; the async routes keep the Flask endpoint names
+    policy = CACHE_CONTROL.get(request.endpoint)
+    if policy and request.method == 'GET' and response.status_code in (200, 304) \
+            and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = policy
+    return response
+
+
+@quart_app.errorhandler(asyncpg.PostgresError)
+async def handle_database_error(e):
+    logger.error(str(e))
+    return jsonify({"error": "Database error"})
+
+
+async def _json_body():
+    return await request.get_json(force=True, silent=True) or {}
+
+
+async def _requested_fields(projection, default, rename=None):
+    value = request.args.get('fields')
+    if value is None:
+        value = (await _json_body()).get('fields')
+    return projection.parse(value, default, rename)
+
+
+def _page_args():
+    # limit is None when the client sent neither after nor limit and gets the whole list, as in app.py
+    if 'after' not in request.args and 'limit' not in request.args:
+        return None, None
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+async def _fetch_page(sql, key_column, after, limit):
+    params = []
+    if after is not None:
+        sql += f' WHERE {key_column} > $1'
+        params.append(after)
+    if limit is None:
+        return await pool.fetch(sql + f' ORDER BY {key_column}', *params), None
+    sql += f' ORDER BY {key_column} LIMIT ${len(params) + 1}'
+    params.append(limit + 1)
+    rows = await pool.fetch(sql, *params)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _filter_from_row(row):
+    return {'filter_id': row[0], 'filter_name': row[1], 'category_id': row[2], 'category_name': row[3],
+            'filter_type': row[4], 'options': row[5]}
+
+
+_MISSING = object()
+
+
+async def _cached(key, tags, loader):
+    # Shares the Flask app's catalog cache, so its write endpoints invalidate these entries too
+    value = catalog_cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+    generation = catalog_cache.generation
+    value = await loader()
+    catalog_cache.set(key, value, tags=tags, generation=generation)
+    return value
+
+
+@route('/app/v1/products/get_products', methods=['GET'])
+async def get_products():
+    after, limit = _page_args()
+    try:
+        fields = await _requested_fields(PRODUCT_FIELDS, 'list')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    build = PRODUCT_FIELDS.builder(fields)
+
+    async def load():
+        rows, next_cursor = await _fetch_page(PRODUCT_FIELDS.select(fields), 'product_id', after, limit)
+        if limit is None:
+            return {'products': [build(row) for row in rows]}
+        return {'products': [build(row) for row in rows], 'next_cursor': next_cursor}
+
+    page = await _cached(('get_products', after, limit, fields), ('products',), load)
+    logger.debug("Retrieved %s products from the database", len(page['products']))
+    return jsonify(page)
+
+
+@route('/app/v1/products/get_product', methods=['GET'])
+async def get_product():
+    product_id = (await _json_body()).get('product_id')
+    try:
+        fields = await _requested_fields(PRODUCT_FIELDS, 'list', rename=SHORT_PRODUCT_KEYS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    row = await pool.fetchrow(PRODUCT_FIELDS.select(fields) + ' WHERE product_id = $1', product_id)
+    if row is None:
+        return jsonify({'error': f'Product with ID {product_id} does not exist'}), 404
+    product = PRODUCT_FIELDS.builder(fields, SHORT_PRODUCT_KEYS)(row)
+    logger.debug("Retrieved product with id %s from the database", product_id)
+    return jsonify({'product': product})
+
+
+@route('/app/v1/products/search_products', methods=['GET'])
+async def search_products():
+    data = await _json_body()
+    query = data.get('query')
+    try:
+        limit = search_limit(data.get('limit'))
+        fields = await _requested_fields(PRODUCT_FIELDS, 'list')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if search_index.is_stale():
+        rows = await pool.fetch('SELECT product_id, product_name, description, tags FROM products')
+        # Building the index is CPU-bound; off the event loop, so other requests keep being served
+        await asyncio.get_running_loop().run_in_executor(None, search_index.load, rows)
+    ranked = search_index.search(query, limit=limit)
+    rows = await pool.fetch(PRODUCT_FIELDS.select(fields) + ' WHERE product_id = any($1::int[])',
+                            [product_id for product_id, _ in ranked])
+    rows = {row[0]: row for row in rows}
+    build = PRODUCT_FIELDS.builder(fields)
+    products = [build(rows[product_id]) for product_id, _ in ranked if product_id in rows]
+    logger.debug("Found %s products matching query '%s'", len(products), query)
+    return jsonify({'products': products})
+
+
+@route('/app/v1/products/get_featured_products', methods=['GET'])
+async def get_featured_products():
+    async def load():
+        rows = await pool.fetch(f'SELECT {PRODUCT_COLUMNS} FROM products WHERE featured = true')
+        return [product_from_row(row) for row in rows]
+
+    products = await _cached(('get_featured_products',), ('products',), load)
+    logger.debug("Retrieved %s featured products from the database", len(products))
+    return jsonify({'products': products})
+
+
+@route('/app/v1/filters/get_filters', methods=['GET'])
+async def get_filters():
+    category_id = request.args.get('category_id', type=int)
+
+    async def load():
+        if category_id is None:
+            rows = await pool.fetch(FILTERS_SQL + 'GROUP BY f.filter_id, c.category_name ORDER BY f.filter_id')
+        else:
+            rows = await pool.fetch(FILTERS_SQL + 'WHERE f.filter_id IN (SELECT filter_id FROM Filter '
+                                    'WHERE category_id = $1 UNION SELECT filter_id FROM filter_category '
+                                    'WHERE category_id = $1) '
+                                    'GROUP BY f.filter_id, c.category_name ORDER BY f.filter_id', category_id)
+        return [_filter_from_row(row) for row in rows]
+
+    filters = await _cached(('get_filters', category_id), ('filters',), load)
+    logger.debug("Retrieved %s filters from the database", len(filters))
+    return jsonify({'filters': filters})
+
+
+@route('/app/v1/filters/get_filter', methods=['GET'])
+async def get_filter():
+    filter_id = (await _json_body()).get('filter_id')
+
+    async def load():
+        row = await pool.fetchrow(FILTERS_SQL + 'WHERE f.filter_id = $1 GROUP BY f.filter_id, c.category_name',
+                                  filter_id)
+        return _filter_from_row(row) if row is not None else None
+
+    fil = await _cached(('get_filter', filter_id), ('filters',), load)
+    if fil is None:
+        return jsonify({'error': f"No filter found with id {filter_id}"}), 404
+    logger.debug("Retrieved filter %s from the database", filter_id)
+    return jsonify({'filter': fil})
+
+
+@route('/app/v1/categories/get_categories', methods=['GET'])
+async def get_categories():
+    async def load():
+        rows = await pool.fetch('SELECT category_id, category_name, description, parent_category_id FROM Category '
+                                'WHERE deleted_at IS NULL ORDER BY category_id')
+        return [{'category_id': row[0], 'name': row[1], 'description': row[2], 'parent_category_id': row[3]}
+                for row in rows]
+
+    categories = await _cached(('get_categories',), ('categories',), load)
+    logger.debug("Retrieved %s categories", len(categories))
+    return jsonify(categories), 200
+
+
+@route('/app/v1/categories/get_category', methods=['GET'])
+async def get_category():
+    category_name = (await _json_body()).get('category_name')
+    row = await pool.fetchrow('SELECT category_id, category_name, description, parent_category_id FROM Category '
+                              'WHERE category_name = $1 AND deleted_at IS NULL', category_name)
+    if row is None:
+        logger.debug("Category with name %s not found", category_name)
+        return jsonify({'error': f'Category with name {category_name} not found'}), 404
+    category = {'category_id': row[0], 'name': row[1], 'description': row[2], 'parent_category_id': row[3]}
+    logger.debug("Retrieved category with ID %s", row[0])
+    return jsonify(category), 200
+
+
+@route('/app/v1/customers/get_customers', methods=['GET'])
+async def get_customers():
+    after, limit = _page_args()
+    try:
+        fields = await _requested_fields(CUSTOMER_FIELDS, 'detail')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    rows, next_cursor = await _fetch_page(CUSTOMER_FIELDS.select(fields), 'customer_id', after, limit)
+    build = CUSTOMER_FIELDS.builder(fields)
+    customers = [build(row) for row in rows]
+    logger.debug("Retrieved %s customers from the database", len(customers))
+    headers = {'X-Next-Cursor': str(next_cursor)} if next_cursor is not None else {}
+    return jsonify(customers), 200, headers
+
+
+@route('/app/v1/customers/get_customer', methods=['GET'])
+async def get_customer():
+    customer_id = (await _json_body()).get('customer_id')
+    row = await pool.fetchrow(f'SELECT {CUSTOMER_COLUMNS} FROM Customer WHERE customer_id = $1', customer_id)
+    if row is None:
+        return jsonify({'error': f'Customer with ID {customer_id} does not exist'}), 404
+    logger.debug("Retrieved customer with ID %s", customer_id)
+    return jsonify(customer_from_row(row)), 200
+
+
+wsgi_fallback = WsgiToAsgi(flask_app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] not in ASYNC_ROUTES:
+        await wsgi_fallback(scope, receive, send)
+        return
+    await quart_app(scope, receive, send)
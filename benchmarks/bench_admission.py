@@ -0,0 +1,184 @@
+# Overloads the service at rising concurrency and reports p99 latency per priority class, with and without
+# admission control. Against a running instance (--base-url) it replays the seeded loadtest mix: start the app
+# once with ADMISSION_ENABLED = False and once with it on, and pass --label to tell the runs apart.
+# --simulate needs no server or database: request threads go through AdmissionController in process and then
+# run against a model of Postgres with --capacity connections' worth of throughput whose service time grows
+# with the number of statements in flight, so both modes can be compared on any machine.
+#
+#   python -m benchmarks.bench_admission --simulate --concurrency 8 32 128 256
+#   python -m benchmarks.bench_admission --base-url http://127.0.0.1:5000 --concurrency 16 64 256 --label on
+import argparse
+import json
+import random
+import threading
+import time
+
+from admission import AdmissionController, Overloaded
+from benchmarks.loadtest import MANIFEST, default_mix, run
+from settings import ADMISSION_CLASSES, ADMISSION_ROUTES, ADMISSION_ROUTE_LIMITS, ADMISSION_EXEMPT
+from settings import ADMISSION_INITIAL_LIMIT, ADMISSION_MIN_LIMIT, ADMISSION_MAX_LIMIT, ADMISSION_ADJUST_INTERVAL
+
+# (endpoint, share of the traffic, service time in seconds on an idle database)
+SIMULATED_MIX = [
+    ('get_product', 0.35, 0.004),
+    ('get_products', 0.2, 0.012),
+    ('filter_products', 0.15, 0.008),
+    ('get_customer', 0.1, 0.005),
+    ('update_product', 0.08, 0.015),
+    ('search_products', 0.1, 0.04),
+    ('bulk_import_products', 0.02, 0.4),
+]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))]
+
+
+class SimulatedDatabase:
+    # Serves at most `capacity` statements at a time; the rest wait, and every statement slows down as
+    # in-flight work beyond capacity piles up (lock and buffer contention), like a saturated Postgres
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def run(self, service_time):
+        with self._lock:
+            self._in_flight += 1
+            contention = max(0, self._in_flight - self.capacity) / self.capacity
+        try:
+            with self._slots:
+                time.sleep(service_time * (1 + 0.5 * contention))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+def make_controller():
+    return AdmissionController(ADMISSION_CLASSES, routes=ADMISSION_ROUTES, route_limits=ADMISSION_ROUTE_LIMITS,
+                               exempt=ADMISSION_EXEMPT, initial_limit=ADMISSION_INITIAL_LIMIT,
+                               min_limit=ADMISSION_MIN_LIMIT, max_limit=ADMISSION_MAX_LIMIT,
+                               adjust_interval=ADMISSION_ADJUST_INTERVAL)
+
+
+def simulate(concurrency, duration, capacity, admission):
+    database = SimulatedDatabase(capacity)
+    controller = make_controller() if admission else None
+    names, weights, service = zip(*SIMULATED_MIX)
+    service = dict(zip(names, service))
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        rng = random.Random()
+        local = []
+        while time.monotonic() < deadline:
+            route = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            status = 200
+            try:
+                ticket = controller.acquire(route) if controller is not None else None
+            except Overloaded as e:
+                status = 503
+                local.append((route, status, time.perf_counter() - started))
+                # A well-behaved client backs off instead of retrying at once
+                time.sleep(min(e.retry_after, 0.05))
+                continue
+            try:
+                database.run(service[route])
+            finally:
+                if controller is not None:
+                    controller.release(ticket)
+            local.append((route, status, time.perf_counter() - started))
+        with results_lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return summarize(results, elapsed, controller)
+
+
+def class_of(route):
+    return ADMISSION_ROUTES.get(route, 'normal')
+
+
+def summarize(results, elapsed, controller=None):
+    by_class = {}
+    for route, status, latency in results:
+        by_class.setdefault(class_of(route), []).append((status, latency))
+    report = {}
+    for name in ADMISSION_CLASSES:
+        samples = by_class.get(name, [])
+        served = [latency for status, latency in samples if 0 < status < 500]
+        report[name] = {
+            'requests': len(samples),
+            'served_per_s': len(served) / elapsed if elapsed else 0.0,
+            'p50_ms': _percentile(served, 50) * 1000,
+            'p99_ms': _percentile(served, 99) * 1000,
+            'shed_pct': 100.0 * sum(1 for status, _ in samples if status == 503) / len(samples) if samples else 0.0,
+            'p99_all_ms': _percentile([latency for _, latency in samples], 99) * 1000,
+        }
+    return {'classes': report, 'limit': controller.stats()['limit'] if controller is not None else None}
+
+
+def live(base_url, concurrency, duration, manifest):
+    with open(manifest) as f:
+        specs = default_mix(json.load(f))
+    endpoints = run(base_url, specs, concurrency, duration=duration)['endpoints']
+    report = {}
+    for name in ADMISSION_CLASSES:
+        members = {route: e for route, e in endpoints.items() if class_of(route) == name}
+        requests = sum(e['requests'] for e in members.values())
+        report[name] = {
+            'requests': requests,
+            'served_per_s': sum(e['throughput'] for e in members.values()),
+            'p50_ms': max((e['p50_ms'] for e in members.values()), default=0.0),
+            # loadtest keeps no per-request samples, so this is the worst endpoint's p99 in the class
+            'p99_ms': max((e['p99_ms'] for e in members.values()), default=0.0),
+            'shed_pct': 100.0 * sum(e['errors'] for e in members.values()) / requests if requests else 0.0,
+            'p99_all_ms': max((e['p99_ms'] for e in members.values()), default=0.0),
+        }
+    return {'classes': report, 'limit': None}
+
+
+def print_row(label, concurrency, result):
+    for name, c in result['classes'].items():
+        print(f"{label:<10}{concurrency:>6} {name:<10}{c['requests']:>9}{c['served_per_s']:>10.1f}"
+              f"{c['p50_ms']:>10.1f}{c['p99_ms']:>10.1f}{c['p99_all_ms']:>11.1f}{c['shed_pct']:>8.1f}"
+              f"{result['limit'] if result['limit'] is not None else '':>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure p99 per priority class under overload')
+    parser.add_argument('--simulate', action='store_true', help='in-process model instead of a running server')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--manifest', default=MANIFEST)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128, 256])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--capacity', type=int, default=16, help='simulated database connections')
+    parser.add_argument('--label', default='live', help='name for this run in the report (live mode)')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'conc':>6} {'class':<10}{'reqs':>9}{'served/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'p99 all':>11}{'shed %':>8}{'limit':>7}")
+    for concurrency in args.concurrency:
+        if args.simulate:
+            for admission in (False, True):
+                result = simulate(concurrency, args.duration, args.capacity, admission)
+                print_row('admission' if admission else 'none', concurrency, result)
+        else:
+            print_row(args.label, concurrency, live(args.base_url, concurrency, args.duration, args.manifest))
+
+
+if __name__ == '__main__':
+    main()
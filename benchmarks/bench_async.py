@@ -0,0 +1,34 @@
+# Runs the same read-only mix against the threaded Flask server and the asyncio server at rising
+# concurrency and prints both side by side.
+#
+#   gunicorn --threads 16 -w 1 'admin_apis:app' -b 127.0.0.1:5000
+#   hypercorn async_app:application --bind 127.0.0.1:8000
+#   python -m benchmarks.bench_async --threaded http://127.0.0.1:5000 --async http://127.0.0.1:8000
+import argparse
+import json
+
+from benchmarks.loadtest import MANIFEST, default_mix, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare threaded and asyncio serving modes')
+    parser.add_argument('--threaded', default='http://127.0.0.1:5000')
+    parser.add_argument('--async', dest='async_url', default='http://127.0.0.1:8000')
+    parser.add_argument('--manifest', default=MANIFEST)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--duration', type=float, default=30.0)
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    print(f"{'mode':<10}{'conc':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for concurrency in args.concurrency:
+        for mode, url in (('threaded', args.threaded), ('asyncio', args.async_url)):
+            specs = default_mix(manifest, include_writes=False)
+            overall = run(url, specs, concurrency, duration=args.duration)['overall']
+            print(f"{mode:<10}{concurrency:>6}{overall['throughput']:>10.1f}{overall['p50_ms']:>10.2f}"
+                  f"{overall['p95_ms']:>10.2f}{overall['p99_ms']:>10.2f}{overall['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
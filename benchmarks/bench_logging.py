@@ -0,0 +1,72 @@
+# Measures the cost of a logger.debug call on the request thread with the synchronous FileHandler
+# that setup_logger used to attach versus the queue-based pipeline in log_pipeline.
+#
+#   python -m benchmarks.bench_logging --records 20000 --threads 1 8
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from log_pipeline import setup_async_handler
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def make_logger(name, log_file, async_mode):
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter(FORMAT)
+    if async_mode:
+        _, listener = setup_async_handler(logger, log_file, logging.DEBUG, formatter, max_bytes=0, backup_count=0,
+                                          queue_size=100000, batch_size=256, flush_interval=0.1)
+        return logger, listener.stop
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return logger, handler.close
+
+
+def run(async_mode, records, threads, directory):
+    log_file = os.path.join(directory, f"bench-{'async' if async_mode else 'sync'}-{threads}.log")
+    logger, shutdown = make_logger(f"bench.{async_mode}.{threads}", log_file, async_mode)
+    samples = [[] for _ in range(threads)]
+    per_thread = records // threads
+
+    def work(out):
+        for i in range(per_thread):
+            started = time.perf_counter()
+            logger.debug("Retrieved %s products from the database with filter options %s for category %s",
+                         i, ['red', 'xl'], 7)
+            out.append(time.perf_counter() - started)
+
+    workers = [threading.Thread(target=work, args=(samples[i],)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    request_path = time.perf_counter() - started
+    shutdown()
+    drained = time.perf_counter() - started
+
+    latencies = sorted(sample * 1e6 for thread_samples in samples for sample in thread_samples)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    label = 'queue + batched writer' if async_mode else 'FileHandler'
+    print(f"{label:<24} threads {threads:>2}   p50 {statistics.median(latencies):7.2f} us   p99 {p99:8.2f} us"
+          f"   request-path wall {request_path * 1000:8.1f} ms   until written {drained * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark synchronous vs queued log writes')
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for threads in args.threads:
+            run(False, args.records, threads, directory)
+            run(True, args.records, threads, directory)
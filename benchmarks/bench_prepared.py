@@ -0,0 +1,88 @@
+# Compares plain parameterized execution of the registered hot statements with EXECUTE of the
+# per-connection prepared versions, and reports the planning time each plain call pays.
+#
+#   python -m benchmarks.bench_prepared --iterations 2000
+import argparse
+import statistics
+import time
+
+from settings import checkout_connection, release_connection
+from statements import STATEMENTS, execute_prepared, plain_sql
+
+
+def sample_params(cur):
+    cur.execute('SELECT product_id FROM products ORDER BY product_id LIMIT 1;')
+    product_id = cur.fetchone()[0]
+    cur.execute('SELECT category_name FROM Category WHERE deleted_at IS NULL ORDER BY category_id LIMIT 1;')
+    category_name = cur.fetchone()[0]
+    cur.execute('SELECT category_id FROM Category WHERE deleted_at IS NULL ORDER BY category_id LIMIT 1;')
+    category_id = cur.fetchone()[0]
+    cur.execute('SELECT filter_id FROM Filter ORDER BY filter_id LIMIT 1;')
+    filter_id = cur.fetchone()[0]
+    cur.execute('SELECT customer_id, email FROM Customer ORDER BY customer_id LIMIT 1;')
+    customer_id, email = cur.fetchone()
+    return {
+        'product_by_id': (product_id,),
+        'product_updated_at': (product_id,),
+        'live_category_id_by_name': (category_name,),
+        'live_category_version_by_name': (category_name,),
+        'live_category_by_id': (category_id,),
+        'filter_with_options': (filter_id,),
+        'filter_options_by_filter': (filter_id,),
+        'customer_by_id': (customer_id,),
+        'customer_updated_at': (customer_id,),
+        'customer_id_by_email': (email,),
+        'other_customer_id_by_email': (email, customer_id),
+    }
+
+
+def planning_ms(cur, name, params):
+    cur.execute('EXPLAIN (ANALYZE, SUMMARY) ' + plain_sql(name), params)
+    for (line,) in cur.fetchall():
+        if line.startswith('Planning Time:'):
+            return float(line.split(':')[1].split()[0])
+    return float('nan')
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prepared vs plain execution of hot statements')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        params = sample_params(cur)
+        print(f"{'statement':<28}{'plan ms':>10}{'plain us':>12}{'prepared us':>14}{'saved':>9}")
+        for name in STATEMENTS:
+            plan = planning_ms(cur, name, params[name])
+
+            def plain():
+                cur.execute(plain_sql(name), params[name])
+                cur.fetchall()
+
+            def prepared():
+                execute_prepared(cur, name, params[name])
+                cur.fetchall()
+
+            prepared()
+            plain_us = timed(plain, args.iterations)
+            prepared_us = timed(prepared, args.iterations)
+            saved = (plain_us - prepared_us) / plain_us * 100 if plain_us else 0.0
+            print(f"{name:<28}{plan:>10.3f}{plain_us:>12.1f}{prepared_us:>14.1f}{saved:>8.1f}%")
+        conn.rollback()
+    finally:
+        release_connection(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Hammers reservations on a single hot SKU from many threads, once with one locked UPDATE per reservation
+# and once through StockReserver's per-SKU batches, then checks that neither sold more than was in stock.
+# Works on a scratch product that is removed afterwards.
+#
+#   python -m benchmarks.bench_reservations --threads 16 --reservations 200 --stock 2400
+import argparse
+import statistics
+import threading
+import time
+
+from inventory import StockReserver, InsufficientStock
+from migrations import migrate
+from settings import checkout_connection, release_connection
+
+SKU = 'bench-hot-sku'
+
+
+def create_product(stock):
+    migrate()
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO Products (product_name, sku, price, available_qty, in_order, is_active) "
+                    "VALUES ('Benchmark hot SKU', %s, 1, %s, 0, false) "
+                    "ON CONFLICT (sku) DO UPDATE SET available_qty = EXCLUDED.available_qty, in_order = 0 "
+                    "RETURNING product_id;", (SKU, stock))
+        product_id = cur.fetchone()[0]
+        cur.execute('DELETE FROM stock_reservation WHERE product_id = %s;', (product_id,))
+        conn.commit()
+        return product_id
+    finally:
+        release_connection(conn)
+
+
+def drop_product(product_id):
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM stock_reservation WHERE product_id = %s;', (product_id,))
+        cur.execute('DELETE FROM Products WHERE product_id = %s;', (product_id,))
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+
+def check_stock(product_id, stock):
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT available_qty, in_order FROM Products WHERE product_id = %s;', (product_id,))
+        available, in_order = cur.fetchone()
+        cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_reservation "
+                    "WHERE product_id = %s AND status = 'held';", (product_id,))
+        held = cur.fetchone()[0]
+        conn.rollback()
+    finally:
+        release_connection(conn)
+    return available >= 0 and in_order == held and available + held == stock, available, held
+
+
+def row_lock_reserve(product_id, quantity, hold_seconds=900):
+    # The straightforward version: every reservation takes the product row lock for its own transaction
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('UPDATE Products SET available_qty = available_qty - %s, in_order = in_order + %s '
+                    'WHERE product_id = %s AND available_qty >= %s RETURNING available_qty;',
+                    (quantity, quantity, product_id, quantity))
+        if cur.fetchone() is None:
+            conn.rollback()
+            raise InsufficientStock(product_id, quantity, None)
+        cur.execute("INSERT INTO stock_reservation (product_id, quantity, expires_at) "
+                    "VALUES (%s, %s, NOW() + %s * INTERVAL '1 second');", (product_id, quantity, hold_seconds))
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+
+def hammer(reserve, product_id, threads, per_thread):
+    latencies = []
+    outcomes = {'granted': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker():
+        local = []
+        counts = {'granted': 0, 'rejected': 0, 'errors': 0}
+        start.wait()
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            try:
+                reserve(product_id, 1)
+                counts['granted'] += 1
+            except InsufficientStock:
+                counts['rejected'] += 1
+            except Exception:
+                counts['errors'] += 1
+            local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local)
+            for key, value in counts.items():
+                outcomes[key] += value
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1],
+        **outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark stock reservations on one hot SKU')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--reservations', type=int, default=200, help='reservations per thread')
+    parser.add_argument('--stock', type=int, default=None,
+                        help='starting stock (default: 3/4 of the attempts, so the SKU sells out)')
+    parser.add_argument('--batch-window', type=float, default=0.002)
+    args = parser.parse_args()
+    stock = args.stock if args.stock is not None else args.threads * args.reservations * 3 // 4
+
+    reserver = StockReserver(batch_window=args.batch_window)
+    modes = (('row lock', row_lock_reserve), ('batched', reserver.reserve))
+    print(f"{'mode':<10}{'res/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'granted':>9}{'rejected':>10}{'errors':>8}"
+          f"{'stock ok':>10}")
+    for mode, reserve in modes:
+        product_id = create_product(stock)
+        try:
+            result = hammer(reserve, product_id, args.threads, args.reservations)
+            ok, available, held = check_stock(product_id, stock)
+            ok = ok and result['granted'] == held <= stock
+        finally:
+            drop_product(product_id)
+        print(f"{mode:<10}{result['throughput']:>10.1f}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['granted']:>9}{result['rejected']:>10}{result['errors']:>8}{'yes' if ok else 'NO':>10}")
+    stats = reserver.stats()
+    print(f"batched: {stats['batches']} batches, largest {stats['max_batch_seen']} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Compares search_products' ranked in-memory index against the old ILIKE '%q%' scan.
+#
+#   python -m benchmarks.bench_search                  # against the database in settings.DB_CONFIG
+#   python -m benchmarks.bench_search --synthetic 50000  # no database; the scan is emulated in Python
+import argparse
+import random
+import statistics
+import time
+
+from search_index import SearchIndex
+
+ILIKE_SQL = ("select product_id, product_name, description, price, image_urls from products "
+             "where product_name ilike %s or description ilike %s;")
+QUERIES = ['shirt', 'blue', 'cot', 'cotton shirt', 'ceramic mug', 'wireles', 'leather bag', 'xl', 'organic', 'lamp']
+
+_WORDS = ['red', 'blue', 'green', 'black', 'cotton', 'leather', 'wireless', 'organic', 'ceramic', 'steel',
+          'shirt', 'jeans', 'mug', 'lamp', 'bag', 'shoes', 'headphones', 'speaker', 'table', 'chair',
+          'xl', 'small', 'large', 'premium', 'classic', 'vintage', 'eco', 'portable', 'smart', 'kids']
+
+
+def synthetic_products(count, seed=7, vocabulary=5000):
+    # Common catalog words plus a long tail of generated ones, drawn with a skewed distribution
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = _WORDS + [''.join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(vocabulary)]
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    rows = []
+    for product_id in range(1, count + 1):
+        name = ' '.join(rng.choices(words, weights, k=3))
+        description = ' '.join(rng.choices(words, weights, k=20))
+        tags = rng.choices(words, weights, k=2)
+        rows.append((product_id, name, description, tags))
+    return rows
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{label:<28} mean {statistics.mean(samples):8.3f} ms   p50 {statistics.median(samples):8.3f} ms"
+          f"   p95 {p95:8.3f} ms")
+
+
+def run_synthetic(count, repeat, limit):
+    rows = synthetic_products(count)
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    print(f"Indexed {count} products in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    lowered = [(pid, (name or '').lower(), (description or '').lower()) for pid, name, description, _ in rows]
+    scan_samples, index_samples = [], []
+    for query in QUERIES:
+        q = query.lower()
+        scanned, samples = timed(lambda: [pid for pid, n, d in lowered if q in n or q in d], repeat)
+        scan_samples.extend(samples)
+        ranked, samples = timed(lambda: index.search(query, limit=limit), repeat)
+        index_samples.extend(samples)
+        print(f"  {query!r:<16} scan hits {len(scanned):>6}   index hits {len(ranked):>3}")
+    report('emulated ILIKE scan', scan_samples)
+    report('search index', index_samples)
+
+
+def run_database(repeat, limit):
+    from settings import checkout_connection, release_connection
+
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        index = SearchIndex()
+        started = time.perf_counter()
+        index.rebuild(cur)
+        print(f"Indexed {index.stats()['documents']} products in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        def ilike(query):
+            cur.execute(ILIKE_SQL, (f"%{query}%", f"%{query}%"))
+            return cur.fetchall()
+
+        def indexed(query):
+            ranked = index.search(query, limit=limit)
+            cur.execute('select product_id, product_name, description, price, image_urls from products '
+                        'where product_id = any(%s);', ([pid for pid, _ in ranked],))
+            return cur.fetchall()
+
+        ilike_samples, index_samples = [], []
+        for query in QUERIES:
+            scanned, samples = timed(lambda: ilike(query), repeat)
+            ilike_samples.extend(samples)
+            fetched, samples = timed(lambda: indexed(query), repeat)
+            index_samples.extend(samples)
+            print(f"  {query!r:<16} ILIKE rows {len(scanned):>6}   index rows {len(fetched):>3}")
+        report('ILIKE query', ilike_samples)
+        report('search index + fetch', index_samples)
+    finally:
+        release_connection(conn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark search_products: search index vs ILIKE')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='benchmark N generated products without a database')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+    if args.synthetic:
+        run_synthetic(args.synthetic, args.repeat, args.limit)
+    else:
+        run_database(args.repeat, args.limit)
@@ -0,0 +1,153 @@
+# Compares per-worker memory and product lookup latency for a catalog held as Python dicts in every worker
+# against the shared memory-mapped snapshot. Each mode starts --workers fresh processes that load the catalog
+# the way a worker would and then report RSS, PSS (shared pages split between the processes mapping them)
+# and the median time of --lookups random product lookups.
+#
+#   python -m benchmarks.bench_snapshot --synthetic 200000 --workers 4
+#   python -m benchmarks.bench_snapshot --workers 4          # catalog from the configured database
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from catalog_snapshot import CatalogSnapshot, write_snapshot
+
+_WORDS = ['red', 'blue', 'steel', 'oak', 'linen', 'large', 'small', 'classic', 'modern', 'lamp', 'chair', 'table',
+          'shirt', 'kettle', 'rug', 'mug', 'desk', 'sofa', 'frame', 'vase']
+
+
+def synthetic_catalog(count, seed=7):
+    rng = random.Random(seed)
+    products = []
+    for i in range(1, count + 1):
+        products.append((i, ' '.join(rng.choices(_WORDS, k=3)), ' '.join(rng.choices(_WORDS, k=30)),
+                         f'{rng.randint(100, 50000) / 100:.2f}',
+                         [f'https://img.example.com/{i}/{n}.jpg' for n in range(rng.randint(1, 4))],
+                         rng.random() < 0.02))
+    categories = [(i, f'category-{i}', f'Synthetic category {i}', None if i <= 10 else rng.randint(1, 10))
+                  for i in range(1, 201)]
+    filters = [(i, f'filter-{i}', rng.randint(1, 200), None, 'multi',
+                [{'option_id': i * 100 + n, 'option_value': f'{rng.choice(_WORDS)}-{n}'} for n in range(20)])
+               for i in range(1, 401)]
+    return products, categories, filters
+
+
+def database_catalog():
+    from catalog_snapshot import PRODUCTS_SQL, CATEGORIES_SQL, FILTERS_SQL
+    from settings import checkout_connection, release_connection
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        catalog = []
+        for sql in (PRODUCTS_SQL, CATEGORIES_SQL, FILTERS_SQL):
+            cur.execute(sql)
+            catalog.append(cur.fetchall())
+        conn.rollback()
+    finally:
+        release_connection(conn)
+    return tuple(catalog)
+
+
+def memory_kb():
+    rss = pss = 0
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    except FileNotFoundError:
+        pss = rss
+    return rss, pss
+
+
+def worker(mode, source, path, lookups, ids, ready, go, results):
+    if mode == 'dicts':
+        # What a worker keeps when it caches the catalog endpoints' dicts itself
+        products, categories, filters = synthetic_catalog(source) if source else database_catalog()
+        by_id = {row[0]: {'product_id': row[0], 'product_name': row[1], 'description': row[2], 'price': row[3],
+                          'image_urls': row[4]} for row in products}
+        kept = (by_id, [{'category_id': c[0], 'name': c[1], 'description': c[2], 'parent_category_id': c[3]}
+                        for c in categories], list(filters))
+        del products, categories, filters
+        lookup = by_id.get
+    else:
+        snapshot = CatalogSnapshot(path)
+        kept = snapshot
+        # Serve the whole catalog once, as a busy worker eventually would, so its pages are resident
+        after = None
+        while True:
+            page, after = snapshot.products_page(after, 1000)
+            if after is None:
+                break
+        snapshot.categories()
+        snapshot.filters()
+        lookup = snapshot.product
+    ready.put(os.getpid())
+    # Measure once every worker holds the catalog, so PSS reflects the sharing
+    go.wait()
+    rss, pss = memory_kb()
+    samples = []
+    for product_id in ids[:lookups]:
+        started = time.perf_counter()
+        lookup(product_id)
+        samples.append((time.perf_counter() - started) * 1e6)
+    results.put((rss, pss, statistics.median(samples)))
+    del kept
+
+
+def run_mode(mode, source, path, workers, lookups, ids):
+    ctx = multiprocessing.get_context('spawn')
+    ready, results, go = ctx.Queue(), ctx.Queue(), ctx.Event()
+    processes = [ctx.Process(target=worker, args=(mode, source, path, lookups, ids, ready, go, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+    go.set()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-worker catalog memory and lookup latency')
+    parser.add_argument('--synthetic', type=int, default=0, help='generate this many products instead of reading '
+                                                                   'the database')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    catalog = synthetic_catalog(args.synthetic) if args.synthetic else database_catalog()
+    product_ids = [row[0] for row in catalog[0]]
+    rng = random.Random(1)
+    ids = [rng.choice(product_ids) for _ in range(args.lookups)]
+    with tempfile.TemporaryDirectory(dir='/dev/shm' if os.path.isdir('/dev/shm') else None) as tmp:
+        path = os.path.join(tmp, 'catalog.snap')
+        started = time.perf_counter()
+        write_snapshot(path, 1, *catalog)
+        build_s = time.perf_counter() - started
+        del catalog
+        print(f"{len(product_ids)} products, snapshot {os.path.getsize(path) / 1024 / 1024:.1f} MiB "
+              f"written in {build_s:.2f}s")
+        print(f"{'mode':<10}{'workers':>8}{'RSS MiB/worker':>16}{'PSS MiB/worker':>16}{'PSS MiB total':>15}"
+              f"{'lookup us':>11}")
+        for mode in ('dicts', 'snapshot'):
+            reports = run_mode(mode, args.synthetic, path, args.workers, args.lookups, ids)
+            rss = statistics.mean(r[0] for r in reports) / 1024
+            pss = statistics.mean(r[1] for r in reports) / 1024
+            lookup_us = statistics.median(r[2] for r in reports)
+            print(f"{mode:<10}{args.workers:>8}{rss:>16.1f}{pss:>16.1f}{pss * args.workers:>15.1f}"
+                  f"{lookup_us:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
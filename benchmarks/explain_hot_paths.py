@@ -0,0 +1,155 @@
+# EXPLAINs every lookup the request path makes against a seeded database with enable_seqscan off, and exits
+# non-zero when any of them still plans a Seq Scan, i.e. no index can serve it. Nothing is executed: writes
+# are only planned, and the transaction is rolled back. Whole-table loads (get_categories, the category tree,
+# facet and search index rebuilds, catalog snapshots) scan on purpose and are not listed.
+#
+#   python -m benchmarks.seed --reset         # applies the migrations first
+#   python -m benchmarks.explain_hot_paths
+#   python -m benchmarks.explain_hot_paths --verbose    # print every plan
+#
+# Statements registered in statements.STATEMENTS are picked up automatically; queries written inline in
+# app.py, admin_apis and inventory.py are listed in hot_queries() and need adding there when a route gains one.
+import argparse
+import json
+import sys
+
+from admin_apis import UPSERT_ROW_SQL, PRODUCT_COLUMNS
+from app import FILTER_UPDATE_SQL, FILTERED_PRODUCT_FIELDS
+from benchmarks.bench_prepared import sample_params
+from projection import PRODUCT_FIELDS, CUSTOMER_FIELDS
+from settings import checkout_connection, release_connection
+from statements import STATEMENTS, FILTER_SELECT, FILTER_COLUMNS, FILTER_JOINS, plain_sql
+
+
+def hot_queries(cur):
+    params = sample_params(cur)
+    product_id = params['product_by_id'][0]
+    category_id = params['live_category_by_id'][0]
+    category_name = params['live_category_id_by_name'][0]
+    filter_id = params['filter_with_options'][0]
+    email, customer_id = params['other_customer_id_by_email']
+    product_ids = list(range(product_id, product_id + 50))
+
+    queries = [(f'statement {name}', plain_sql(name), params[name]) for name in STATEMENTS]
+    queries += [
+        ('get_products page', PRODUCT_FIELDS.select(PRODUCT_FIELDS.presets['list']) +
+         ' WHERE product_id > %s ORDER BY product_id LIMIT %s;', (product_id, 101)),
+        ('get_product projected', PRODUCT_FIELDS.select(PRODUCT_FIELDS.presets['card'] + ('updated_at',)) +
+         ' WHERE product_id = %s;', (product_id,)),
+        ('get_featured_products', 'select product_id, product_name, description, price, image_urls from products '
+                                  'where featured = true;', ()),
+        ('get_category_products', 'select product_id, product_name, description, price, image_urls from products p '
+                                  'where exists (select 1 from product_category pc where pc.product_id = p.product_id '
+                                  'and pc.category_id = any(%s)) and p.product_id > %s order by p.product_id limit %s;',
+         ([category_id], product_id, 101)),
+        ('filter_products', PRODUCT_FIELDS.select(FILTERED_PRODUCT_FIELDS) +
+         ' WHERE product_id = any(%s) ORDER BY product_id;', (product_ids,)),
+        ('search_products', PRODUCT_FIELDS.select(PRODUCT_FIELDS.presets['list']) + ' WHERE product_id = any(%s);',
+         (product_ids,)),
+        ('get_filters by category', FILTER_SELECT +
+         'WHERE f.filter_id IN (SELECT filter_id FROM Filter WHERE category_id = %s '
+         'UNION SELECT filter_id FROM filter_category WHERE category_id = %s) '
+         'GROUP BY f.filter_id, c.category_name ORDER BY f.filter_id;', (category_id, category_id)),
+        ('bulk_update_filters categories', 'SELECT category_name, category_id FROM Category '
+         'WHERE category_name = ANY(%s) AND deleted_at IS NULL;', ([category_name],)),
+        ('update_filter', FILTER_UPDATE_SQL, {'filter_id': filter_id, 'filter_name': 'Color', 'filter_type': 'multi',
+                                              'category_id': category_id, 'replace': True, 'options': ['red', 'blue']}),
+        ('delete_filter', 'DELETE FROM Filter WHERE filter_id=%s;', (filter_id,)),
+        ('update_category', 'UPDATE Category SET category_name = %s,description = %s,parent_category_id = %s,'
+                            'updated_at = NOW() WHERE category_id = %s;', (category_name, None, None, category_id)),
+        ('delete_category', 'UPDATE Category SET deleted_at = NOW() WHERE category_id = %s', (category_id,)),
+        ('get_customers page', CUSTOMER_FIELDS.select(CUSTOMER_FIELDS.presets['detail']) +
+         ' WHERE customer_id > %s ORDER BY customer_id LIMIT %s;', (customer_id, 101)),
+        ('get_customers version', "SELECT md5(string_agg(customer_id || ':' || COALESCE(updated_at::text, ''), ',' "
+                                  "ORDER BY customer_id)), max(updated_at) FROM (SELECT customer_id, updated_at "
+                                  "FROM Customer WHERE customer_id > %s ORDER BY customer_id LIMIT %s) page;",
+         (customer_id, 101)),
+        ('update_customer password', 'SELECT password FROM Customer WHERE customer_id = %s;', (customer_id,)),
+        ('delete_customer', 'SELECT * FROM Customer WHERE customer_id = %s AND deleted_at IS NULL;', (customer_id,)),
+        ('batch get_category', 'SELECT category_id, category_name, description, parent_category_id FROM Category '
+                               'WHERE category_name = ANY(%s) AND deleted_at IS NULL;', ([category_name],)),
+        ('batch get_filter', FILTER_SELECT + 'WHERE f.filter_id = ANY(%s) GROUP BY f.filter_id, c.category_name;',
+         ([filter_id],)),
+        ('batch get_filters', 'WITH links AS (SELECT filter_id, category_id FROM Filter WHERE category_id = ANY(%s) '
+                              'UNION SELECT filter_id, category_id FROM filter_category WHERE category_id = ANY(%s)) '
+                              f'SELECT links.category_id, {FILTER_COLUMNS} FROM links '
+                              f'JOIN Filter f ON f.filter_id = links.filter_id {FILTER_JOINS}'
+                              'GROUP BY links.category_id, f.filter_id, c.category_name ORDER BY f.filter_id;',
+         ([category_id], [category_id])),
+        ('batch get_customer', 'SELECT customer_id, customer_fname, customer_lname, email, phone_number, address, '
+                               'points_balance, points_redeemed FROM Customer WHERE customer_id = ANY(%s);',
+         ([customer_id],)),
+        ('customer by email', 'SELECT customer_id FROM Customer WHERE email = %s;', (email,)),
+        ('bulk_import row upsert', UPSERT_ROW_SQL, tuple('x' if column in ('product_name', 'sku') else None
+                                                         for column in PRODUCT_COLUMNS)),
+        ('facet refresh_product', 'SELECT category_id FROM product_category WHERE product_id = %s;', (product_id,)),
+        ('facet refresh_filter', 'SELECT category_id FROM Filter WHERE filter_id = %s '
+                                 'UNION SELECT category_id FROM filter_category WHERE filter_id = %s;',
+         (filter_id, filter_id)),
+        ('reservation lookup', 'SELECT product_id, status FROM stock_reservation WHERE reservation_id = %s;', (1,)),
+        ('reservation expiry', "UPDATE stock_reservation SET status = 'expired', updated_at = NOW() "
+                               "WHERE product_id = %s AND status = 'held' AND expires_at < NOW() RETURNING quantity;",
+         (product_id,)),
+        ('reservation finish', "UPDATE stock_reservation SET updated_at = NOW(), "
+                               "status = CASE WHEN reservation_id = ANY(%s) THEN 'confirmed' ELSE 'released' END "
+                               "WHERE reservation_id = ANY(%s) AND product_id = %s AND status = 'held' "
+                               "RETURNING reservation_id, quantity, status;", ([1], [1, 2], product_id)),
+        ('reservation stock lock', 'SELECT COALESCE(available_qty, 0) FROM Products WHERE product_id = %s FOR UPDATE;',
+         (product_id,)),
+    ]
+    return queries
+
+
+def seq_scans(plan):
+    # Relations read by Seq Scan nodes anywhere in a FORMAT JSON plan
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(cur, sql, params):
+    cur.execute('SAVEPOINT explain_hot_path;')
+    try:
+        cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cur.fetchone()[0]
+    finally:
+        cur.execute('ROLLBACK TO SAVEPOINT explain_hot_path;')
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail when a hot query plans a sequential scan')
+    parser.add_argument('--verbose', action='store_true', help='print the plan of every query')
+    args = parser.parse_args()
+
+    conn = checkout_connection()
+    failures = 0
+    try:
+        cur = conn.cursor()
+        cur.execute('SET LOCAL enable_seqscan = off;')
+        for name, sql, params in hot_queries(cur):
+            try:
+                plan = explain(cur, sql, params)
+            except Exception as e:
+                failures += 1
+                print(f"{name:<34} ERROR     {str(e).strip().splitlines()[0]}")
+                continue
+            scanned = seq_scans(plan)
+            if scanned:
+                failures += 1
+            print(f"{name:<34} {'SEQ SCAN' if scanned else 'ok':<9} {', '.join(filter(None, scanned))}")
+            if args.verbose:
+                print(json.dumps(plan, indent=2))
+    finally:
+        conn.rollback()
+        release_connection(conn)
+    print(f"{failures} of the hot queries fall back to a sequential scan or failed to plan" if failures
+          else 'Every hot query is served by an index')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# Replays a request mix against a running instance at fixed concurrency and reports throughput,
+# p50/p95/p99 latency and SQL statements per request (from the /metrics endpoint).
+#
+#   flask --app admin_apis run                            # serves app.py and admin_apis routes
+#   python -m benchmarks.seed --reset
+#   python -m benchmarks.loadtest --concurrency 32 --duration 60 --output benchmarks/results/run.json
+#   python -m benchmarks.loadtest --traffic traffic.jsonl --compare benchmarks/results/run.json
+#
+# A traffic file has one JSON object per line: {"method", "path", "json", "query", "weight", "request_id"}.
+# Lines without a path (for example backlog entries with only request_id/title/body) are skipped.
+# Without --traffic the mix is built from the seed manifest and touches every /app/v1 endpoint.
+import argparse
+import http.client
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+MANIFEST = 'benchmarks/seed_manifest.json'
+READ_WEIGHT = 10
+WRITE_WEIGHT = 1
+
+
+class RequestSpec:
+    __slots__ = ('name', 'method', 'path', 'body', 'query', 'weight')
+
+    def __init__(self, name, method, path, body=None, query=None, weight=1):
+        self.name = name
+        self.method = method.upper()
+        self.path = path
+        self.body = body
+        self.query = query
+        self.weight = weight
+
+    def target(self):
+        return self.path + ('?' + urlencode(self.query) if self.query else '')
+
+
+def load_traffic(path):
+    specs, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not entry.get('path'):
+                skipped += 1
+                continue
+            name = entry.get('request_id') or entry.get('name') or entry['path'].rsplit('/', 1)[-1]
+            specs.append(RequestSpec(name, entry.get('method', 'GET'), entry['path'], entry.get('json'),
+                                     entry.get('query'), entry.get('weight', 1)))
+    return specs, skipped
+
+
+def default_mix(manifest, include_writes=True, include_deletes=False):
+    # Payload factories are re-evaluated per request so ids and search terms vary
+    rng = random.Random()
+    counter = itertools.count()
+    first_product, last_product = manifest['product_ids']
+    first_customer, last_customer = manifest['customer_ids']
+    category_ids = manifest['category_ids']
+
+    def product_id():
+        return rng.randint(first_product, last_product)
+
+    def category():
+        i = rng.randrange(len(category_ids))
+        return category_ids[i], manifest['category_names'][i]
+
+    def filter_options():
+        category_id, _ = category()
+        values = manifest['option_values'].get(str(category_id)) or ['red']
+        return {'category': category_id, 'filter_options': rng.sample(values, min(2, len(values)))}
+
+    reads = [
+        ('get_products', 'GET', '/app/v1/products/get_products', None,
+         lambda: {'after': rng.randint(first_product, last_product), 'limit': 50}),
+        ('get_product', 'GET', '/app/v1/products/get_product', lambda: {'product_id': product_id()}, None),
+        ('search_products', 'GET', '/app/v1/products/search_products',
+         lambda: {'query': ' '.join(rng.sample(manifest['search_terms'], rng.randint(1, 2)))}, None),
+        ('get_featured_products', 'GET', '/app/v1/products/get_featured_products', None, None),
+        ('filter_products', 'GET', '/app/v1/products/filter_products', filter_options, None),
+        ('get_filters', 'GET', '/app/v1/filters/get_filters', None, lambda: {'category_id': category()[0]}),
+        ('get_filter', 'GET', '/app/v1/filters/get_filter',
+         lambda: {'filter_id': rng.choice(manifest['filter_ids'])}, None),
+        ('get_categories', 'GET', '/app/v1/categories/get_categories', None, None),
+        ('get_category', 'GET', '/app/v1/categories/get_category', lambda: {'category_name': category()[1]}, None),
+        ('get_customers', 'GET', '/app/v1/customers/get_customers', None,
+         lambda: {'after': rng.randint(first_customer, last_customer), 'limit': 50}),
+        ('get_customer', 'GET', '/app/v1/customers/get_customer',
+         lambda: {'customer_id': rng.randint(first_customer, last_customer)}, None),
+    ]
+    writes = [
+        ('create_product', 'POST', '/app/v1/products/create_product',
+         lambda: {'product_name': 'loadtest product', 'sku': f'LT-{time.time_ns()}-{next(counter)}',
+                  'description': 'created by loadtest', 'price': '9.99', 'available_qty': 10, 'featured': False,
+                  'is_active': True, 'in_order': 0, 'image_urls': [], 'tags': ['loadtest']}, None),
+        ('update_product', 'PUT', '/app/v1/products/update_product',
+         lambda: {'product_id': product_id(), 'product_name': 'updated by loadtest', 'sku': f'LTU-{time.time_ns()}',
+                  'price': '19.99', 'available_qty': 5, 'featured': False, 'is_active': True, 'in_order': 0,
+                  'image_urls': [], 'tags': ['loadtest']}, None),
+        ('create_category', 'POST', '/app/v1/categories/create_category',
+         lambda: {'name': f'lt-{time.time_ns()}', 'description': 'loadtest', 'parent_category_id': None}, None),
+        ('update_category', 'PUT', '/app/v1/categories/update_category',
+         lambda: {'category_name': category()[1], 'description': 'updated by loadtest',
+                  'parent_category_id': None}, None),
+        ('create_filter', 'POST', '/app/v1/filters/create_filter',
+         lambda: {'filter_name': 'Loadtest', 'category_name': category()[1], 'filter_type': 'single',
+                  'filter_options': []}, None),
+        ('update_filter', 'PUT', '/app/v1/filters/update_filter',
+         lambda: {'filter_id': rng.choice(manifest['filter_ids']), 'filter_name': 'Color',
+                  'category_name': category()[1], 'filter_type': 'multi', 'options': ['red', 'blue', 'green']},
+         None),
+        ('create_customer', 'POST', '/app/v1/customers/create_customer',
+         lambda: {'customer_fname': 'load', 'customer_lname': 'test', 'email': f'lt{time.time_ns()}@example.com',
+                  'password': 'loadtest', 'phone_number': '+15550000000', 'address': '1 Test St'}, None),
+        ('update_customer', 'PUT', '/app/v1/customers/update_customer',
+         lambda: {'customer_id': rng.randint(first_customer, last_customer), 'customer_fname': 'load',
+                  'customer_lname': 'test', 'email': f'ltu{time.time_ns()}@example.com', 'password': None,
+                  'phone_number': '+15550000000', 'address': '2 Test St'}, None),
+    ]
+    scratch_filters = iter(manifest.get('scratch_filter_ids', []))
+    scratch_customers = iter(manifest.get('scratch_customer_ids', []))
+    scratch_categories = iter(manifest.get('scratch_category_names', []))
+    deletes = [
+        ('delete_filter', 'DELETE', '/app/v1/filters/delete_filter',
+         lambda: {'filter_id': next(scratch_filters, 0)}, None),
+        ('delete_customer', 'DELETE', '/app/v1/customers/delete_customer',
+         lambda: {'customer_id': next(scratch_customers, 0)}, None),
+        ('delete_category', 'DELETE', '/app/v1/categories/delete_category',
+         lambda: {'category_name': next(scratch_categories, '')}, None),
+    ]
+
+    mix = [(spec, READ_WEIGHT) for spec in reads]
+    if include_writes:
+        mix += [(spec, WRITE_WEIGHT) for spec in writes]
+    if include_deletes:
+        mix += [(spec, WRITE_WEIGHT) for spec in deletes]
+    return [DynamicSpec(name, method, path, body, query, weight) for (name, method, path, body, query), weight in mix]
+
+
+class DynamicSpec(RequestSpec):
+    __slots__ = ('body_factory', 'query_factory')
+
+    def __init__(self, name, method, path, body_factory, query_factory, weight):
+        super().__init__(name, method, path, weight=weight)
+        self.body_factory = body_factory
+        self.query_factory = query_factory
+
+    def materialize(self):
+        return RequestSpec(self.name, self.method, self.path, self.body_factory() if self.body_factory else None,
+                           self.query_factory() if self.query_factory else None)
+
+
+def send(conn, spec):
+    body = json.dumps(spec.body).encode() if spec.body is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(spec.method, spec.target(), body=body, headers=headers)
+    response = conn.getresponse()
+    payload = response.read()
+    return response.status, len(payload)
+
+
+def scrape_metrics(base_url):
+    # Returns {endpoint: (requests, statements)} from the Prometheus text at /metrics
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    try:
+        conn.request('GET', '/metrics')
+        text = conn.getresponse().read().decode()
+    except OSError:
+        return None
+    finally:
+        conn.close()
+    requests, statements = {}, {}
+    for line in text.splitlines():
+        if line.startswith('http_requests_total{') or line.startswith('db_statements_total{'):
+            labels, value = line.rsplit(' ', 1)
+            endpoint = labels.split('endpoint="', 1)[1].split('"', 1)[0]
+            target = requests if line.startswith('http_requests_total') else statements
+            target[endpoint] = target.get(endpoint, 0) + float(value)
+    return {endpoint: (requests.get(endpoint, 0), statements.get(endpoint, 0)) for endpoint in requests}
+
+
+def run(base_url, specs, concurrency, duration=None, total=None, timeout=30):
+    parts = urlsplit(base_url)
+    weights = [spec.weight for spec in specs]
+    results = []
+    results_lock = threading.Lock()
+    issued = itertools.count()
+    deadline = time.monotonic() + duration if duration else None
+
+    def worker():
+        rng = random.Random()
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        local = []
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if total is not None and next(issued) >= total:
+                break
+            spec = rng.choices(specs, weights)[0]
+            if isinstance(spec, DynamicSpec):
+                spec = spec.materialize()
+            started = time.perf_counter()
+            try:
+                status, size = send(conn, spec)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+                status, size = 0, 0
+            local.append((spec.name, status, time.perf_counter() - started, size))
+        conn.close()
+        with results_lock:
+            results.extend(local)
+
+    before = scrape_metrics(base_url)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    after = scrape_metrics(base_url)
+    return summarize(results, elapsed, concurrency, before, after)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _latency_summary(latencies, count, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': count,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p95_ms': _percentile(latencies, 95) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def summarize(results, elapsed, concurrency, before, after):
+    by_name = {}
+    for name, status, latency, size in results:
+        by_name.setdefault(name, []).append((status, latency, size))
+    endpoints = {}
+    for name, samples in sorted(by_name.items()):
+        summary = _latency_summary([s[1] for s in samples], len(samples), elapsed)
+        summary['errors'] = sum(1 for s in samples if s[0] == 0 or s[0] >= 500)
+        summary['bytes'] = sum(s[2] for s in samples)
+        if before is not None and after is not None and name in after:
+            requests = after[name][0] - before.get(name, (0, 0))[0]
+            statements = after[name][1] - before.get(name, (0, 0))[1]
+            summary['queries_per_request'] = statements / requests if requests else None
+        endpoints[name] = summary
+    overall = _latency_summary([r[2] for r in results], len(results), elapsed)
+    overall['errors'] = sum(e['errors'] for e in endpoints.values())
+    if before is not None and after is not None:
+        requests = sum(v[0] for v in after.values()) - sum(v[0] for v in before.values())
+        statements = sum(v[1] for v in after.values()) - sum(v[1] for v in before.values())
+        overall['queries_per_request'] = statements / requests if requests else None
+    return {'concurrency': concurrency, 'duration_s': elapsed, 'overall': overall, 'endpoints': endpoints}
+
+
+def print_report(report, baseline=None):
+    def fmt(summary, base):
+        qpr = summary.get('queries_per_request')
+        line = (f"{summary['requests']:>8} {summary['throughput']:>9.1f} {summary['p50_ms']:>9.2f} "
+                f"{summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f} {summary['errors']:>7} "
+                f"{qpr if qpr is not None else float('nan'):>8.2f}")
+        if base:
+            delta = (summary['p99_ms'] - base['p99_ms']) / base['p99_ms'] * 100 if base['p99_ms'] else 0.0
+            line += f"   p99 {delta:+6.1f}%   rps {summary['throughput'] - base['throughput']:+8.1f}"
+        return line
+
+    print(f"concurrency {report['concurrency']}, {report['duration_s']:.1f}s")
+    print(f"{'endpoint':<24}{'reqs':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} "
+          f"{'q/req':>8}")
+    for name, summary in report['endpoints'].items():
+        base = baseline['endpoints'].get(name) if baseline else None
+        print(f"{name:<24}{fmt(summary, base)}")
+    print(f"{'TOTAL':<24}{fmt(report['overall'], baseline['overall'] if baseline else None)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a request mix against a running instance')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--traffic', help='JSONL file of requests to replay instead of the seeded mix')
+    parser.add_argument('--manifest', default=MANIFEST)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to run (ignored with --requests)')
+    parser.add_argument('--requests', type=int, help='stop after this many requests')
+    parser.add_argument('--read-only', action='store_true', help='leave create/update endpoints out of the mix')
+    parser.add_argument('--include-deletes', action='store_true', help='also hit delete endpoints on scratch rows')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='previous JSON report to diff against')
+    args = parser.parse_args()
+
+    if args.traffic:
+        specs, skipped = load_traffic(args.traffic)
+        if skipped:
+            print(f"Skipped {skipped} lines without a path")
+    else:
+        with open(args.manifest) as f:
+            specs = default_mix(json.load(f), include_writes=not args.read_only,
+                                include_deletes=args.include_deletes)
+    if not specs:
+        parser.error('no requests to replay')
+
+    report = run(args.base_url, specs, args.concurrency, duration=None if args.requests else args.duration,
+                 total=args.requests)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        import os
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
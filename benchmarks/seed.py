@@ -0,0 +1,168 @@
+# Seeds the database in settings.DB_CONFIG with a synthetic catalog for load testing and writes a
+# manifest of the generated ids that benchmarks.loadtest builds its request mix from.
+#
+#   python -m benchmarks.seed --products 50000 --customers 20000 --reset
+import argparse
+import json
+import random
+from decimal import Decimal
+
+from psycopg2.extras import execute_values
+
+from migrations import migrate
+from settings import checkout_connection, release_connection
+
+MANIFEST = 'benchmarks/seed_manifest.json'
+
+_ADJECTIVES = ['red', 'blue', 'green', 'black', 'white', 'organic', 'wireless', 'leather', 'cotton', 'steel',
+               'vintage', 'classic', 'premium', 'portable', 'smart', 'eco', 'compact', 'deluxe', 'mini', 'pro']
+_NOUNS = ['shirt', 'jeans', 'mug', 'lamp', 'bag', 'shoes', 'headphones', 'speaker', 'table', 'chair', 'watch',
+          'jacket', 'bottle', 'backpack', 'keyboard', 'monitor', 'blanket', 'pillow', 'kettle', 'camera']
+_FILTERS = [('Color', 'multi', ['red', 'blue', 'green', 'black', 'white']),
+            ('Size', 'single', ['xs', 's', 'm', 'l', 'xl']),
+            ('Material', 'multi', ['cotton', 'leather', 'steel', 'wood', 'plastic']),
+            ('Brand', 'multi', [f'brand{i}' for i in range(12)]),
+            ('Rating', 'single', ['1', '2', '3', '4', '5'])]
+_FIRST = ['ava', 'liam', 'noah', 'emma', 'mia', 'ravi', 'sara', 'omar', 'li', 'yuki', 'arjun', 'zoe']
+_LAST = ['smith', 'patel', 'garcia', 'kim', 'nguyen', 'khan', 'brown', 'rossi', 'silva', 'reddy']
+
+
+def reset(cur):
+    cur.execute('TRUNCATE product_category, filter_category, FilterOption, Filter, products, Category, Customer '
+                'RESTART IDENTITY CASCADE;')
+
+
+def seed_categories(cur, rng, count, scratch):
+    # Roughly a quarter are top level, the rest hang under an earlier category
+    category_ids = []
+    for i in range(count):
+        parent = rng.choice(category_ids) if category_ids and i >= count // 4 else None
+        cur.execute('INSERT INTO Category (category_name, description, parent_category_id) VALUES (%s, %s, %s) '
+                    'RETURNING category_id;', (f'category-{i}', f'Synthetic category {i}', parent))
+        category_ids.append(cur.fetchone()[0])
+    scratch_names = [f'scratch-category-{i}' for i in range(scratch)]
+    execute_values(cur, 'INSERT INTO Category (category_name, description) VALUES %s',
+                   [(name, 'Reserved for delete_category') for name in scratch_names])
+    return category_ids, scratch_names
+
+
+def seed_filters(cur, rng, category_ids, filters_per_category, scratch):
+    filter_ids = []
+    option_values = {}
+    for category_id in category_ids:
+        for name, filter_type, values in rng.sample(_FILTERS, min(filters_per_category, len(_FILTERS))):
+            cur.execute('INSERT INTO Filter (filter_name, category_id, filter_type) VALUES (%s, %s, %s) '
+                        'RETURNING filter_id;', (name, category_id, filter_type))
+            filter_id = cur.fetchone()[0]
+            cur.execute('INSERT INTO filter_category (filter_id, category_id) VALUES (%s, %s);',
+                        (filter_id, category_id))
+            execute_values(cur, 'INSERT INTO FilterOption (filter_id, option_value) VALUES %s',
+                           [(filter_id, value) for value in values])
+            filter_ids.append(filter_id)
+            option_values.setdefault(category_id, []).extend(values)
+    scratch_ids = []
+    for i in range(scratch):
+        cur.execute('INSERT INTO Filter (filter_name, category_id, filter_type) VALUES (%s, %s, %s) '
+                    'RETURNING filter_id;', (f'scratch-{i}', rng.choice(category_ids), 'single'))
+        scratch_ids.append(cur.fetchone()[0])
+    return filter_ids, option_values, scratch_ids
+
+
+def seed_products(cur, rng, count, category_ids, option_values, batch_size=5000):
+    product_ids = []
+    for start in range(0, count, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, count)):
+            name = f'{rng.choice(_ADJECTIVES)} {rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)}'
+            description = ' '.join(rng.choices(_ADJECTIVES + _NOUNS, k=30))
+            category_id = rng.choice(category_ids)
+            values = option_values.get(category_id) or ['generic']
+            tags = rng.sample(values, min(3, len(values)))
+            rows.append((name, f'SKU-{i:08d}', description, Decimal(rng.randint(100, 50000)) / 100, None,
+                         rng.randint(1, 10), 'pcs', rng.randint(0, 500), rng.random() < 0.02, True, None, 0,
+                         [f'https://img.example.com/{i}/{n}.jpg' for n in range(rng.randint(1, 4))], tags,
+                         category_id))
+        returned = execute_values(
+            cur, 'INSERT INTO products (product_name, sku, description, price, discount_id, capacity, units, '
+                 'available_qty, featured, is_active, vendor_id, in_order, image_urls, tags) VALUES %s '
+                 'RETURNING product_id', [row[:-1] for row in rows], fetch=True)
+        ids = [r[0] for r in returned]
+        execute_values(cur, 'INSERT INTO product_category (product_id, category_id) VALUES %s',
+                       [(product_id, row[-1]) for product_id, row in zip(ids, rows)])
+        product_ids.extend(ids)
+    return product_ids
+
+
+def seed_customers(cur, rng, count, batch_size=5000):
+    # Every customer shares one pre-hashed password so seeding does not spend minutes hashing
+    from werkzeug.security import generate_password_hash
+    password = generate_password_hash('loadtest')
+    customer_ids = []
+    emails = []
+    for start in range(0, count, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, count)):
+            email = f'customer{i}@example.com'
+            rows.append((rng.choice(_FIRST), rng.choice(_LAST), email, password, f'+1555{i:07d}',
+                         f'{rng.randint(1, 999)} Main St', rng.randint(0, 5000), rng.randint(0, 2000)))
+            emails.append(email)
+        returned = execute_values(
+            cur, 'INSERT INTO Customer (customer_fname, customer_lname, email, password, phone_number, address, '
+                 'points_balance, points_redeemed) VALUES %s RETURNING customer_id', rows, fetch=True)
+        customer_ids.extend(r[0] for r in returned)
+    return customer_ids, emails
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    # Creates the tables and indexes on a fresh database; a no-op once they are in place
+    migrate()
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        if args.reset:
+            reset(cur)
+        category_ids, scratch_categories = seed_categories(cur, rng, args.categories, args.scratch)
+        filter_ids, option_values, scratch_filters = seed_filters(cur, rng, category_ids, args.filters_per_category,
+                                                                  args.scratch)
+        product_ids = seed_products(cur, rng, args.products, category_ids, option_values)
+        customer_ids, emails = seed_customers(cur, rng, args.customers + args.scratch)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+    manifest = {
+        'seed': args.seed,
+        'category_ids': category_ids,
+        'category_names': [f'category-{i}' for i in range(len(category_ids))],
+        'filter_ids': filter_ids,
+        'option_values': {str(k): sorted(set(v)) for k, v in option_values.items()},
+        'product_ids': [product_ids[0], product_ids[-1]] if product_ids else [],
+        'customer_ids': [customer_ids[0], customer_ids[args.customers - 1]] if args.customers else [],
+        'customer_emails': emails[:1000],
+        # Rows reserved for delete endpoints so a load test never removes the catalog it reads
+        'scratch_category_names': scratch_categories,
+        'scratch_filter_ids': scratch_filters,
+        'scratch_customer_ids': customer_ids[args.customers:],
+        'search_terms': _ADJECTIVES + _NOUNS,
+    }
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f)
+    print(f"Seeded {len(category_ids)} categories, {len(filter_ids)} filters, {len(product_ids)} products, "
+          f"{len(customer_ids)} customers; manifest written to {args.manifest}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Seed a local database with a synthetic catalog')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--filters-per-category', type=int, default=4)
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--scratch', type=int, default=200, help='extra categories/filters/customers for delete endpoints')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='truncate the catalog tables first')
+    parser.add_argument('--manifest', default=MANIFEST)
+    seed(parser.parse_args())
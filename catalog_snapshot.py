@@ -0,0 +1,362 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_right
+
+from statements import FILTER_SELECT
+
+# A catalog snapshot is one file of typed, 8-byte aligned arrays: a column per field, with every string stored
+# once in a shared table and referenced by index (-1 for NULL), and list-valued fields as an offsets array into
+# a flat values array. Workers mmap the file read-only, so its pages are shared between them and only the rows
+# a request touches are ever turned into Python objects.
+MAGIC = b'CATSNAP1'
+HEADER = struct.Struct('<8sQI')
+SECTION = struct.Struct('<8s1sxxxQQ')
+
+PRODUCTS_SQL = ('SELECT product_id, product_name, description, price::text, image_urls, featured FROM products '
+                'ORDER BY product_id;')
+CATEGORIES_SQL = ('SELECT category_id, category_name, description, parent_category_id FROM Category '
+                  'WHERE deleted_at IS NULL ORDER BY category_id;')
+FILTERS_SQL = FILTER_SELECT + 'GROUP BY f.filter_id, c.category_name ORDER BY f.filter_id;'
+FILTER_LINKS_SQL = 'SELECT filter_id, category_id FROM filter_category ORDER BY filter_id, category_id;'
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self._strings = {}
+        self._sections = {}
+
+    def intern(self, value):
+        if value is None:
+            return -1
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+        return index
+
+    def column(self, name, typecode):
+        return self._sections.setdefault(name, array(typecode))
+
+    def write(self, path, version):
+        data = bytearray()
+        offsets = array('q', [0])
+        for value in self._strings:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        sections = dict(self._sections, str_off=offsets, str_data=array('B', data))
+
+        table_size = HEADER.size + SECTION.size * len(sections)
+        position = _align(table_size)
+        entries = []
+        for name, values in sections.items():
+            length = len(values) * values.itemsize
+            entries.append((name, values, position, length))
+            position = _align(position + length)
+
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, version, len(sections)))
+            for name, values, offset, length in entries:
+                f.write(SECTION.pack(name.encode('ascii'), values.typecode.encode('ascii'), offset, length))
+            for name, values, offset, length in entries:
+                f.write(b'\0' * (offset - f.tell()))
+                values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _align(position):
+    return (position + 7) & ~7
+
+
+def write_snapshot(path, version, products, categories, filters, filter_links=()):
+    # products: (product_id, product_name, description, price text, image_urls, featured) ordered by product_id
+    # categories: (category_id, category_name, description, parent_category_id) ordered by category_id
+    # filters: load_filters rows ordered by filter_id; filter_links: (filter_id, category_id) from filter_category
+    writer = SnapshotWriter()
+    p_id, p_name, p_desc, p_price = (writer.column('p_id', 'q'), writer.column('p_name', 'i'),
+                                     writer.column('p_desc', 'i'), writer.column('p_price', 'i'))
+    p_img_off, p_img = writer.column('p_imgoff', 'q'), writer.column('p_img', 'i')
+    p_img_null, p_featured = writer.column('p_imgnul', 'b'), writer.column('p_feat', 'b')
+    p_img_off.append(0)
+    for product_id, name, description, price, image_urls, featured in products:
+        p_id.append(product_id)
+        p_name.append(writer.intern(name))
+        p_desc.append(writer.intern(description))
+        p_price.append(writer.intern(price))
+        p_img.extend(writer.intern(url) for url in image_urls or ())
+        p_img_off.append(len(p_img))
+        p_img_null.append(1 if image_urls is None else 0)
+        p_featured.append(1 if featured else 0)
+
+    c_id, c_name, c_desc, c_parent = (writer.column('c_id', 'q'), writer.column('c_name', 'i'),
+                                      writer.column('c_desc', 'i'), writer.column('c_parent', 'q'))
+    for category_id, name, description, parent_category_id in categories:
+        c_id.append(category_id)
+        c_name.append(writer.intern(name))
+        c_desc.append(writer.intern(description))
+        c_parent.append(-1 if parent_category_id is None else parent_category_id)
+
+    links = {}
+    for filter_id, category_id in filter_links:
+        links.setdefault(filter_id, []).append(category_id)
+    f_id, f_name, f_cat, f_cat_name, f_type = (writer.column('f_id', 'q'), writer.column('f_name', 'i'),
+                                               writer.column('f_cat', 'q'), writer.column('f_catnm', 'i'),
+                                               writer.column('f_type', 'i'))
+    f_opt_off, o_id = writer.column('f_optoff', 'q'), writer.column('o_id', 'q')
+    o_value = writer.column('o_value', 'i')
+    f_link_off, f_link = writer.column('f_lnkoff', 'q'), writer.column('f_link', 'q')
+    f_opt_off.append(0)
+    f_link_off.append(0)
+    for filter_id, name, category_id, category_name, filter_type, options in filters:
+        f_id.append(filter_id)
+        f_name.append(writer.intern(name))
+        f_cat.append(-1 if category_id is None else category_id)
+        f_cat_name.append(writer.intern(category_name))
+        f_type.append(writer.intern(filter_type))
+        for option in options:
+            o_id.append(option['option_id'])
+            o_value.append(writer.intern(option['option_value']))
+        f_opt_off.append(len(o_id))
+        f_link.extend(links.get(filter_id, ()))
+        f_link_off.append(len(f_link))
+
+    writer.write(path, version)
+
+
+class CatalogSnapshot:
+    # Read-only view of a snapshot file. Columns are memoryviews straight over the mapping; nothing is copied
+    # until a row is materialized.
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        view = memoryview(self._map)
+        magic, self.version, count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        # Every section becomes an attribute named after it (self.p_id, self.str_off, ...)
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(view, HEADER.size + i * SECTION.size)
+            column = view[offset:offset + length]
+            typecode = typecode.decode('ascii')
+            setattr(self, name.rstrip(b'\0').decode('ascii'), column.cast(typecode) if typecode != 'B' else column)
+
+    def string(self, index):
+        if index < 0:
+            return None
+        str_off = self.str_off
+        return str(self.str_data[str_off[index]:str_off[index + 1]], 'utf-8')
+
+    def __len__(self):
+        return len(self.p_id)
+
+    def _image_urls(self, i):
+        start, end = self.p_imgoff[i], self.p_imgoff[i + 1]
+        return None if self.p_imgnul[i] else [self.string(j) for j in self.p_img[start:end]]
+
+    def _product(self, i):
+        return {
+            'product_id': self.p_id[i],
+            'product_name': self.string(self.p_name[i]),
+            'description': self.string(self.p_desc[i]),
+            'price': self.string(self.p_price[i]),
+            'image_urls': self._image_urls(i)
+        }
+
+    def _product_fields(self, i, fields):
+        # Only the requested columns are decoded, so card views skip descriptions and image lists
+        return {field: PRODUCT_GETTERS[field](self, i) for field in fields}
+
+    def has_product_fields(self, fields):
+        return all(field in PRODUCT_GETTERS for field in fields)
+
+    def product(self, product_id, fields=None):
+        i = bisect_right(self.p_id, product_id) - 1
+        if i < 0 or self.p_id[i] != product_id:
+            return None
+        return self._product(i) if fields is None else self._product_fields(i, fields)
+
+    def products_page(self, after, limit, fields=None):
+        # Same contract as fetch_page: rows strictly after the cursor and the cursor for the next page
+        start = bisect_right(self.p_id, after) if after is not None else 0
+        end = min(start + limit, len(self.p_id))
+        if fields is None:
+            products = [self._product(i) for i in range(start, end)]
+        else:
+            products = [self._product_fields(i, fields) for i in range(start, end)]
+        next_cursor = self.p_id[end - 1] if end < len(self.p_id) and end > start else None
+        return products, next_cursor
+
+    def featured_products(self):
+        return [self._product(i) for i in range(len(self.p_id)) if self.p_feat[i]]
+
+    def categories(self):
+        return [{'category_id': self.c_id[i], 'name': self.string(self.c_name[i]),
+                 'description': self.string(self.c_desc[i]),
+                 'parent_category_id': self.c_parent[i] if self.c_parent[i] >= 0 else None}
+                for i in range(len(self.c_id))]
+
+    def filters(self, category_id=None):
+        filters = []
+        for i in range(len(self.f_id)):
+            if category_id is not None and self.f_cat[i] != category_id \
+                    and category_id not in self.f_link[self.f_lnkoff[i]:self.f_lnkoff[i + 1]].tolist():
+                continue
+            start, end = self.f_optoff[i], self.f_optoff[i + 1]
+            filters.append({
+                'filter_id': self.f_id[i],
+                'filter_name': self.string(self.f_name[i]),
+                'category_id': self.f_cat[i] if self.f_cat[i] >= 0 else None,
+                'category_name': self.string(self.f_catnm[i]),
+                'filter_type': self.string(self.f_type[i]),
+                'options': [{'option_id': self.o_id[j], 'option_value': self.string(self.o_value[j])}
+                            for j in range(start, end)]
+            })
+        return filters
+
+
+# Product columns a snapshot can serve, for projected reads (?fields=)
+PRODUCT_GETTERS = {
+    'product_id': lambda snapshot, i: snapshot.p_id[i],
+    'product_name': lambda snapshot, i: snapshot.string(snapshot.p_name[i]),
+    'description': lambda snapshot, i: snapshot.string(snapshot.p_desc[i]),
+    'price': lambda snapshot, i: snapshot.string(snapshot.p_price[i]),
+    'image_urls': CatalogSnapshot._image_urls,
+    'featured': lambda snapshot, i: bool(snapshot.p_feat[i]),
+}
+
+
+class SnapshotManager:
+    # One per worker process. current() hands out the mapped snapshot and, at most every check_interval
+    # seconds, notices a newer file published by any worker and maps that instead. request_rebuild() asks a
+    # background thread to rebuild from the database; requests that arrive during a rebuild are coalesced
+    # into the next one. Builds across processes are serialized with a lock file and published with
+    # os.replace, so readers only ever see a complete file. Every rebuild request bumps a generation, and a
+    # mapped snapshot is only handed out once a build started at or after the latest request has been
+    # mapped; until then current() returns None and callers read from the database, so a write is never
+    # followed by a read of the file from before it.
+    def __init__(self, path, connect, release, check_interval=1.0, on_swap=None):
+        self.path = path
+        self.check_interval = check_interval
+        self._connect = connect
+        self._release = release
+        self._on_swap = on_swap
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._requested = 0
+        self._built = 0
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._builder = None
+        self._stats = {'swaps': 0, 'builds': 0, 'build_failures': 0, 'build_seconds_total': 0.0}
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._refresh()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.generation < self._requested:
+            return None
+        return snapshot
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.request_rebuild()
+            return
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.identity == (stat.st_ino, stat.st_mtime_ns):
+            # Mapped just before the build that published it was counted; the file is still at least that new
+            snapshot.generation = max(snapshot.generation, self._built)
+            return
+        with self._lock:
+            if self._snapshot is not snapshot:
+                return
+            # The old mapping is unmapped once the last request using it lets go
+            mapped = CatalogSnapshot(self.path)
+            mapped.generation = self._built
+            self._snapshot = mapped
+            self._stats['swaps'] += 1
+        if snapshot is not None and self._on_swap is not None:
+            self._on_swap()
+
+    def request_rebuild(self):
+        with self._lock:
+            self._requested += 1
+            self._dirty.set()
+            if self._builder is None:
+                self._builder = threading.Thread(target=self._build_loop, name='catalog-snapshot', daemon=True)
+                self._builder.start()
+
+    def _build_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            # Requests after this point set _dirty again and get a build of their own
+            generation = self._requested
+            started = time.perf_counter()
+            try:
+                self.rebuild()
+            except Exception:
+                with self._lock:
+                    self._stats['build_failures'] += 1
+                continue
+            with self._lock:
+                self._stats['builds'] += 1
+                self._stats['build_seconds_total'] += time.perf_counter() - started
+                self._built = max(self._built, generation)
+            self._checked_at = 0.0
+
+    def rebuild(self):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                version = 0
+                try:
+                    with open(self.path, 'rb') as f:
+                        version = HEADER.unpack(f.read(HEADER.size))[1]
+                except (FileNotFoundError, struct.error):
+                    pass
+                conn = self._connect()
+                failed = False
+                try:
+                    cur = conn.cursor()
+                    # One snapshot of the database for every table that goes into the file
+                    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;')
+                    cur.execute(PRODUCTS_SQL)
+                    products = cur.fetchall()
+                    cur.execute(CATEGORIES_SQL)
+                    categories = cur.fetchall()
+                    cur.execute(FILTERS_SQL)
+                    filters = cur.fetchall()
+                    cur.execute(FILTER_LINKS_SQL)
+                    links = cur.fetchall()
+                    conn.rollback()
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    self._release(conn, error=failed)
+                tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                write_snapshot(tmp_path, version + 1, products, categories, filters, links)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def stats(self):
+        snapshot = self._snapshot
+        with self._lock:
+            stats = dict(self._stats)
+        stats['path'] = self.path
+        stats['version'] = snapshot.version if snapshot is not None else None
+        stats['stale'] = snapshot is not None and snapshot.generation < self._requested
+        stats['products'] = len(snapshot) if snapshot is not None else 0
+        stats['bytes'] = os.path.getsize(self.path) if snapshot is not None else 0
+        return stats
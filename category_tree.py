@@ -0,0 +1,120 @@
+import threading
+import time
+
+CATEGORY_SQL = ('SELECT category_id, category_name, description, parent_category_id FROM Category '
+                'WHERE deleted_at IS NULL')
+
+
+class CategoryTree:
+    # Keeps live categories in memory with a materialized ancestor path per node, so subtree,
+    # nested tree and breadcrumb lookups never need a recursive query. Categories whose parent is
+    # missing or deleted are treated as roots.
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._nodes = {}
+        self._children = {}
+        self._paths = {}
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.ttl
+
+    def rebuild(self, cur):
+        cur.execute(CATEGORY_SQL + ' ORDER BY category_id;')
+        nodes = {row[0]: _node(row) for row in cur.fetchall()}
+        with self._lock:
+            self._nodes = nodes
+            self._children = {}
+            for category_id, node in nodes.items():
+                self._children.setdefault(node['parent_category_id'], []).append(category_id)
+            self._paths = {}
+            for root_id in self._root_ids():
+                self._index_subtree(root_id)
+            self._built_at = time.monotonic()
+
+    def refresh_category(self, cur, category_id):
+        cur.execute(CATEGORY_SQL + ' AND category_id = %s;', (category_id,))
+        row = cur.fetchone()
+        with self._lock:
+            if self._built_at is None:
+                return
+            old = self._nodes.pop(category_id, None)
+            if old is not None:
+                siblings = self._children.get(old['parent_category_id'], [])
+                if category_id in siblings:
+                    siblings.remove(category_id)
+            if row is None:
+                # Deleted: its children are re-rooted until they are moved
+                for child_id in self._children.get(category_id, []):
+                    self._index_subtree(child_id)
+                self._paths.pop(category_id, None)
+                return
+            node = _node(row)
+            self._nodes[category_id] = node
+            siblings = self._children.setdefault(node['parent_category_id'], [])
+            siblings.append(category_id)
+            siblings.sort()
+            self._index_subtree(category_id)
+
+    def _root_ids(self):
+        return sorted(cid for cid, node in self._nodes.items() if node['parent_category_id'] not in self._nodes)
+
+    def _index_subtree(self, category_id):
+        # Recomputes ancestor paths for a node and everything under it
+        parent_id = self._nodes[category_id]['parent_category_id']
+        parent_path = self._paths.get(parent_id, ()) if parent_id in self._nodes else ()
+        if category_id in parent_path:
+            # A cycle in parent_category_id; cut it here
+            parent_path = ()
+        stack = [(category_id, parent_path)]
+        while stack:
+            current, prefix = stack.pop()
+            path = prefix + (current,)
+            self._paths[current] = path
+            for child_id in self._children.get(current, ()):
+                if child_id in self._nodes and child_id not in path:
+                    stack.append((child_id, path))
+
+    def __contains__(self, category_id):
+        return category_id in self._nodes
+
+    def descendants(self, category_id, include_self=True):
+        with self._lock:
+            if category_id not in self._nodes:
+                return []
+            result = [category_id] if include_self else []
+            stack = list(self._children.get(category_id, ()))
+            seen = {category_id}
+            while stack:
+                current = stack.pop()
+                if current in seen or current not in self._nodes:
+                    continue
+                seen.add(current)
+                result.append(current)
+                stack.extend(self._children.get(current, ()))
+            return result
+
+    def breadcrumbs(self, category_id):
+        with self._lock:
+            path = self._paths.get(category_id)
+            if path is None:
+                return None
+            return [{'category_id': cid, 'name': self._nodes[cid]['name']} for cid in path]
+
+    def tree(self, root_id=None):
+        with self._lock:
+            if root_id is not None:
+                return self._subtree(root_id, set()) if root_id in self._nodes else None
+            return [self._subtree(cid, set()) for cid in self._root_ids()]
+
+    def _subtree(self, category_id, seen):
+        seen.add(category_id)
+        node = dict(self._nodes[category_id])
+        node['children'] = [self._subtree(child_id, seen) for child_id in self._children.get(category_id, ())
+                            if child_id in self._nodes and child_id not in seen]
+        return node
+
+
+def _node(row):
+    return {'category_id': row[0], 'name': row[1], 'description': row[2], 'parent_category_id': row[3]}
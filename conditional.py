@@ -0,0 +1,46 @@
+from datetime import timezone
+
+from flask import Response
+
+
+def http_datetime(value):
+    # HTTP dates have second resolution and are UTC; updated_at columns are naive UTC timestamps
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def version_etag(kind, key, updated_at, variant=None):
+    # Rows that were never updated have no updated_at and keep the same tag until their first update.
+    # variant tells apart representations of the same row, e.g. different ?fields= projections.
+    version = f'{updated_at.timestamp():.6f}' if updated_at is not None else 'new'
+    etag = f'{kind}-{key}-{version}'
+    return f'{etag}-{variant}' if variant else etag
+
+
+def is_conditional(request):
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    # If-None-Match wins over If-Modified-Since when a client sends both
+    if request.if_none_match:
+        return etag is not None and request.if_none_match.contains_weak(etag)
+    last_modified = http_datetime(last_modified)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def add_validators(response, etag=None, last_modified=None):
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = http_datetime(last_modified)
+    return response
+
+
+def not_modified(etag=None, last_modified=None):
+    return add_validators(Response(status=304), etag, last_modified)
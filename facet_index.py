@@ -0,0 +1,220 @@
+import threading
+import time
+
+from statements import execute_prepared
+
+# Product sets are kept as int bitmaps over dense positions (bit n set => the product at
+# position n), so AND/OR across facets is a single big-int operation and counts are popcounts.
+#
+# The schema has no table linking products to filter options: FilterOption only lists the values a
+# filter offers, and the old SQL in filter_products checked that a selected option existed for the
+# category without relating it to the product, so it never narrowed the result. Here a product carries
+# an option when Products.tags holds the option value, compared trimmed and case-insensitively (a
+# "Color: Red" option matches products tagged "red"). Products without such a tag drop out as soon as
+# one of its filter's options is selected.
+
+
+def bitmap_ids(bits):
+    ids = []
+    digits = bin(bits)[:1:-1]
+    i = digits.find('1')
+    while i != -1:
+        ids.append(i)
+        i = digits.find('1', i + 1)
+    return ids
+
+
+class FacetIndex:
+    # A product carries a filter option when one of its tags matches the option value
+    # (case-insensitive); category membership comes from product_category. Positions are handed
+    # out in product_id order on rebuild and appended for products created since, so bitmaps are
+    # as wide as the catalog rather than max(product_id). Only tags equal to some option value are
+    # indexed; any other free-text tag can never match a facet.
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._positions = {}
+        self._product_ids = []
+        self._option_values = frozenset()
+        self._category_products = {}
+        self._tag_products = {}
+        self._product_categories = {}
+        self._product_tags = {}
+        self._options = {}
+        self._filter_options = {}
+        self._filter_categories = {}
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.ttl
+
+    def rebuild(self, cur):
+        positions = {}
+        product_ids = []
+        category_products = {}
+        tag_products = {}
+        product_categories = {}
+        product_tags = {}
+        options = {}
+        filter_options = {}
+        filter_categories = {}
+
+        cur.execute('SELECT option_id, filter_id, option_value FROM FilterOption;')
+        for option_id, filter_id, option_value in cur.fetchall():
+            options[option_id] = (filter_id, option_value)
+            filter_options.setdefault(filter_id, set()).add(option_id)
+        option_values = _option_values(options)
+        cur.execute('SELECT product_id, tags FROM products ORDER BY product_id;')
+        for product_id, tags in cur.fetchall():
+            bit = 1 << len(product_ids)
+            positions[product_id] = len(product_ids)
+            product_ids.append(product_id)
+            tags = _normalize_tags(tags) & option_values
+            if tags:
+                product_tags[product_id] = tags
+            for tag in tags:
+                tag_products[tag] = tag_products.get(tag, 0) | bit
+        cur.execute('SELECT product_id, category_id FROM product_category;')
+        for product_id, category_id in cur.fetchall():
+            if product_id not in positions:
+                continue
+            product_categories.setdefault(product_id, set()).add(category_id)
+            category_products[category_id] = category_products.get(category_id, 0) | (1 << positions[product_id])
+        cur.execute('SELECT filter_id, category_id FROM Filter UNION SELECT filter_id, category_id FROM filter_category;')
+        for filter_id, category_id in cur.fetchall():
+            filter_categories.setdefault(filter_id, set()).add(category_id)
+
+        with self._lock:
+            self._positions = positions
+            self._product_ids = product_ids
+            self._option_values = option_values
+            self._category_products = category_products
+            self._tag_products = tag_products
+            self._product_categories = product_categories
+            self._product_tags = product_tags
+            self._options = options
+            self._filter_options = filter_options
+            self._filter_categories = filter_categories
+            self._built_at = time.monotonic()
+
+    def refresh_product(self, cur, product_id):
+        cur.execute('SELECT tags FROM products WHERE product_id = %s;', (product_id,))
+        row = cur.fetchone()
+        cur.execute('SELECT category_id FROM product_category WHERE product_id = %s;', (product_id,))
+        categories = {r[0] for r in cur.fetchall()}
+        with self._lock:
+            if self._built_at is None:
+                return
+            position = self._positions.get(product_id)
+            if position is None:
+                if row is None:
+                    return
+                position = self._positions[product_id] = len(self._product_ids)
+                self._product_ids.append(product_id)
+            bit = 1 << position
+            for tag in self._product_tags.pop(product_id, ()):
+                if tag in self._tag_products:
+                    self._tag_products[tag] &= ~bit
+            for category_id in self._product_categories.pop(product_id, ()):
+                self._category_products[category_id] &= ~bit
+            if row is None:
+                # The position stays unused until the next rebuild
+                del self._positions[product_id]
+                self._product_ids[position] = None
+                return
+            tags = _normalize_tags(row[0]) & self._option_values
+            if tags:
+                self._product_tags[product_id] = tags
+            for tag in tags:
+                self._tag_products[tag] = self._tag_products.get(tag, 0) | bit
+            self._product_categories[product_id] = categories
+            for category_id in categories:
+                self._category_products[category_id] = self._category_products.get(category_id, 0) | bit
+
+    def refresh_filter(self, cur, filter_id):
+        cur.execute('SELECT category_id FROM Filter WHERE filter_id = %s '
+                    'UNION SELECT category_id FROM filter_category WHERE filter_id = %s;', (filter_id, filter_id))
+        categories = {r[0] for r in cur.fetchall()}
+        execute_prepared(cur, 'filter_options_by_filter', (filter_id,))
+        option_rows = cur.fetchall()
+        with self._lock:
+            if self._built_at is None:
+                return
+            for option_id in self._filter_options.pop(filter_id, ()):
+                self._options.pop(option_id, None)
+            self._filter_categories.pop(filter_id, None)
+            if categories or option_rows:
+                self._filter_categories[filter_id] = categories
+                self._filter_options[filter_id] = {option_id for option_id, _ in option_rows}
+                for option_id, option_value in option_rows:
+                    self._options[option_id] = (filter_id, option_value)
+            option_values = _option_values(self._options)
+            if option_values - self._option_values:
+                # Product tags for a new value were never indexed; rebuild on the next search
+                self._built_at = None
+            for tag in self._option_values - option_values:
+                self._tag_products.pop(tag, None)
+            self._option_values = option_values
+
+    def search(self, category_ids, option_values=(), with_counts=False):
+        with self._lock:
+            base = 0
+            for category_id in category_ids:
+                base |= self._category_products.get(category_id, 0)
+            filters = [f for f, cats in self._filter_categories.items() if cats & set(category_ids)]
+
+            # Options are OR-ed within a filter and the filters are AND-ed together
+            wanted = {str(v).strip().lower() for v in option_values}
+            selected = {}
+            for filter_id in filters:
+                for option_id in self._filter_options.get(filter_id, ()):
+                    if self._options[option_id][1].strip().lower() in wanted:
+                        selected[filter_id] = selected.get(filter_id, 0) | self._option_bits(option_id)
+
+            matched = base
+            for bits in selected.values():
+                matched &= bits
+
+            counts = []
+            if with_counts:
+                for filter_id in filters:
+                    # Counts for a filter ignore its own selection so sibling options stay meaningful
+                    others = base
+                    for other_id, bits in selected.items():
+                        if other_id != filter_id:
+                            others &= bits
+                    for option_id in sorted(self._filter_options.get(filter_id, ())):
+                        counts.append({
+                            'filter_id': filter_id,
+                            'option_id': option_id,
+                            'option_value': self._options[option_id][1],
+                            'count': bin(others & self._option_bits(option_id)).count('1')
+                        })
+            product_ids = sorted(self._product_ids[position] for position in bitmap_ids(matched))
+        return product_ids, counts
+
+    def _option_bits(self, option_id):
+        return self._tag_products.get(self._options[option_id][1].strip().lower(), 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'products': len(self._positions),
+                'indexed_tags': len(self._tag_products),
+                'categories': len(self._category_products),
+                'filters': len(self._filter_options),
+                'options': len(self._options),
+                'age': None if self._built_at is None else time.monotonic() - self._built_at
+            }
+
+
+def _option_values(options):
+    return frozenset(option_value.strip().lower() for _, option_value in options.values())
+
+
+def _normalize_tags(tags):
+    if not tags:
+        return frozenset()
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return frozenset(str(tag).strip().lower() for tag in tags if str(tag).strip())
@@ -0,0 +1,255 @@
+import threading
+import time
+
+from psycopg2.extras import execute_values
+
+from settings import checkout_connection, release_connection
+
+# Held stock is moved from Products.available_qty to Products.in_order; confirming a hold takes it out of
+# in_order for good, releasing (or letting it expire) moves it back to available_qty. Applied by migrations.py.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS stock_reservation (
+    reservation_id BIGSERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES Products (product_id),
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    status TEXT NOT NULL DEFAULT 'held' CHECK (status IN ('held', 'confirmed', 'released', 'expired')),
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS stock_reservation_held_idx ON stock_reservation (product_id, expires_at)
+    WHERE status = 'held';
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, requested, available):
+        super().__init__(f"Only {available} of product {product_id} available, {requested} requested")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+class ProductNotFound(Exception):
+    pass
+
+
+class ReservationNotHeld(Exception):
+    def __init__(self, reservation_id, status):
+        super().__init__(f"Reservation {reservation_id} is {status or 'unknown'}, not held")
+        self.reservation_id = reservation_id
+        self.status = status
+
+
+class _Op:
+    __slots__ = ('kind', 'product_id', 'quantity', 'reservation_id', 'event', 'lead', 'result', 'error')
+
+    def __init__(self, kind, product_id, quantity=None, reservation_id=None):
+        self.kind = kind
+        self.product_id = product_id
+        self.quantity = quantity
+        self.reservation_id = reservation_id
+        self.event = threading.Event()
+        self.lead = False
+        self.result = None
+        self.error = None
+
+
+class StockReserver:
+    # Group commit per SKU. Reserve, confirm and release calls for the same product queue up; one of the
+    # waiting request threads becomes the leader, takes the product row lock once (SELECT ... FOR UPDATE),
+    # applies the whole queue in order against the locked quantity and writes a single UPDATE to Products.
+    # Whoever arrives while a batch is in flight queues for the next one, so a hot SKU costs one row lock
+    # per batch rather than one per checkout. Overselling is impossible because every grant is checked
+    # against available_qty under the row lock; several processes stay correct and simply batch less.
+    # A batch that moves stock bumps Products.updated_at and, once committed, calls on_change(product_id).
+    def __init__(self, hold_seconds=900, batch_window=0.002, max_batch=500, on_change=None):
+        self.hold_seconds = hold_seconds
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = set()
+        self._stats = {'batches': 0, 'ops': 0, 'reserved': 0, 'rejected': 0, 'confirmed': 0, 'released': 0,
+                       'expired': 0, 'max_batch_seen': 0}
+
+    def reserve(self, product_id, quantity):
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError('quantity must be a positive integer')
+        return self._submit(_Op('reserve', product_id, quantity=quantity))
+
+    def confirm(self, cur, reservation_id):
+        return self._submit(_Op('confirm', self._product_for(cur, reservation_id), reservation_id=reservation_id))
+
+    def release(self, cur, reservation_id):
+        return self._submit(_Op('release', self._product_for(cur, reservation_id), reservation_id=reservation_id))
+
+    def _product_for(self, cur, reservation_id):
+        cur.execute('SELECT product_id, status FROM stock_reservation WHERE reservation_id = %s;', (reservation_id,))
+        row = cur.fetchone()
+        if row is None:
+            raise ReservationNotHeld(reservation_id, None)
+        if row[1] != 'held':
+            raise ReservationNotHeld(reservation_id, row[1])
+        return row[0]
+
+    def _submit(self, op):
+        with self._lock:
+            self._pending.setdefault(op.product_id, []).append(op)
+            lead = op.product_id not in self._flushing
+            if lead:
+                self._flushing.add(op.product_id)
+        if lead:
+            self._lead(op.product_id)
+        while True:
+            op.event.wait()
+            if op.lead:
+                # The previous leader handed the queue over to this thread
+                op.lead = False
+                op.event.clear()
+                self._lead(op.product_id)
+                continue
+            if op.error is not None:
+                raise op.error
+            return op.result
+
+    def _lead(self, product_id):
+        if self.batch_window:
+            # Let concurrent requests for the same SKU join this batch
+            time.sleep(self.batch_window)
+        with self._lock:
+            queue = self._pending.pop(product_id, [])
+            batch, rest = queue[:self.max_batch], queue[self.max_batch:]
+            if rest:
+                self._pending[product_id] = rest
+        try:
+            self._flush(product_id, batch)
+        except Exception as e:
+            for op in batch:
+                if op.result is None and op.error is None:
+                    op.error = e
+        finally:
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['ops'] += len(batch)
+                self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+                queue = self._pending.get(product_id)
+                if queue:
+                    queue[0].lead = True
+                    queue[0].event.set()
+                else:
+                    self._flushing.discard(product_id)
+            for op in batch:
+                op.event.set()
+
+    def _flush(self, product_id, batch):
+        conn = checkout_connection()
+        failed = False
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT COALESCE(available_qty, 0) FROM Products WHERE product_id = %s FOR UPDATE;',
+                        (product_id,))
+            row = cur.fetchone()
+            if row is None:
+                for op in batch:
+                    op.error = ProductNotFound(f'Product with ID {product_id} does not exist')
+                conn.rollback()
+                return
+            available = stocked = row[0]
+            in_order_delta = 0
+            counts = {'reserved': 0, 'rejected': 0, 'confirmed': 0, 'released': 0, 'expired': 0}
+
+            # Lapsed holds go back on the shelf before anything else is decided
+            cur.execute("UPDATE stock_reservation SET status = 'expired', updated_at = NOW() "
+                        "WHERE product_id = %s AND status = 'held' AND expires_at < NOW() RETURNING quantity;",
+                        (product_id,))
+            for (quantity,) in cur.fetchall():
+                available += quantity
+                in_order_delta -= quantity
+                counts['expired'] += 1
+
+            # Confirms and releases first, so released stock can serve reservations in the same batch
+            finishing = [op for op in batch if op.kind != 'reserve']
+            if finishing:
+                confirm_ids = [op.reservation_id for op in finishing if op.kind == 'confirm']
+                cur.execute("UPDATE stock_reservation SET updated_at = NOW(), "
+                            "status = CASE WHEN reservation_id = ANY(%s) THEN 'confirmed' ELSE 'released' END "
+                            "WHERE reservation_id = ANY(%s) AND product_id = %s AND status = 'held' "
+                            "RETURNING reservation_id, quantity, status;",
+                            (confirm_ids, [op.reservation_id for op in finishing], product_id))
+                finished = {reservation_id: (quantity, status) for reservation_id, quantity, status in cur.fetchall()}
+                # Holds that lapsed just above, or were finished elsewhere since _product_for looked, keep
+                # their real status so the caller hears 'expired' or 'confirmed' rather than "does not exist"
+                statuses = {reservation_id: status for reservation_id, (_, status) in finished.items()}
+                missing = [op.reservation_id for op in finishing if op.reservation_id not in finished]
+                if missing:
+                    cur.execute('SELECT reservation_id, status FROM stock_reservation WHERE reservation_id = ANY(%s);',
+                                (missing,))
+                    statuses.update(cur.fetchall())
+                for op in finishing:
+                    quantity, status = finished.pop(op.reservation_id, (None, None))
+                    if status is None or status != op.kind + 'ed':
+                        # A second confirm/release of the same hold in this batch finds it already popped
+                        op.error = ReservationNotHeld(op.reservation_id, status or statuses.get(op.reservation_id))
+                        continue
+                    in_order_delta -= quantity
+                    if status == 'released':
+                        available += quantity
+                    counts[status] += 1
+                    op.result = {'reservation_id': op.reservation_id, 'product_id': product_id,
+                                 'quantity': quantity, 'status': status}
+
+            # Reservations are granted first come, first served against what is left
+            granted = []
+            for op in batch:
+                if op.kind != 'reserve':
+                    continue
+                if op.quantity > available:
+                    op.error = InsufficientStock(product_id, op.quantity, available)
+                    counts['rejected'] += 1
+                    continue
+                available -= op.quantity
+                in_order_delta += op.quantity
+                granted.append(op)
+            if granted:
+                rows = execute_values(
+                    cur, 'INSERT INTO stock_reservation (product_id, quantity, expires_at) VALUES %s '
+                         'RETURNING reservation_id, expires_at',
+                    [(product_id, op.quantity, self.hold_seconds) for op in granted],
+                    template="(%s, %s, NOW() + %s * INTERVAL '1 second')", page_size=len(granted), fetch=True)
+                for op, (reservation_id, expires_at) in zip(granted, rows):
+                    op.result = {'reservation_id': reservation_id, 'product_id': product_id,
+                                 'quantity': op.quantity, 'status': 'held',
+                                 'expires_at': expires_at.strftime('%Y-%m-%d %H:%M:%S')}
+                counts['reserved'] += len(granted)
+
+            changed = available != stocked or in_order_delta != 0
+            if changed:
+                # updated_at drives the product ETags, so stock moves must show up there too
+                cur.execute('UPDATE Products SET available_qty = %s, in_order = COALESCE(in_order, 0) + %s, '
+                            'updated_at = NOW() WHERE product_id = %s;', (available, in_order_delta, product_id))
+            conn.commit()
+            with self._lock:
+                for key, value in counts.items():
+                    self._stats[key] += value
+        except Exception:
+            failed = True
+            # Nothing was applied, so every op in the batch gets the database error instead
+            for op in batch:
+                op.result = op.error = None
+            raise
+        finally:
+            release_connection(conn, error=failed)
+        if changed and self._on_change is not None:
+            self._on_change(product_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = sum(len(queue) for queue in self._pending.values())
+            stats['hot_products'] = len(self._flushing)
+        stats['hold_seconds'] = self.hold_seconds
+        stats['batch_window'] = self.batch_window
+        stats['max_batch'] = self.max_batch
+        return stats
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+
+class BatchingRotatingFileHandler(RotatingFileHandler):
+    # Writes a whole batch of records with one write and one flush
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            if record.levelno < self.level:
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0:
+                self.stream.seek(0, 2)
+                if self.stream.tell() + sum(len(line) for line in lines) >= self.maxBytes:
+                    self.doRollover()
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+class LazyQueueHandler(QueueHandler):
+    # Only the message is rendered on the caller's thread; timestamps and the format string
+    # are applied by the listener thread. Once max_size records are waiting new ones are dropped
+    # instead of blocking the request.
+    def __init__(self, log_queue, max_size=10000):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The record is rendered in place rather than copied; handlers further up see the same message
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class BatchingQueueListener:
+    _sentinel = None
+
+    def __init__(self, log_queue, handler, batch_size=256, flush_interval=0.5):
+        self.queue = log_queue
+        self.handler = handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if record is self._sentinel:
+                    stopping = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self.handler.emit_batch(batch)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+        self.handler.close()
+
+
+class EndpointFilter(logging.Filter):
+    # Per-endpoint minimum levels and sampling of records below WARNING, keyed by Flask endpoint name
+    def __init__(self, levels=None, sample_rates=None):
+        super().__init__()
+        self.levels = levels or {}
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record):
+        if not self.levels and not self.sample_rates:
+            return True
+        from flask import has_request_context, request
+        if not has_request_context():
+            return True
+        endpoint = request.endpoint
+        if record.levelno < self.levels.get(endpoint, logging.NOTSET):
+            return False
+        rate = self.sample_rates.get(endpoint)
+        if rate is not None and record.levelno < logging.WARNING:
+            return random.random() < rate
+        return True
+
+
+def setup_async_handler(logger, log_file, level, formatter, max_bytes, backup_count, queue_size, batch_size,
+                        flush_interval, endpoint_levels=None, sample_rates=None):
+    file_handler = BatchingRotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setLevel(level)
+    file_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue, max_size=queue_size)
+    handler.setLevel(level)
+    handler.addFilter(EndpointFilter(endpoint_levels, sample_rates))
+    logger.addHandler(handler)
+
+    listener = BatchingQueueListener(log_queue, file_handler, batch_size=batch_size, flush_interval=flush_interval)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler, listener
@@ -0,0 +1,210 @@
+import threading
+import time
+
+from psycopg2.extensions import cursor as _cursor
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_time', 'rows', 'status', 'response_bytes', 'queries')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.status = None
+        self.response_bytes = 0
+        # (sql, vars, seconds, rows) for every statement, for the request listeners
+        self.queries = []
+
+
+def current_request_stats():
+    return getattr(_local, 'stats', None)
+
+
+class InstrumentedCursor(_cursor):
+    # Counts statements, time spent in the database and rows returned for the current request.
+    # Outside a request (scripts, streamed generators) it behaves like a plain cursor.
+    def execute(self, query, vars=None):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.db_time += elapsed
+            stats.statements += 1
+            rows = self.rowcount
+            if self.description is not None and rows > 0:
+                stats.rows += rows
+            stats.queries.append((query, vars, elapsed, rows))
+
+    def executemany(self, query, vars_list):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().executemany(query, vars_list)
+        vars_list = list(vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.db_time += elapsed
+            stats.statements += len(vars_list)
+            stats.queries.append((query, None, elapsed, self.rowcount))
+
+    def copy_expert(self, sql, file, size=8192):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().copy_expert(sql, file, size)
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.db_time += elapsed
+            stats.statements += 1
+            stats.queries.append((sql, None, elapsed, self.rowcount))
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._db_time = {}
+        self._requests = {}
+        self._statements = {}
+        self._rows = {}
+        self._response_bytes = {}
+        self._collectors = []
+        self._request_listeners = []
+
+    def add_request_listener(self, listener):
+        # listener(endpoint, stats) runs after every request, outside the registry lock
+        self._request_listeners.append(listener)
+
+    def record(self, endpoint, stats, elapsed):
+        status = str(stats.status or 500)
+        with self._lock:
+            latency = self._latency.get(endpoint)
+            if latency is None:
+                latency = self._latency[endpoint] = Histogram()
+                self._db_time[endpoint] = Histogram()
+            latency.observe(elapsed)
+            self._db_time[endpoint].observe(stats.db_time)
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._statements[endpoint] = self._statements.get(endpoint, 0) + stats.statements
+            self._rows[endpoint] = self._rows.get(endpoint, 0) + stats.rows
+            self._response_bytes[endpoint] = self._response_bytes.get(endpoint, 0) + stats.response_bytes
+        for listener in self._request_listeners:
+            listener(endpoint, stats)
+
+    def register_collector(self, collector):
+        # collector() returns (name, type, help, [(labels, value), ...]) tuples for extra gauges/counters
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, 'http_request_duration_seconds', 'Request latency by endpoint',
+                                    self._latency)
+            self._render_histograms(lines, 'db_time_per_request_seconds', 'Database time per request by endpoint',
+                                    self._db_time)
+            _render_family(lines, 'http_requests_total', 'counter', 'Requests by endpoint and status',
+                           [({'endpoint': e, 'status': s}, v) for (e, s), v in sorted(self._requests.items())])
+            _render_family(lines, 'db_statements_total', 'counter', 'SQL statements executed by endpoint',
+                           [({'endpoint': e}, v) for e, v in sorted(self._statements.items())])
+            _render_family(lines, 'db_rows_fetched_total', 'counter', 'Rows returned by SQL statements by endpoint',
+                           [({'endpoint': e}, v) for e, v in sorted(self._rows.items())])
+            _render_family(lines, 'http_response_bytes_total', 'counter', 'Response body bytes by endpoint',
+                           [({'endpoint': e}, v) for e, v in sorted(self._response_bytes.items())])
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                _render_family(lines, name, kind, help_text, samples)
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{endpoint="{_escape(endpoint)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{endpoint="{_escape(endpoint)}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{endpoint="{_escape(endpoint)}"}} {histogram.total}')
+            lines.append(f'{name}_count{{endpoint="{_escape(endpoint)}"}} {histogram.count}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_family(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        if labels:
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f'{name}{{{label_text}}} {value}')
+        else:
+            lines.append(f'{name} {value}')
+
+
+registry = MetricsRegistry()
+
+
+def init_app(app):
+    from flask import Response, request
+
+    @app.before_request
+    def start_request_metrics():
+        _local.stats = RequestStats()
+
+    @app.after_request
+    def capture_response_metrics(response):
+        stats = getattr(_local, 'stats', None)
+        if stats is not None:
+            stats.status = response.status_code
+            if not response.is_streamed:
+                stats.response_bytes = response.calculate_content_length() or 0
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exc):
+        stats = getattr(_local, 'stats', None)
+        _local.stats = None
+        if stats is None:
+            return
+        if exc is not None:
+            stats.status = 500
+        registry.record(request.endpoint or 'unmatched', stats, time.perf_counter() - stats.started)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
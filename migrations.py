@@ -0,0 +1,170 @@
+# Versioned schema for the service. Each migration runs once, in its own transaction, and is recorded in
+# schema_migrations; concurrent runs (several workers starting at once) wait on an advisory lock. Every
+# statement is IF NOT EXISTS, so an existing database that already has the tables is adopted as it is.
+#
+#   python -m migrations             # apply everything pending
+#   python -m migrations --status
+#   python -m migrations --target 2
+import argparse
+
+from inventory import SCHEMA_SQL as STOCK_RESERVATION_SQL
+from settings import checkout_connection, release_connection
+
+# pg_advisory_xact_lock key shared by every process that migrates this database
+LOCK_KEY = 725_400_001
+
+# Columns the routes may write as NULL (create_product passes whatever the client sent) stay nullable
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS Category (
+    category_id SERIAL PRIMARY KEY,
+    category_name TEXT NOT NULL,
+    description TEXT,
+    parent_category_id INTEGER REFERENCES Category (category_id),
+    updated_at TIMESTAMP,
+    deleted_at TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS Products (
+    product_id SERIAL PRIMARY KEY,
+    product_name TEXT NOT NULL,
+    sku TEXT,
+    description TEXT,
+    price NUMERIC(12, 2),
+    discount_id INTEGER,
+    capacity INTEGER,
+    units TEXT,
+    available_qty INTEGER DEFAULT 0,
+    featured BOOLEAN DEFAULT false,
+    is_active BOOLEAN DEFAULT true,
+    vendor_id INTEGER,
+    in_order INTEGER DEFAULT 0,
+    image_urls TEXT[],
+    tags TEXT[],
+    updated_at TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS product_category (
+    product_id INTEGER NOT NULL REFERENCES Products (product_id) ON DELETE CASCADE,
+    category_id INTEGER NOT NULL REFERENCES Category (category_id) ON DELETE CASCADE,
+    PRIMARY KEY (product_id, category_id)
+);
+CREATE TABLE IF NOT EXISTS Filter (
+    filter_id SERIAL PRIMARY KEY,
+    filter_name TEXT NOT NULL,
+    category_id INTEGER REFERENCES Category (category_id),
+    filter_type TEXT
+);
+CREATE TABLE IF NOT EXISTS FilterOption (
+    option_id SERIAL PRIMARY KEY,
+    filter_id INTEGER NOT NULL REFERENCES Filter (filter_id) ON DELETE CASCADE,
+    option_value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS filter_category (
+    filter_id INTEGER NOT NULL REFERENCES Filter (filter_id) ON DELETE CASCADE,
+    category_id INTEGER NOT NULL REFERENCES Category (category_id) ON DELETE CASCADE,
+    PRIMARY KEY (filter_id, category_id)
+);
+CREATE TABLE IF NOT EXISTS Customer (
+    customer_id SERIAL PRIMARY KEY,
+    customer_fname TEXT,
+    customer_lname TEXT,
+    email TEXT,
+    password TEXT,
+    phone_number TEXT,
+    address TEXT,
+    points_balance INTEGER DEFAULT 0,
+    points_redeemed INTEGER DEFAULT 0,
+    updated_at TIMESTAMP,
+    deleted_at TIMESTAMP
+);
+"""
+
+# One index per lookup the request path makes; benchmarks.explain_hot_paths checks they are used
+INDEXES_SQL = """
+-- ON CONFLICT (sku) in create/bulk import needs a unique index to infer the conflict target
+CREATE UNIQUE INDEX IF NOT EXISTS products_sku_key ON Products (sku);
+-- get_featured_products; featured products are a small slice of the catalog
+CREATE INDEX IF NOT EXISTS products_featured_idx ON Products (product_id) WHERE featured;
+-- Live categories by name (get_category, update/delete_category, batch); names are unique among live rows
+CREATE UNIQUE INDEX IF NOT EXISTS category_live_name_key ON Category (category_name) WHERE deleted_at IS NULL;
+-- category_id_by_name also matched soft-deleted rows (dropped again by migration 4)
+CREATE INDEX IF NOT EXISTS category_name_idx ON Category (category_name);
+CREATE INDEX IF NOT EXISTS customer_email_idx ON Customer (email);
+-- Options of a filter, and the option_value probes of the filter update CTE
+CREATE INDEX IF NOT EXISTS filteroption_filter_value_idx ON FilterOption (filter_id, option_value);
+CREATE INDEX IF NOT EXISTS filter_category_id_idx ON Filter (category_id);
+-- Reverse of the (filter_id, category_id) and (product_id, category_id) primary keys
+CREATE INDEX IF NOT EXISTS filter_category_category_idx ON filter_category (category_id, filter_id);
+CREATE INDEX IF NOT EXISTS product_category_category_idx ON product_category (category_id, product_id);
+"""
+
+MIGRATIONS = [
+    (1, 'tables', TABLES_SQL),
+    (2, 'stock reservations', STOCK_RESERVATION_SQL),
+    (3, 'hot path indexes', INDEXES_SQL),
+    # Every lookup by category name now skips soft-deleted rows, which category_live_name_key covers
+    (4, 'drop category_name_idx', 'DROP INDEX IF EXISTS category_name_idx;'),
+]
+
+_VERSIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+
+def applied_versions(cur):
+    cur.execute(_VERSIONS_SQL)
+    cur.execute('SELECT version FROM schema_migrations;')
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(target=None, log=print):
+    # Applies pending migrations up to target (all by default) and returns the versions it applied
+    applied = []
+    conn = checkout_connection()
+    failed = False
+    try:
+        cur = conn.cursor()
+        for version, name, sql in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            cur.execute('SELECT pg_advisory_xact_lock(%s);', (LOCK_KEY,))
+            if version in applied_versions(cur):
+                conn.rollback()
+                continue
+            cur.execute(sql)
+            cur.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s);', (version, name))
+            conn.commit()
+            applied.append(version)
+            log(f"Applied migration {version}: {name}")
+    except Exception:
+        failed = True
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn, error=failed)
+    return applied
+
+
+def status():
+    conn = checkout_connection()
+    try:
+        cur = conn.cursor()
+        done = applied_versions(cur)
+        conn.commit()
+    finally:
+        release_connection(conn)
+    return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply the versioned schema migrations')
+    parser.add_argument('--target', type=int, help='stop after this version')
+    parser.add_argument('--status', action='store_true', help='list migrations and whether they are applied')
+    args = parser.parse_args()
+    if args.status:
+        for version, name, done in status():
+            print(f"{version:>4}  {'applied' if done else 'pending':<8} {name}")
+    elif not migrate(args.target):
+        print('Nothing to apply')
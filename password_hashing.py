@@ -0,0 +1,107 @@
+import contextlib
+import math
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+
+_main_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _worker_main():
+    # Spawned workers import the parent's __main__ before anything else. Under `python app.py` that is the
+    # whole app, so every worker would build its own pool, caches, QueryLog and a second log writer on
+    # app.log. While workers may be started this module stands in as __main__, so they import only it.
+    with _main_lock:
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = sys.modules[__name__]
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main
+
+
+class HashingBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Password hashing is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    # Runs werkzeug's password hashing on a bounded process pool so it neither holds the GIL nor
+    # ties up request threads. At most max_pending hashes are queued or running; callers beyond that
+    # wait up to queue_timeout for a slot and are then turned away with HashingBusy.
+    def __init__(self, workers=2, max_pending=32, method='scrypt', salt_length=16, queue_timeout=0.5,
+                 timeout=10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.method = method
+        self.salt_length = salt_length
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._stats = {'hashed': 0, 'rejected': 0, 'failed': 0, 'hash_seconds_total': 0.0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, because forking a process that runs request threads and a connection pool is unsafe
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def hash(self, password):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusy(self._retry_after())
+        started = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            # The executor starts its worker processes from submit()
+            with _worker_main():
+                future = executor.submit(generate_password_hash, password, self.method, self.salt_length)
+            hashed = future.result(timeout=self.timeout)
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+        with self._lock:
+            self._stats['hashed'] += 1
+            self._stats['hash_seconds_total'] += time.perf_counter() - started
+        return hashed
+
+    def _retry_after(self):
+        with self._lock:
+            hashed = self._stats['hashed']
+            average = self._stats['hash_seconds_total'] / hashed if hashed else 0.1
+            backlog = self._pending / max(self.workers, 1)
+        return max(1, math.ceil(average * backlog))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        stats['max_pending'] = self.max_pending
+        stats['workers'] = self.workers
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
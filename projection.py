@@ -0,0 +1,101 @@
+import hashlib
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+class Projection:
+    # The columns of one table that clients may pick with ?fields=, by field name, plus named presets.
+    # A fields value is a comma-separated string or a JSON list mixing field and preset names, e.g.
+    # 'card,description'. Only whitelisted columns ever reach the generated SQL, and the key column always
+    # comes first so keyset pagination and lookups by id keep working.
+    def __init__(self, table, key, columns, presets):
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.presets = {name: tuple(fields) for name, fields in presets.items()}
+
+    def parse(self, value, default, rename=None):
+        # Field names in the order asked for, without duplicates. rename maps field names to the keys an
+        # endpoint responds with (e.g. product_id -> id); clients may ask for either.
+        default = self.presets[default] if isinstance(default, str) else tuple(default)
+        if value is None or value == '' or value == []:
+            return default
+        if isinstance(value, str):
+            value = value.split(',')
+        elif not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+            raise InvalidFields('fields must be a comma-separated string or a list of names')
+        aliases = {key: field for field, key in (rename or {}).items()}
+        fields = [self.key]
+        for name in (name.strip() for name in value):
+            if not name:
+                continue
+            name = aliases.get(name, name)
+            if name in self.presets:
+                fields.extend(self.presets[name])
+            elif name in self.columns:
+                fields.append(name)
+            else:
+                raise InvalidFields(f"Unknown field '{name}'; choose from {', '.join(self.columns)} "
+                                    f"or the presets {', '.join(self.presets)}")
+        return tuple(dict.fromkeys(fields))
+
+    def variant(self, fields, default):
+        # Tells representations apart in ETags and cache keys; None for the endpoint's default fields
+        default = self.presets[default] if isinstance(default, str) else tuple(default)
+        if fields == default:
+            return None
+        return hashlib.blake2b(','.join(fields).encode(), digest_size=4).hexdigest()
+
+    def column_list(self, fields, alias=None):
+        prefix = f'{alias}.' if alias else ''
+        return ', '.join(prefix + self.columns[field] for field in fields)
+
+    def select(self, fields):
+        return f'SELECT {self.column_list(fields)} FROM {self.table}'
+
+    def builder(self, fields, rename=None):
+        keys = tuple((rename or {}).get(field, field) for field in fields)
+        return lambda row: dict(zip(keys, row))
+
+
+PRODUCT_FIELDS = Projection('products', 'product_id', {
+    'product_id': 'product_id',
+    'product_name': 'product_name',
+    'sku': 'sku',
+    'description': 'description',
+    'price': 'price',
+    'discount_id': 'discount_id',
+    'capacity': 'capacity',
+    'units': 'units',
+    'available_qty': 'available_qty',
+    'featured': 'featured',
+    'is_active': 'is_active',
+    'vendor_id': 'vendor_id',
+    'image_urls': 'image_urls',
+    'tags': 'tags',
+    'updated_at': 'updated_at',
+}, presets={
+    'card': ('product_id', 'product_name', 'price'),
+    'list': ('product_id', 'product_name', 'description', 'price', 'image_urls'),
+    'detail': ('product_id', 'product_name', 'sku', 'description', 'price', 'discount_id', 'capacity', 'units',
+               'available_qty', 'featured', 'image_urls', 'tags'),
+})
+
+# Never password
+CUSTOMER_FIELDS = Projection('Customer', 'customer_id', {
+    'customer_id': 'customer_id',
+    'customer_fname': 'customer_fname',
+    'customer_lname': 'customer_lname',
+    'email': 'email',
+    'phone_number': 'phone_number',
+    'address': 'address',
+    'points_balance': 'points_balance',
+    'points_redeemed': 'points_redeemed',
+    'updated_at': 'updated_at',
+}, presets={
+    'card': ('customer_id', 'customer_fname', 'customer_lname'),
+    'detail': ('customer_id', 'customer_fname', 'customer_lname', 'email', 'phone_number', 'address',
+               'points_balance', 'points_redeemed'),
+})
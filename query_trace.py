@@ -0,0 +1,220 @@
+import logging
+import queue
+import re
+import threading
+import time
+
+from statements import STATEMENTS, plain_sql
+
+# Literals are replaced with ? so nothing a client sent ends up in the report; runs of placeholders such as
+# IN (...) lists and multi-row VALUES collapse so statements that differ only in arity share one entry.
+_STRING = re.compile(r"(?:[EeBbXxNn]|[Uu]&)?'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w$.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+')
+_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_ROWS = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_SPACE = re.compile(r'\s+')
+_EXECUTE = re.compile(r'^\s*EXECUTE\s+(\w+)', re.IGNORECASE)
+_WRITE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+_FINGERPRINT_CACHE_SIZE = 4096
+
+
+def redact_sql(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _LIST.sub('?', sql)
+    sql = _ROWS.sub('(?)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def explain_target(sql):
+    # The statement to explain for a traced one, and whether it is safe to run it again with ANALYZE
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    match = _EXECUTE.match(sql)
+    if match:
+        if match.group(1) not in STATEMENTS:
+            return None, False
+        sql = plain_sql(match.group(1))
+    keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    if keyword == 'SELECT' or (keyword == 'WITH' and not _WRITE.search(sql)):
+        return sql, True
+    if keyword in ('INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        return sql, False
+    return None, False
+
+
+class QueryStats:
+    __slots__ = ('sql', 'calls', 'total_time', 'max_time', 'rows', 'slow_calls', 'plan', 'plan_analyzed',
+                 'plan_at')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.slow_calls = 0
+        self.plan = None
+        self.plan_analyzed = False
+        self.plan_at = None
+
+    def as_dict(self, endpoint):
+        return {
+            'endpoint': endpoint,
+            'sql': self.sql,
+            'calls': self.calls,
+            'total_ms': round(self.total_time * 1000, 3),
+            'mean_ms': round(self.total_time / self.calls * 1000, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_time * 1000, 3),
+            'rows': self.rows,
+            'slow_calls': self.slow_calls,
+            'plan': self.plan,
+            'plan_analyzed': self.plan_analyzed,
+            'plan_at': self.plan_at,
+        }
+
+
+class QueryLog:
+    # Aggregates the statements each request ran by (endpoint, redacted SQL). Statements slower than
+    # slow_threshold are logged, and a background thread captures their plan: EXPLAIN (ANALYZE, BUFFERS) for
+    # reads, plain EXPLAIN for writes so they are not applied twice. Plans are refreshed at most every
+    # explain_interval seconds per statement, and slow statements are dropped rather than queued once
+    # max_pending explains are waiting. At most max_entries statements are tracked; the cheapest go first.
+    def __init__(self, connect, release, slow_threshold=0.2, explain_interval=300, explain_timeout=10,
+                 max_pending=32, max_entries=2000, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.slow_threshold = slow_threshold
+        self.explain_interval = explain_interval
+        self.explain_timeout = explain_timeout
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self._connect = connect
+        self._release = release
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._fingerprints = {}
+        self._explained_at = {}
+        self._pending = queue.SimpleQueue()
+        self._stats = {'explained': 0, 'explain_failures': 0, 'explains_dropped': 0, 'evicted': 0}
+        self._worker = None
+
+    def fingerprint(self, sql):
+        fingerprint = self._fingerprints.get(sql)
+        if fingerprint is None:
+            fingerprint = redact_sql(sql)
+            if len(self._fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            self._fingerprints[sql] = fingerprint
+        return fingerprint
+
+    def record_request(self, endpoint, stats):
+        # metrics request listener: stats.queries holds (sql, vars, seconds, rows) per statement
+        for sql, params, elapsed, rows in stats.queries:
+            self.record(endpoint, sql, params, elapsed, rows)
+
+    def record(self, endpoint, sql, params, elapsed, rows):
+        fingerprint = self.fingerprint(sql)
+        key = (endpoint, fingerprint)
+        slow = elapsed >= self.slow_threshold
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    cheapest = min(self._entries, key=lambda k: self._entries[k].total_time)
+                    del self._entries[cheapest]
+                    self._stats['evicted'] += 1
+                entry = self._entries[key] = QueryStats(fingerprint)
+            entry.calls += 1
+            entry.total_time += elapsed
+            entry.max_time = max(entry.max_time, elapsed)
+            entry.rows += max(rows, 0)
+            if not slow:
+                return
+            entry.slow_calls += 1
+            explained_at = self._explained_at.get(key)
+            due = explained_at is None or time.monotonic() - explained_at >= self.explain_interval
+            if due:
+                if self._pending.qsize() >= self.max_pending:
+                    self._stats['explains_dropped'] += 1
+                    due = False
+                else:
+                    self._explained_at[key] = time.monotonic()
+        self.logger.warning("Slow query on %s: %.1f ms, %s rows: %s", endpoint, elapsed * 1000, rows, fingerprint)
+        if due:
+            self._pending.put((key, sql, params))
+            self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._explain_loop, name='query-explain', daemon=True)
+                self._worker.start()
+
+    def _explain_loop(self):
+        while True:
+            key, sql, params = self._pending.get()
+            try:
+                plan, analyzed = self._explain(sql, params)
+            except Exception as e:
+                self.logger.warning("EXPLAIN failed for %s: %s", key[1], e)
+                with self._lock:
+                    self._stats['explain_failures'] += 1
+                continue
+            if plan is None:
+                continue
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.plan = plan
+                    entry.plan_analyzed = analyzed
+                    entry.plan_at = time.strftime('%Y-%m-%d %H:%M:%S')
+                self._stats['explained'] += 1
+
+    def _explain(self, sql, params):
+        target, analyze = explain_target(sql)
+        if target is None:
+            return None, False
+        # Reads can be explained on a replica; writes are only explained, never run, but need the primary
+        conn = self._connect(readonly=analyze)
+        failed = False
+        try:
+            cur = conn.cursor()
+            cur.execute('SET LOCAL statement_timeout = %s;', (int(self.explain_timeout * 1000),))
+            options = '(ANALYZE, BUFFERS)' if analyze else ''
+            cur.execute(f'EXPLAIN {options} {target}', params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+            # Nothing the explained statement did is kept
+            conn.rollback()
+            return plan, analyze
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(conn, error=failed)
+
+    def top(self, limit=20, endpoint=None, sort='total'):
+        keys = {'total': lambda e: e.total_time, 'max': lambda e: e.max_time,
+                'mean': lambda e: e.total_time / e.calls if e.calls else 0.0, 'calls': lambda e: e.calls}
+        if sort not in keys:
+            raise ValueError(f'sort must be one of {", ".join(keys)}')
+        with self._lock:
+            items = [(k, e) for k, e in self._entries.items() if endpoint is None or k[0] == endpoint]
+            items.sort(key=lambda item: keys[sort](item[1]), reverse=True)
+            return [entry.as_dict(key[0]) for key, entry in items[:limit]]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['statements'] = len(self._entries)
+        stats['pending_explains'] = self._pending.qsize()
+        stats['slow_threshold'] = self.slow_threshold
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._explained_at.clear()
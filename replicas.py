@@ -0,0 +1,113 @@
+import itertools
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+# Seconds the standby is behind the primary. A standby that has replayed everything it received counts as
+# current even when pg_last_xact_replay_timestamp() is old, which is the case whenever the primary is idle,
+# but only while its WAL receiver is streaming: one that lost the primary has replayed all it received and
+# still falls further behind, so it gets NULL. pg_stat_wal_receiver.status is only visible to superusers and
+# members of pg_read_all_stats, which the replica DSN's role therefore needs.
+LAG_SQL = ("SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+           "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+           "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+           "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END;")
+
+
+def describe_dsn(dsn):
+    # host:port/dbname, never the credentials
+    params = parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+
+class Replica:
+    def __init__(self, dsn, pool):
+        self.name = describe_dsn(dsn)
+        self.pool = pool
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self.selected = 0
+
+
+class ReplicaRouter:
+    # Spreads read-only checkouts over the replica pools, round robin or to the pool with the fewest
+    # connections in use. A background thread measures every replica's lag each check_interval seconds;
+    # replicas that are unreachable or more than max_lag seconds behind are skipped until they catch up.
+    # pick() returns None when no replica qualifies and the caller should use the primary.
+    def __init__(self, dsns, make_pool, strategy='round_robin', max_lag=5.0, check_interval=2.0):
+        if strategy not in ('round_robin', 'least_connections'):
+            raise ValueError(f"Unknown replica strategy {strategy!r}")
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [Replica(dsn, make_pool(dsn)) for dsn in dsns]
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._fallbacks = 0
+        if self.replicas:
+            self.check()
+            self._checker = threading.Thread(target=self._check_loop, name='db-replica-lag', daemon=True)
+            self._checker.start()
+
+    def pick(self):
+        with self._lock:
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                self._fallbacks += 1
+                return None
+            if self.strategy == 'least_connections':
+                replica = min(healthy, key=lambda r: r.pool.in_use)
+            else:
+                replica = healthy[next(self._turn) % len(healthy)]
+            replica.selected += 1
+            return replica
+
+    def check(self):
+        for replica in self.replicas:
+            lag = error = None
+            try:
+                conn = replica.pool.getconn(timeout=self.check_interval)
+            except psycopg2.Error as e:
+                error = str(e).strip()
+            else:
+                failed = False
+                try:
+                    cur = conn.cursor()
+                    cur.execute(LAG_SQL)
+                    lag = cur.fetchone()[0]
+                    if lag is None:
+                        error = 'WAL receiver is not streaming'
+                    else:
+                        lag = float(lag)
+                    conn.rollback()
+                except psycopg2.Error as e:
+                    failed = True
+                    error = str(e).strip()
+                finally:
+                    replica.pool.putconn(conn, error=failed)
+            with self._lock:
+                replica.lag = lag
+                replica.error = error
+                replica.healthy = lag is not None and lag <= self.max_lag
+                replica.checked_at = time.time()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            replicas = {replica.name: {'healthy': replica.healthy, 'lag': replica.lag, 'error': replica.error,
+                                       'checked_at': replica.checked_at, 'selected': replica.selected,
+                                       'in_use': replica.pool.in_use}
+                        for replica in self.replicas}
+            return {'strategy': self.strategy, 'max_lag': self.max_lag, 'primary_fallbacks': self._fallbacks,
+                    'replicas': replicas}
@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import json
+from decimal import Decimal
+
+from flask import Response
+
+from catalog_cache import CatalogCache
+from conditional import is_not_modified, not_modified
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(value):
+    # Same representation Flask's provider uses for the numeric columns the catalog returns
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def orjson_dumps(value):
+    return orjson.dumps(value, default=_default, option=orjson.OPT_SORT_KEYS)
+
+
+def stdlib_dumps(value):
+    return json.dumps(value, default=_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def get_encoder(name='auto'):
+    # 'auto' picks orjson when it is installed; either way the output is compact UTF-8 JSON bytes
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ImportError('RESPONSE_JSON_ENCODER is orjson but orjson is not installed')
+        return orjson_dumps
+    if name in ('auto', 'json'):
+        return stdlib_dumps
+    raise ValueError(f'Unknown JSON encoder {name!r}')
+
+
+class EncodedResponse:
+    # A serialized body plus its compressed variants, keyed by Content-Encoding ('identity', 'gzip', 'br'),
+    # and an ETag hashed from the uncompressed body
+    __slots__ = ('variants', 'etag')
+
+    def __init__(self, variants):
+        self.variants = variants
+        self.etag = hashlib.blake2b(variants['identity'], digest_size=12).hexdigest()
+
+    @property
+    def size(self):
+        return sum(len(body) for body in self.variants.values())
+
+
+class ResponseCache(CatalogCache):
+    # Catalog cache whose entries are ready-to-send response bodies. It registers with catalog_cache like the
+    # other caches, so invalidate('products') etc. drop the stale bodies too.
+    def __init__(self, name, encoder='auto', gzip_level=6, brotli_quality=5, min_compress_size=1024, **kwargs):
+        super().__init__(name, **kwargs)
+        self.dumps = get_encoder(encoder)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.min_compress_size = min_compress_size
+
+    def encode(self, value):
+        body = self.dumps(value)
+        variants = {'identity': body}
+        if len(body) >= self.min_compress_size:
+            variants['gzip'] = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+            if brotli is not None:
+                variants['br'] = brotli.compress(body, quality=self.brotli_quality)
+        return EncodedResponse(variants)
+
+    def get_or_build(self, key, loader, tags=()):
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        generation = self.generation
+        entry = self.encode(loader())
+        self.set(key, entry, tags=tags, size=entry.size, generation=generation)
+        return entry
+
+    def respond(self, entry, request, status=200):
+        # Picks the best variant the client accepts; identity is always acceptable for these endpoints
+        if is_not_modified(request, entry.etag):
+            response = not_modified(entry.etag)
+            response.vary.add('Accept-Encoding')
+            return response
+        encoding = 'identity'
+        best = 0
+        for candidate in ('br', 'gzip'):
+            quality = request.accept_encodings.quality(candidate)
+            if candidate in entry.variants and quality > best:
+                encoding, best = candidate, quality
+        response = Response(entry.variants[encoding], status=status, mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(entry.etag, weak=True)
+        return response
@@ -0,0 +1,214 @@
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+_TOKEN_RE = re.compile(r'\w+')
+_STOP_WORDS = frozenset(['a', 'an', 'and', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+# Per-field weights used when scoring a term occurrence
+FIELD_WEIGHTS = {'name': 3.0, 'tags': 2.0, 'description': 1.0}
+# Score multipliers for terms reached by prefix expansion or typo correction rather than exact match
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+MAX_PREFIX_EXPANSIONS = 50
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return [token for token in _TOKEN_RE.findall(text) if token not in _STOP_WORDS]
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    # Levenshtein distance <= 1, plus adjacent transpositions
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if la > lb:
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    def __init__(self, ttl=300, min_fuzzy_length=4):
+        self.ttl = ttl
+        self.min_fuzzy_length = min_fuzzy_length
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self._norms = None
+        self._terms = []
+        self._terms_dirty = False
+        self._delete_index = {}
+
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self.ttl
+
+    def rebuild(self, cur):
+        cur.execute('SELECT product_id, product_name, description, tags FROM products;')
+        self.load(cur.fetchall())
+
+    def load(self, rows):
+        # Built on the side and swapped in, so searches only wait for the swap, not the build
+        fresh = SearchIndex(ttl=self.ttl, min_fuzzy_length=self.min_fuzzy_length)
+        for product_id, name, description, tags in rows:
+            fresh._add(product_id, name, description, tags)
+        terms = sorted(fresh._postings)
+        with self._lock:
+            self._postings = fresh._postings
+            self._doc_terms = fresh._doc_terms
+            self._doc_lengths = fresh._doc_lengths
+            self._total_length = fresh._total_length
+            self._delete_index = fresh._delete_index
+            self._terms = terms
+            self._terms_dirty = False
+            self._norms = None
+            self._built_at = time.monotonic()
+
+    def refresh_product(self, cur, product_id):
+        cur.execute('SELECT product_id, product_name, description, tags FROM products WHERE product_id = %s;',
+                    (product_id,))
+        row = cur.fetchone()
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(product_id)
+            if row is not None:
+                self._add(*row)
+            self._norms = None
+
+    def _add(self, product_id, name, description, tags):
+        if isinstance(tags, (list, tuple)):
+            tags = ' '.join(str(tag) for tag in tags)
+        weights = {}
+        length = 0.0
+        for field, text in (('name', name), ('tags', tags), ('description', description)):
+            tokens = tokenize(text)
+            weight = FIELD_WEIGHTS[field]
+            length += weight * len(tokens)
+            for token in tokens:
+                weights[token] = weights.get(token, 0.0) + weight
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+                for variant in _deletes(term) | {term}:
+                    self._delete_index.setdefault(variant, set()).add(term)
+            postings[product_id] = weight
+        self._doc_terms[product_id] = tuple(weights)
+        self._doc_lengths[product_id] = length
+        self._total_length += length
+
+    def _remove(self, product_id):
+        for term in self._doc_terms.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+                for variant in _deletes(term) | {term}:
+                    terms = self._delete_index.get(variant)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self._delete_index[variant]
+        self._total_length -= self._doc_lengths.pop(product_id, 0.0)
+
+    def _expand(self, token, prefix):
+        # Returns {term: multiplier} for the index terms a query token should match
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        if prefix:
+            if self._terms_dirty:
+                self._terms = sorted(self._postings)
+                self._terms_dirty = False
+            i = bisect_left(self._terms, token)
+            while i < len(self._terms) and len(matches) < MAX_PREFIX_EXPANSIONS and self._terms[i].startswith(token):
+                matches.setdefault(self._terms[i], PREFIX_WEIGHT)
+                i += 1
+        if not matches and len(token) >= self.min_fuzzy_length:
+            candidates = set()
+            for variant in _deletes(token) | {token}:
+                candidates |= self._delete_index.get(variant, set())
+            for term in candidates:
+                if _within_one_edit(token, term):
+                    matches[term] = FUZZY_WEIGHT
+        return matches
+
+    def search(self, query, limit=50):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if not n_docs:
+                return []
+            norms = self._length_norms(n_docs)
+            scores = None
+            for position, token in enumerate(tokens):
+                # The last token is still being typed, so it also matches as a prefix
+                matches = self._expand(token, prefix=position == len(tokens) - 1)
+                token_scores = {}
+                for term, multiplier in matches.items():
+                    postings = self._postings[term]
+                    factor = multiplier * (BM25_K1 + 1) * math.log(
+                        1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    if not token_scores:
+                        token_scores = {pid: factor * tf / (tf + norms[pid]) for pid, tf in postings.items()}
+                        continue
+                    for product_id, tf in postings.items():
+                        score = factor * tf / (tf + norms[product_id])
+                        if score > token_scores.get(product_id, 0.0):
+                            token_scores[product_id] = score
+                # Every query token has to match for a product to be returned
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+                if not scores:
+                    return []
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def _length_norms(self, n_docs):
+        # BM25 length normalisation per document, recomputed only after the index changes
+        if self._norms is None:
+            avg_length = self._total_length / n_docs or 1.0
+            self._norms = {pid: BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                           for pid, length in self._doc_lengths.items()}
+        return self._norms
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._doc_lengths),
+                'terms': len(self._postings),
+                'age': None if self._built_at is None else time.monotonic() - self._built_at
+            }
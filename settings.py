@@ -1,34 +1,297 @@
-import psycopg2
 import logging
+import os
+import threading
+import time
 
+from db_pool import ConnectionPool
+from replicas import ReplicaRouter
+from metrics import InstrumentedCursor
+from log_pipeline import setup_async_handler
 
-def set_connection():
+DB_CONFIG = {
+    'host': "172.16.1.236",
+    'port': "5432",
+    'database': "bctst",
+    'user': "akshith",
+    'password': "akshith"
+}
+
+# DB_PRIMARY_DSN, when set, replaces DB_CONFIG for the primary. DB_REPLICA_DSNS lists read replicas separated
+# by ';' (libpq key=value strings or postgresql:// URIs). GET requests read from a replica picked by
+# REPLICA_STRATEGY ('round_robin' or 'least_connections'); replicas more than REPLICA_MAX_LAG seconds behind,
+# measured every REPLICA_LAG_CHECK_INTERVAL seconds, are skipped. After a client writes, its reads stay on the
+# primary for READ_YOUR_WRITES_SECONDS via the READ_PIN_COOKIE cookie.
+DB_PRIMARY_DSN = os.environ.get('DB_PRIMARY_DSN')
+DB_REPLICA_DSNS = [dsn.strip() for dsn in os.environ.get('DB_REPLICA_DSNS', '').split(';') if dsn.strip()]
+REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round_robin')
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+REPLICA_LAG_CHECK_INTERVAL = 2
+READ_YOUR_WRITES_SECONDS = 10
+READ_PIN_COOKIE = 'db_read_pin'
+
+# Connection pool sizing; connections idle for longer than POOL_MAX_IDLE seconds are
+# closed down to POOL_MIN_SIZE, and checkouts give up after POOL_TIMEOUT seconds.
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 20
+POOL_TIMEOUT = 5
+POOL_MAX_IDLE = 300
+POOL_HEALTH_CHECK_AFTER = 30
+
+# In-process cache for catalog reads (products, categories, filters)
+CATALOG_CACHE_TTL = 300
+CATALOG_CACHE_MAX_ENTRIES = 512
+CATALOG_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# With CATALOG_SNAPSHOT_PATH set, products, categories and filters are served from a memory-mapped snapshot
+# file shared by all worker processes (put it on tmpfs, e.g. /dev/shm). Catalog writes republish it in the
+# background; workers look for a newer file at most every CATALOG_SNAPSHOT_CHECK_INTERVAL seconds.
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+CATALOG_SNAPSHOT_CHECK_INTERVAL = 1.0
+
+# Serialized (and gzip/brotli compressed) bodies of get_products, get_featured_products and get_categories.
+# RESPONSE_JSON_ENCODER is 'auto' (orjson when installed), 'orjson' or 'json'; bodies smaller than
+# RESPONSE_COMPRESS_MIN_SIZE bytes are only kept uncompressed.
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESPONSE_JSON_ENCODER = 'auto'
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5
+RESPONSE_COMPRESS_MIN_SIZE = 1024
+
+# Keyset pagination for list endpoints; streamed responses read STREAM_FETCH_SIZE rows at a time
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_FETCH_SIZE = 2000
+
+# The facet index behind filter_products is rebuilt from the database after this many seconds;
+# writes made by this process update it in place in between.
+FACET_INDEX_TTL = 300
+
+# Product search index (same refresh rules as the facet index) and the most results search_products returns
+SEARCH_INDEX_TTL = 300
+SEARCH_RESULT_LIMIT = 50
+
+# The in-memory category hierarchy is reloaded after this many seconds; local category writes update it in place
+CATEGORY_TREE_TTL = 300
+
+# Password hashing runs on a process pool. The method string carries the werkzeug algorithm and cost,
+# e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'. Beyond PASSWORD_HASH_MAX_PENDING queued or running
+# hashes, signups wait PASSWORD_HASH_QUEUE_TIMEOUT seconds for a slot and then get a 503.
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+PASSWORD_HASH_SALT_LENGTH = 16
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 32
+PASSWORD_HASH_QUEUE_TIMEOUT = 0.5
+PASSWORD_HASH_TIMEOUT = 10
+
+# Cache-Control sent with successful GET responses, by endpoint. Every GET listed here also answers
+# If-None-Match / If-Modified-Since with 304 when its validators match.
+CACHE_CONTROL = {
+    'get_products': 'public, max-age=60',
+    'get_featured_products': 'public, max-age=60',
+    'get_product': 'public, max-age=60',
+    'get_categories': 'public, max-age=300',
+    'get_category': 'public, max-age=300',
+    'get_customers': 'private, no-cache',
+    'get_customer': 'private, no-cache',
+}
+
+# Stock reservations are held for RESERVATION_HOLD_SECONDS unless confirmed or released. Reserve/confirm/release
+# calls for one product are applied together; a batch waits RESERVATION_BATCH_WINDOW seconds for company and
+# takes at most RESERVATION_MAX_BATCH calls.
+RESERVATION_HOLD_SECONDS = 900
+RESERVATION_BATCH_WINDOW = 0.002
+RESERVATION_MAX_BATCH = 500
+
+# Statements slower than SLOW_QUERY_THRESHOLD seconds are logged and get their plan captured in the background:
+# EXPLAIN (ANALYZE, BUFFERS) for reads, plain EXPLAIN for writes. A statement is re-explained at most every
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds; each EXPLAIN may run for SLOW_QUERY_EXPLAIN_TIMEOUT seconds.
+SLOW_QUERY_THRESHOLD = 0.2
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+SLOW_QUERY_EXPLAIN_TIMEOUT = 10
+SLOW_QUERY_MAX_PENDING = 32
+QUERY_LOG_MAX_ENTRIES = 2000
+
+# Admission control: requests take a slot under a shared concurrency limit before their handler runs. The limit
+# starts at ADMISSION_INITIAL_LIMIT and moves within ADMISSION_MIN_LIMIT..ADMISSION_MAX_LIMIT: it is cut when more
+# than a tenth of the requests finishing in an ADMISSION_ADJUST_INTERVAL window were slower than their class's
+# target_latency, and raised by one when requests queued without that happening. A class fills at most `share` of
+# the limit and queues up to max_queue requests for max_queue_time seconds before answering 503 + Retry-After;
+# freed slots go to the lowest `priority` first. Endpoints not in ADMISSION_ROUTES are 'normal';
+# ADMISSION_ROUTE_LIMITS caps single endpoints and ADMISSION_EXEMPT endpoints are never queued.
+ADMISSION_ENABLED = True
+ADMISSION_INITIAL_LIMIT = POOL_MAX_SIZE
+ADMISSION_MIN_LIMIT = 4
+ADMISSION_MAX_LIMIT = 64
+ADMISSION_ADJUST_INTERVAL = 0.5
+ADMISSION_CLASSES = {
+    'critical': {'priority': 0, 'share': 1.0, 'max_queue': 200, 'max_queue_time': 1.0, 'target_latency': 0.25},
+    'normal': {'priority': 1, 'share': 0.8, 'max_queue': 100, 'max_queue_time': 0.5, 'target_latency': 0.5},
+    'low': {'priority': 2, 'share': 0.5, 'max_queue': 20, 'max_queue_time': 1.0, 'target_latency': 5.0},
+}
+ADMISSION_ROUTES = {
+    'get_products': 'critical',
+    'get_product': 'critical',
+    'get_featured_products': 'critical',
+    'get_category_products': 'critical',
+    'filter_products': 'critical',
+    'get_categories': 'critical',
+    'get_category': 'critical',
+    'get_category_tree': 'critical',
+    'get_breadcrumbs': 'critical',
+    'get_filters': 'critical',
+    'get_filter': 'critical',
+    'search_products': 'low',
+    'bulk_import_products': 'low',
+    'bulk_update_filters': 'low',
+}
+ADMISSION_ROUTE_LIMITS = {
+    'search_products': 8,
+    'bulk_import_products': 2,
+    'bulk_update_filters': 2,
+}
+ADMISSION_EXEMPT = {'static', 'get_metrics', 'get_pool_stats', 'get_replica_stats', 'get_snapshot_stats',
+                    'get_top_queries', 'get_cache_stats', 'get_inventory_stats', 'get_admission_stats'}
+
+# Most sub-requests accepted by one /app/v1/batch call
+BATCH_MAX_REQUESTS = 100
+
+# Rows staged and upserted per COPY batch by the bulk product import
+BULK_IMPORT_BATCH_SIZE = 5000
+
+# Logging: with LOG_ASYNC the request path only enqueues records and a background thread writes them
+# in batches to a size-rotated file. LOG_ENDPOINT_LEVELS raises the level for noisy endpoints, e.g.
+# {'get_products': logging.INFO}, and LOG_SAMPLE_RATES keeps a fraction of their sub-WARNING records,
+# e.g. {'search_products': 0.1}.
+LOG_ASYNC = True
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 0.5
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_ENDPOINT_LEVELS = {}
+LOG_SAMPLE_RATES = {}
+
+_pool = None
+_pool_lock = threading.Lock()
+_router = None
+_router_lock = threading.Lock()
+
+
+def _make_pool(dsn=None):
+    connect_kwargs = {'dsn': dsn} if dsn else dict(DB_CONFIG)
+    connect_kwargs['cursor_factory'] = InstrumentedCursor
+    return ConnectionPool(connect_kwargs, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                          max_idle=POOL_MAX_IDLE, health_check_after=POOL_HEALTH_CHECK_AFTER)
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _make_pool(DB_PRIMARY_DSN)
+    return _pool
+
+
+def get_replica_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ReplicaRouter(DB_REPLICA_DSNS, _make_pool, strategy=REPLICA_STRATEGY,
+                                    max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_LAG_CHECK_INTERVAL)
+    return _router
+
+
+def checkout_connection(readonly=False):
+    # Untracked checkout; the caller must hand the connection back with release_connection.
+    # Read-only checkouts go to a current replica when there is one.
+    if readonly and DB_REPLICA_DSNS:
+        replica = get_replica_router().pick()
+        if replica is not None:
+            return replica.pool.getconn()
+    return get_pool().getconn()
+
+
+def release_connection(conn, error=False):
+    (getattr(conn, 'pool', None) or get_pool()).putconn(conn, error=error)
+
+
+def mark_read_only():
+    # For routes that only read but are not GETs, e.g. the POSTed batch lookup
+    from flask import g
+    g._db_read_only = True
+
+
+def prefers_replica():
+    # GET and HEAD requests read from replicas unless the client wrote recently (read-your-writes)
+    from flask import g, request, has_request_context
+    if not DB_REPLICA_DSNS or not has_request_context():
+        return False
+    if request.method not in ('GET', 'HEAD') and not g.get('_db_read_only'):
+        return False
     try:
-        conn = psycopg2.connect(
-            host="172.16.1.236",
-            port="5432",
-            database="bctst",
-            user="akshith",
-            password="akshith"
-        )
-        cur = conn.cursor()
-        print("database connected")
-        return cur, conn
-    except (Exception, psycopg2.Error) as error:
-        print("Failed connected due to: ", error)
-        return None, None
-
-
-def setup_logger(logger_name, log_file, level=logging.DEBUG):
+        pinned_until = float(request.cookies.get(READ_PIN_COOKIE, 0))
+    except ValueError:
+        pinned_until = 0
+    return pinned_until < time.time()
+
+
+def pin_reads_to_primary(response):
+    # after_request hook: a successful write keeps this client's reads on the primary for a while
+    from flask import g, request
+    if DB_REPLICA_DSNS and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400 \
+            and not g.get('_db_read_only'):
+        response.set_cookie(READ_PIN_COOKIE, str(time.time() + READ_YOUR_WRITES_SECONDS),
+                            max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+def set_connection(readonly=None):
+    # Raises when no connection can be had (PoolTimeout when the pool stays exhausted); the app answers 503
+    if readonly is None:
+        readonly = prefers_replica()
+    conn = checkout_connection(readonly=readonly)
+    cur = conn.cursor()
+    _track_connection(conn)
+    return cur, conn
+
+
+def _track_connection(conn):
+    # Connections handed out during a request are returned to the pool when it ends
+    from flask import g, has_app_context
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(conn)
+
+
+def release_connections(error=False):
+    from flask import g, has_app_context
+    if not has_app_context():
+        return
+    connections = g.pop('_db_connections', [])
+    for conn in connections:
+        release_connection(conn, error=error)
+
+
+def setup_logger(logger_name, log_file, level=logging.DEBUG, async_mode=None):
     logger = logging.getLogger(logger_name)
     logger.setLevel(level)
+    if async_mode is None:
+        async_mode = LOG_ASYNC
+
+    # Create a logging format
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if async_mode:
+        # Request threads only enqueue; a background thread formats, batches and writes with rotation
+        setup_async_handler(logger, log_file, level, formatter, max_bytes=LOG_MAX_BYTES,
+                            backup_count=LOG_BACKUP_COUNT, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                            flush_interval=LOG_FLUSH_INTERVAL, endpoint_levels=LOG_ENDPOINT_LEVELS,
+                            sample_rates=LOG_SAMPLE_RATES)
+        return logger
 
     # Create a file handler to store logs
     handler = logging.FileHandler(log_file)
     handler.setLevel(level)
-
-    # Create a logging format
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
 
     # Add the file handler to the logger
@@ -0,0 +1,62 @@
+import re
+
+import psycopg2
+
+# Filters joined with their options, shared by load_filters, the batch endpoint, the async app and the
+# statements below. Queries using it group by f.filter_id, c.category_name.
+FILTER_COLUMNS = ("f.filter_id, f.filter_name, f.category_id, c.category_name, f.filter_type, "
+                  "COALESCE(json_agg(json_build_object('option_id', fo.option_id, 'option_value', fo.option_value) "
+                  "ORDER BY fo.option_id) FILTER (WHERE fo.option_id IS NOT NULL), '[]')")
+FILTER_JOINS = ("LEFT JOIN Category c ON c.category_id = f.category_id "
+                "LEFT JOIN FilterOption fo ON fo.filter_id = f.filter_id ")
+FILTER_SELECT = f"SELECT {FILTER_COLUMNS} FROM Filter f {FILTER_JOINS}"
+
+# Hot statements, prepared once per connection and then executed by name. Parameters use $n placeholders.
+STATEMENTS = {
+    'product_by_id': 'SELECT product_id, product_name, description, price, image_urls, updated_at FROM products '
+                     'WHERE product_id = $1',
+    'product_updated_at': 'SELECT updated_at FROM products WHERE product_id = $1',
+    'live_category_id_by_name': 'SELECT category_id FROM Category WHERE category_name = $1 AND deleted_at IS NULL',
+    'live_category_version_by_name': 'SELECT category_id, updated_at FROM Category '
+                                     'WHERE category_name = $1 AND deleted_at IS NULL',
+    'live_category_by_id': 'SELECT category_id, category_name, description, parent_category_id FROM Category '
+                           'WHERE category_id = $1 AND deleted_at IS NULL',
+    'filter_with_options': FILTER_SELECT + 'WHERE f.filter_id = $1 GROUP BY f.filter_id, c.category_name',
+    'filter_options_by_filter': 'SELECT option_id, option_value FROM FilterOption WHERE filter_id = $1',
+    'customer_by_id': 'SELECT customer_id, customer_fname, customer_lname, email, phone_number, address, '
+                      'points_balance, points_redeemed, updated_at FROM Customer WHERE customer_id = $1',
+    'customer_updated_at': 'SELECT updated_at FROM Customer WHERE customer_id = $1',
+    'customer_id_by_email': 'SELECT customer_id FROM Customer WHERE email = $1',
+    'other_customer_id_by_email': 'SELECT customer_id FROM Customer WHERE email = $1 AND customer_id != $2',
+}
+
+_PLACEHOLDER = re.compile(r'\$(\d+)')
+_param_counts = {name: len(set(_PLACEHOLDER.findall(sql))) for name, sql in STATEMENTS.items()}
+
+
+def plain_sql(name):
+    # The same statement with psycopg2 placeholders, for connections that cannot track prepared names
+    sql = STATEMENTS[name].replace('%', '%%')
+    return _PLACEHOLDER.sub('%s', sql)
+
+
+def execute_prepared(cur, name, params=()):
+    conn = cur.connection
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None:
+        cur.execute(plain_sql(name), params)
+        return
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {STATEMENTS[name]};')
+        prepared.add(name)
+    count = _param_counts[name]
+    try:
+        if count:
+            cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * count)});', params)
+        else:
+            cur.execute(f'EXECUTE {name};')
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The session lost its prepared statements (DISCARD ALL, a pooler in between);
+        # the failed transaction is rolled back by the caller and the next use prepares again
+        prepared.clear()
+        raise
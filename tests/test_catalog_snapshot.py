@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def snapshot(app_module):
+    manager = app_module.catalog_snapshot
+    manager.check_interval = 0
+    deadline = time.monotonic() + 30
+    while manager.current() is None:
+        if time.monotonic() > deadline:
+            pytest.fail('catalog snapshot was never built')
+        time.sleep(0.05)
+    return manager
+
+
+def create_product(client, sku):
+    response = client.post('/app/v1/products/create_product', json={'product_name': f'product {sku}', 'sku': sku})
+    assert response.status_code == 201
+    return response.get_json()['product_id']
+
+
+def products_after(client, product_id):
+    response = client.get('/app/v1/products/get_products', query_string={'after': product_id - 1, 'limit': 1})
+    assert response.status_code == 200
+    return [product['product_id'] for product in response.get_json()['products']]
+
+
+def test_read_after_write_sees_the_write(client, snapshot, unique):
+    for attempt in range(3):
+        product_id = create_product(client, f'{unique}-{attempt}')
+        # Straight after the write, before the background rebuild has published a new file
+        assert products_after(client, product_id) == [product_id]
+
+
+def test_cached_page_is_refreshed_by_a_write(client, snapshot, unique):
+    product_id = create_product(client, f'{unique}-a')
+    next_id = product_id + 1
+    assert products_after(client, next_id) == []
+    assert create_product(client, f'{unique}-b') == next_id
+    assert products_after(client, next_id) == [next_id]
+
+
+def test_snapshot_is_served_again_once_rebuilt(client, snapshot, unique):
+    product_id = create_product(client, unique)
+    assert snapshot.current() is None or snapshot.current().product(product_id) is not None
+    deadline = time.monotonic() + 30
+    while snapshot.current() is None:
+        if time.monotonic() > deadline:
+            pytest.fail('catalog snapshot was not rebuilt after the write')
+        time.sleep(0.05)
+    assert snapshot.current().product(product_id) is not None
+    assert products_after(client, product_id) == [product_id]
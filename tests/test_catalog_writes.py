@@ -0,0 +1,47 @@
+def create_category(client, name, description='first'):
+    return client.post('/app/v1/categories/create_category', json={'name': name, 'description': description})
+
+
+def get_category(client, name):
+    return client.get('/app/v1/categories/get_category', json={'category_name': name})
+
+
+def test_duplicate_category_is_a_conflict(client, unique):
+    assert create_category(client, unique).status_code == 201
+    response = create_category(client, unique)
+    assert response.status_code == 409
+    assert response.get_json() == {'error': f'Category {unique} already exists'}
+
+
+def test_recreated_category_is_the_one_updated_and_deleted(client, unique):
+    assert create_category(client, unique).status_code == 201
+    response = client.delete('/app/v1/categories/delete_category', json={'category_name': unique})
+    assert response.status_code == 204
+    response = create_category(client, unique, 'second')
+    assert response.status_code == 201
+    category_id = response.get_json()['category_id']
+
+    response = client.put('/app/v1/categories/update_category',
+                          json={'category_name': unique, 'description': 'third'})
+    assert response.status_code == 200
+    category = get_category(client, unique).get_json()
+    assert (category['category_id'], category['description']) == (category_id, 'third')
+
+    response = client.delete('/app/v1/categories/delete_category', json={'category_name': unique})
+    assert response.status_code == 204
+    assert get_category(client, unique).status_code == 404
+
+
+def test_duplicate_sku_is_a_conflict(client, unique):
+    product = {'product_name': 'first', 'sku': unique}
+    assert client.post('/app/v1/products/create_product', json=product).status_code == 201
+    response = client.post('/app/v1/products/create_product', json=product)
+    assert response.status_code == 409
+    assert response.get_json() == {'error': f'Product with sku {unique} already exists'}
+
+    response = client.post('/app/v1/products/create_product', json={'product_name': 'second', 'sku': f'{unique}-2'})
+    assert response.status_code == 201
+    response = client.put('/app/v1/products/update_product',
+                          json={'product_id': response.get_json()['product_id'], 'product_name': 'second',
+                                'sku': unique})
+    assert response.status_code == 409